@@ -150,6 +150,8 @@ eps = mlc.FieldReference(1e-8, field_type=float)
 templates_enabled = mlc.FieldReference(True, field_type=bool)
 embed_template_torsion_angles = mlc.FieldReference(True, field_type=bool)
 tune_chunk_size = mlc.FieldReference(True, field_type=bool)
+chunk_plan_path = mlc.FieldReference(None, field_type=str)
+chunk_memory_budget = mlc.FieldReference(None, field_type=float)
 
 NUM_RES = "num residues placeholder"
 NUM_MSA_SEQ = "msa placeholder"
@@ -309,6 +311,12 @@ config = mlc.ConfigDict(
             },
             "data_module": {
                 "use_small_bfd": False,
+                # Size in GiB of the cache of parsed template structures of
+                # each DataLoader worker. None disables it
+                "template_cache_size": None,
+                # Directory shared by the workers, e.g. under /dev/shm, where
+                # the parsed structures are also cached
+                "template_cache_dir": None,
                 "data_loaders": {
                     "batch_size": 1,
                     "num_workers": 0,
@@ -321,6 +329,18 @@ config = mlc.ConfigDict(
             "chunk_size": chunk_size,
             "use_lma": False,
             "offload_inference": False,
+            # If set, offloaded activations are spilled to this directory,
+            # e.g. on a node-local SSD, instead of being kept on the CPU
+            "offload_dir": None,
+            # If set, the pair embedding of the Evoformer and extra MSA
+            # stacks is kept in a memory-mapped file under offload_dir,
+            # and their pair stacks run by tiles of this many rows, so that
+            # N_res isn't bounded by memory. Ignored if offload_inference
+            "stream_tile_size": None,
+            # Whether to split the stacks among the ranks of the default
+            # process group at inference time (see openfold/utils/dap.py).
+            # Takes precedence over stream_tile_size
+            "dap": False,
             "c_z": c_z,
             "c_m": c_m,
             "c_t": c_t,
@@ -328,6 +348,12 @@ config = mlc.ConfigDict(
             "c_s": c_s,
             "eps": eps,
             "recompute_attention": False,
+            "flash_attention": False,
+            # If set, the Evoformer and extra MSA stacks tune the chunk size
+            # of each module by wall time and save the plans to this file
+            "chunk_plan_path": chunk_plan_path,
+            # Maximum activation memory of a chunked module in GiB
+            "chunk_memory_budget": chunk_memory_budget,
         },
         "model": {
             "_mask_trans": False,
@@ -420,6 +446,8 @@ config = mlc.ConfigDict(
                     "pair_dropout": 0.25,
                     "clear_cache_between_blocks": False,
                     "tune_chunk_size": tune_chunk_size,
+                    "chunk_plan_path": chunk_plan_path,
+                    "chunk_memory_budget": chunk_memory_budget,
                     "inf": 1e9,
                     "eps": eps,  # 1e-10,
                     "ckpt": blocks_per_ckpt is not None,
@@ -443,6 +471,8 @@ config = mlc.ConfigDict(
                 "blocks_per_ckpt": blocks_per_ckpt,
                 "clear_cache_between_blocks": False,
                 "tune_chunk_size": tune_chunk_size,
+                "chunk_plan_path": chunk_plan_path,
+                "chunk_memory_budget": chunk_memory_budget,
                 "inf": 1e9,
                 "eps": eps,  # 1e-10,
                 "save_activation_to_file": False,
@@ -0,0 +1,184 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A pre-parsed store of the alignments of many chains, in place of a directory
+of per-chain directories of .a3m, .sto and .hhr files. The MSAs are kept as
+arrays of HHblits residue IDs and deletion counts, as returned by
+parsers.parse_a3m_arrays, and the template hits as parsed TemplateHits, so
+that nothing is parsed again when the chains are read.
+
+The store is a record store (see record_store.py) with one record per chain,
+named after its directory. Shards are written independently by
+write_alignment_shard, e.g. by the ranks of an MPI job, and indexed by
+finalize_alignment_store. See scripts/build_alignment_store.py.
+"""
+import multiprocessing
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from openfold.data import parsers, record_store
+
+
+_KIND = "alignments"
+
+
+def is_alignment_store(path: str) -> bool:
+    """Returns whether path is a complete alignment store."""
+    return record_store.is_record_store(path, _KIND)
+
+
+def read_alignment_dir(alignment_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Parses the alignments of a chain, in the order DataPipeline reads them.
+
+    Returns:
+        A dict with the "msas" of the chain, mapping file names to dicts of
+        its "msa" and "deletion_matrix" arrays, and its template "hits",
+        mapping file names to lists of TemplateHits
+    """
+    record = {"msas": {}, "hits": {}}
+    for dirpath, dirs, files in os.walk(alignment_dir):
+        for f in files:
+            path = os.path.join(dirpath, f)
+            ext = os.path.splitext(f)[-1]
+
+            if(ext == ".a3m"):
+                with open(path, "rb") as fp:
+                    msa, deletion_matrix = parsers.parse_a3m_arrays(fp.read())
+            elif(ext == ".sto"):
+                with open(path, "rb") as fp:
+                    msa, deletion_matrix, _ = parsers.parse_stockholm_arrays(
+                        fp.read()
+                    )
+            elif(ext == ".hhr"):
+                with open(path, "r") as fp:
+                    record["hits"][f] = parsers.parse_hhr(fp.read())
+                continue
+            else:
+                continue
+
+            record["msas"][f] = {
+                "msa": msa, "deletion_matrix": deletion_matrix
+            }
+
+    return record
+
+
+def write_alignment_shard(
+    alignment_dir: str,
+    names: Sequence[str],
+    store_dir: str,
+    shard: int,
+):
+    """
+    Writes a shard of an alignment store. Shards already written are
+    skipped, so that an interrupted build can be resumed.
+
+    Args:
+        alignment_dir:
+            Directory of per-chain alignment directories
+        names:
+            Names of the chain directories of the shard
+        store_dir:
+            Directory of the store
+        shard:
+            Index of the shard
+    """
+    records = (
+        (name, read_alignment_dir(os.path.join(alignment_dir, name)))
+        for name in names
+    )
+    record_store.write_shard(records, store_dir, shard)
+
+
+def finalize_alignment_store(store_dir: str, num_shards: int):
+    """Indexes the shards written by write_alignment_shard."""
+    record_store.finalize_store(store_dir, num_shards, _KIND)
+
+
+def build_alignment_store(
+    alignment_dir: str,
+    store_dir: str,
+    num_workers: int = 1,
+    names: Optional[Sequence[str]] = None,
+):
+    """
+    Builds an alignment store from a directory of per-chain alignment
+    directories, with one shard per worker process.
+
+    Args:
+        alignment_dir:
+            Directory of per-chain alignment directories
+        store_dir:
+            Output directory
+        num_workers:
+            Number of processes parsing the alignments
+        names:
+            Names of the chain directories to store. Defaults to all
+    """
+    if names is None:
+        names = sorted(
+            d for d in os.listdir(alignment_dir)
+            if os.path.isdir(os.path.join(alignment_dir, d))
+        )
+
+    num_shards = max(num_workers, 1)
+    jobs = [
+        (alignment_dir, names[shard::num_shards], store_dir, shard)
+        for shard in range(num_shards)
+    ]
+    if num_workers > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            pool.starmap(write_alignment_shard, jobs)
+    else:
+        for job in jobs:
+            write_alignment_shard(*job)
+
+    finalize_alignment_store(store_dir, num_shards)
+
+
+class AlignmentStore(record_store.RecordStore):
+    """A memory-mapped store written by build_alignment_store."""
+
+    def __init__(self, store_dir: str):
+        super().__init__(store_dir)
+        self._last = None
+
+    def chain_ids(self) -> List[str]:
+        """Returns the names of all chains, sorted."""
+        return self.names()
+
+    def _record(self, name: str) -> Dict[str, Dict[str, Any]]:
+        # The MSAs and hits of a chain are read one after the other
+        if self._last is None or self._last[0] != name:
+            self._last = (name, self.load(name))
+
+        return self._last[1]
+
+    def msa_data(self, name: str) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        Returns the MSAs of a chain as DataPipeline._parse_msa_data, by file
+        name.
+        """
+        return dict(self._record(name)["msas"])
+
+    def template_hits(self, name: str) -> Dict[str, List[parsers.TemplateHit]]:
+        """
+        Returns the template hits of a chain as
+        DataPipeline._parse_template_hits, by file name.
+        """
+        return dict(self._record(name)["hits"])
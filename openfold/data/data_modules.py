@@ -20,6 +20,8 @@ from openfold.data import (
     mmcif_parsing,
     templates,
 )
+from openfold.data.alignment_store import AlignmentStore, is_alignment_store
+from openfold.data.structure_cache import StructureCache
 from openfold.utils.tensor_utils import tensor_tree_map, dict_multimap
 from openfold.data.tools.utils import load_cif
 
@@ -39,6 +41,7 @@ class OpenFoldSingleDataset(torch.utils.data.Dataset):
         treat_pdb_as_distillation: bool = True,
         mapping_path: Optional[str] = None,
         mode: str = "train", 
+        structure_cache: Optional[StructureCache] = None,
         _output_raw: bool = False,
         _structure_index: Optional[Any] = None,
         _alignment_index: Optional[Any] = None,
@@ -54,7 +57,8 @@ class OpenFoldSingleDataset(torch.utils.data.Dataset):
                     (defined in openfold.features.alignment_runner).
                     I.e. a directory of directories named {PDB_ID}_{CHAIN_ID}
                     or simply {PDB_ID}, each containing .a3m, .sto, and .hhr
-                    files.
+                    files, or an alignment store of such directories built
+                    by scripts/build_alignment_store.py.
                 template_mmcif_dir:
                     Path to a directory containing template mmCIF files.
                 config:
@@ -80,6 +84,9 @@ class OpenFoldSingleDataset(torch.utils.data.Dataset):
                     special distillation set preprocessing steps).
                 mode:
                     "train", "val", or "predict"
+                structure_cache:
+                    An optional cache of the parsed template structures, which
+                    may be shared with other datasets.
         """
         super(OpenFoldSingleDataset, self).__init__()
         self.data_dir = data_dir
@@ -103,8 +110,14 @@ class OpenFoldSingleDataset(torch.utils.data.Dataset):
                 "scripts/generate_mmcif_cache.py before running OpenFold"
             )
 
+        alignment_store = None
+        if(is_alignment_store(alignment_dir)):
+            alignment_store = AlignmentStore(alignment_dir)
+
         if(_alignment_index is not None):
             self._chain_ids = list(_alignment_index.keys())
+        elif(mapping_path is None and alignment_store is not None):
+            self._chain_ids = alignment_store.chain_ids()
         elif(mapping_path is None):
             self._chain_ids = list(os.listdir(alignment_dir))
         else:
@@ -123,10 +136,12 @@ class OpenFoldSingleDataset(torch.utils.data.Dataset):
             release_dates_path=template_release_dates_cache_path,
             obsolete_pdbs_path=obsolete_pdbs_file_path,
             _shuffle_top_k_prefiltered=shuffle_top_k_prefiltered,
+            structure_cache=structure_cache,
         )
 
         self.data_pipeline = data_pipeline.DataPipeline(
             template_featurizer=template_featurizer,
+            alignment_store=alignment_store,
         )
 
         if(not self._output_raw):
@@ -571,6 +586,15 @@ class OpenFoldDataModule(pl.LightningDataModule):
                 self._distillation_alignment_index = json.load(fp)
 
     def setup(self):
+        # Templates recur across the datasets
+        structure_cache = None
+        data_module_config = self.config.data_module
+        if(data_module_config.template_cache_size is not None):
+            structure_cache = StructureCache(
+                int(data_module_config.template_cache_size * (1 << 30)),
+                shared_dir=data_module_config.template_cache_dir,
+            )
+
         # Most of the arguments are the same for the three datasets 
         dataset_gen = partial(OpenFoldSingleDataset,
             template_mmcif_dir=self.template_mmcif_dir,
@@ -581,6 +605,7 @@ class OpenFoldDataModule(pl.LightningDataModule):
                 self.template_release_dates_cache_path,
             obsolete_pdbs_file_path=
                 self.obsolete_pdbs_file_path,
+            structure_cache=structure_cache,
         )
 
         if(self.training_mode):
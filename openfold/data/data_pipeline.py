@@ -16,8 +16,10 @@
 
 import os
 import datetime
+from functools import partial
 from multiprocessing import cpu_count
-from typing import Mapping, Optional, Sequence, Any
+import shutil
+from typing import Callable, Mapping, Optional, Sequence, Any, Union
 from pathlib import Path
 import resource
 import logging
@@ -25,6 +27,7 @@ import logging
 import numpy as np
 
 from openfold.data import templates, parsers, mmcif_parsing
+from openfold.data.alignment_store import AlignmentStore
 from openfold.data.tools import jackhmmer, hhblits, hhsearch
 from openfold.data.tools.utils import to_date 
 from openfold.np import residue_constants, protein
@@ -230,35 +233,50 @@ def make_pdb_features(
 
 
 def make_msa_features(
-    msas: Sequence[Sequence[str]],
-    deletion_matrices: Sequence[parsers.DeletionMatrix],
+    msas: Sequence[Union[Sequence[str], np.ndarray]],
+    deletion_matrices: Sequence[Union[parsers.DeletionMatrix, np.ndarray]],
 ) -> FeatureDict:
-    """Constructs a feature dict of MSA features."""
+    """Constructs a feature dict of MSA features.
+
+    The MSAs are lists of aligned sequences, or arrays of residue IDs as
+    returned by parsers.parse_a3m_arrays and parsers.parse_stockholm_arrays.
+    """
     if not msas:
         raise ValueError("At least one MSA must be provided.")
 
-    int_msa = []
-    deletion_matrix = []
-    seen_sequences = set()
+    int_msas = []
     for msa_index, msa in enumerate(msas):
-        if not msa:
+        if len(msa) == 0:
             raise ValueError(
                 f"MSA {msa_index} must contain at least one sequence."
             )
-        for sequence_index, sequence in enumerate(msa):
-            if sequence in seen_sequences:
-                continue
-            seen_sequences.add(sequence)
-            int_msa.append(
-                [residue_constants.HHBLITS_AA_TO_ID[res] for res in sequence]
-            )
-            deletion_matrix.append(deletion_matrices[msa_index][sequence_index])
-
-    num_res = len(msas[0][0])
+        if not isinstance(msa, np.ndarray):
+            msa = parsers.sequences_to_ids(msa)
+        int_msas.append(msa)
+
+    int_msa = np.ascontiguousarray(np.concatenate(int_msas, axis=0))
+    deletion_matrix = np.concatenate([
+        np.asarray(d).reshape(m.shape)
+        for m, d in zip(int_msas, deletion_matrices)
+    ], axis=0)
+
+    # Duplicate sequences are dropped by hashing the bytes of their rows,
+    # keeping the first
+    seen_sequences = set()
+    keep = []
+    for i, row in enumerate(int_msa):
+        key = row.tobytes()
+        if key not in seen_sequences:
+            seen_sequences.add(key)
+            keep.append(i)
+    int_msa = int_msa[keep]
+    deletion_matrix = deletion_matrix[keep]
+
+    num_res = int_msa.shape[-1]
     num_alignments = len(int_msa)
     features = {}
-    features["deletion_matrix_int"] = np.array(deletion_matrix, dtype=np.int32)
-    features["msa"] = np.array(int_msa, dtype=np.int32)
+    features["deletion_matrix_int"] = deletion_matrix.astype(np.int32)
+    features["msa"] = int_msa.astype(np.int32)
     features["num_alignments"] = np.array(
         [num_alignments] * num_res, dtype=np.int32
     )
@@ -419,15 +437,45 @@ class AlignmentRunner:
             self,
             out_path: str,
             content: Any) -> None:
+        def write(temp_path):
+            with open(temp_path, "w") as f:
+                f.write(content)
+
+        self.write_safely_with(out_path, write)
+
+    def write_safely_with(
+            self,
+            out_path: str,
+            write_fn: Callable[[str], None]) -> None:
+        """Like write_safely, with the file written by write_fn(path)."""
         temp_path = out_path+".temp"
-        with open(temp_path, "w") as f:
-            f.write(content)
+        write_fn(temp_path)
 
         os.rename(temp_path, out_path)
 
         if self.disable_write_permission:
             Path(out_path).chmod(0o440)
 
+    def _sto_to_a3m_fn(
+            self,
+            out_path: str,
+            max_sequences: int) -> Callable[[str], None]:
+        """
+        The sto_fn of Jackhmmer.query converting its output to an A3M at
+        out_path, without reading it whole.
+        """
+        def sto_fn(sto_path):
+            self.write_safely_with(
+                out_path,
+                partial(
+                    parsers.convert_stockholm_file_to_a3m,
+                    sto_path,
+                    max_sequences=max_sequences,
+                ),
+            )
+
+        return sto_fn
+
     def run(
         self,
         fasta_path: str,
@@ -456,17 +504,16 @@ class AlignmentRunner:
 
         if(self.jackhmmer_uniref90_runner is not None and \
            self.is_uncomplted(ignore_if_exists, uniref90_out_path)):
-            jackhmmer_uniref90_result = self.jackhmmer_uniref90_runner.query(
+            # The truncated A3M is read back for hhsearch below
+            self.jackhmmer_uniref90_runner.query(
                 fasta_path,
                 input_label,
                 timeout=self.timeout,
                 preexec_fn=preexec_fn,
-            )[0]
-            uniref90_msa_as_a3m = parsers.convert_stockholm_to_a3m(
-                jackhmmer_uniref90_result["sto"], 
-                max_sequences=self.uniref_max_hits
+                sto_fn=self._sto_to_a3m_fn(
+                    uniref90_out_path, self.uniref_max_hits
+                ),
             )
-            self.write_safely(uniref90_out_path, uniref90_msa_as_a3m)
             generated.append(UNIREF90_OUT_FILENAME)
 
         if(self.hhsearch_pdb70_runner is not None):
@@ -488,29 +535,30 @@ class AlignmentRunner:
         if(self.jackhmmer_mgnify_runner is not None):
             mgnify_out_path = os.path.join(output_dir, MGNIFY_OUT_FILENAME)
             if self.is_uncomplted(ignore_if_exists, mgnify_out_path):
-                jackhmmer_mgnify_result = self.jackhmmer_mgnify_runner.query(
+                self.jackhmmer_mgnify_runner.query(
                     fasta_path,
                     input_label,
                     timeout=self.timeout,
                     preexec_fn=preexec_fn,
-                )[0]
-                mgnify_msa_as_a3m = parsers.convert_stockholm_to_a3m(
-                    jackhmmer_mgnify_result["sto"],
-                    max_sequences=self.mgnify_max_hits
+                    sto_fn=self._sto_to_a3m_fn(
+                        mgnify_out_path, self.mgnify_max_hits
+                    ),
                 )
-                self.write_safely(mgnify_out_path, mgnify_msa_as_a3m)
                 generated.append(MGNIFY_OUT_FILENAME)
 
         if(self.use_small_bfd and self.jackhmmer_small_bfd_runner is not None):
             bfd_out_path = os.path.join(output_dir, SMALL_BFD_OUT_FILENAME)
             if self.is_uncomplted(ignore_if_exists, bfd_out_path):
-                jackhmmer_small_bfd_result = self.jackhmmer_small_bfd_runner.query(
+                # Copied as is, without reading it whole
+                self.jackhmmer_small_bfd_runner.query(
                     fasta_path,
                     input_label,
                     timeout=self.timeout,
                     preexec_fn=preexec_fn,
-                )[0]
-                self.write_safely(bfd_out_path, jackhmmer_small_bfd_result["sto"])
+                    sto_fn=lambda sto_path: self.write_safely_with(
+                        bfd_out_path, partial(shutil.copyfile, sto_path)
+                    ),
+                )
                 generated.append(SMALL_BFD_OUT_FILENAME)
 
         elif(self.hhblits_bfd_uniclust_runner is not None):
@@ -575,33 +623,61 @@ class DataPipeline:
     def __init__(
         self,
         template_featurizer: Optional[templates.TemplateHitFeaturizer],
+        alignment_store: Optional[AlignmentStore] = None,
     ):
+        """
+        Args:
+            template_featurizer:
+                Featurizer of the template hits. If None, no templates are
+                used
+            alignment_store:
+                Store read in place of the alignment directories whose
+                names it holds. See openfold/data/alignment_store.py
+        """
         self.template_featurizer = template_featurizer
+        self.alignment_store = alignment_store
+
+    def _store_name(
+        self,
+        alignment_dir: str,
+        _alignment_index: Optional[Any] = None,
+    ) -> Optional[str]:
+        """The name of alignment_dir in the alignment store, if it holds it."""
+        if(self.alignment_store is None or _alignment_index is not None):
+            return None
+
+        name = os.path.basename(os.path.normpath(alignment_dir))
+
+        return name if name in self.alignment_store else None
 
     def _parse_msa_data(
         self,
         alignment_dir: str,
         _alignment_index: Optional[Any] = None,
     ) -> Mapping[str, Any]:
+        store_name = self._store_name(alignment_dir, _alignment_index)
+        if(store_name is not None):
+            return self.alignment_store.msa_data(store_name)
+
         msa_data = {} 
         if(_alignment_index is not None):
             fp = open(os.path.join(alignment_dir, _alignment_index["db"]), "rb")
 
             def read_msa(start, size):
                 fp.seek(start)
-                msa = fp.read(size).decode("utf-8")
+                msa = fp.read(size)
                 return msa
 
             for (name, start, size) in _alignment_index["files"]:
                 ext = os.path.splitext(name)[-1]
 
                 if(ext == ".a3m"):
-                    msa, deletion_matrix = parsers.parse_a3m(
+                    msa, deletion_matrix = parsers.parse_a3m_arrays(
                         read_msa(start, size)
                     )
                     data = {"msa": msa, "deletion_matrix": deletion_matrix}
                 elif(ext == ".sto"):
-                    msa, deletion_matrix, _ = parsers.parse_stockholm(
+                    msa, deletion_matrix, _ = parsers.parse_stockholm_arrays(
                         read_msa(start, size)
                     )
                     data = {"msa": msa, "deletion_matrix": deletion_matrix}
@@ -618,13 +694,15 @@ class DataPipeline:
                     ext = os.path.splitext(f)[-1]
 
                     if(ext == ".a3m"):
-                        with open(path, "r") as fp:
-                            msa, deletion_matrix = parsers.parse_a3m(fp.read())
+                        with open(path, "rb") as fp:
+                            msa, deletion_matrix = parsers.parse_a3m_arrays(
+                                fp.read()
+                            )
                         data = {"msa": msa, "deletion_matrix": deletion_matrix}
                     elif(ext == ".sto"):
-                        with open(path, "r") as fp:
-                            msa, deletion_matrix, _ = parsers.parse_stockholm(
-                                fp.read()
+                        with open(path, "rb") as fp:
+                            msa, deletion_matrix, _ = (
+                                parsers.parse_stockholm_arrays(fp.read())
                             )
                         data = {"msa": msa, "deletion_matrix": deletion_matrix}
                     else:
@@ -639,6 +717,10 @@ class DataPipeline:
         alignment_dir: str,
         _alignment_index: Optional[Any] = None
     ) -> Mapping[str, Any]:
+        store_name = self._store_name(alignment_dir, _alignment_index)
+        if(store_name is not None):
+            return self.alignment_store.template_hits(store_name)
+
         all_hits = {}
         if(_alignment_index is not None):
             fp = open(os.path.join(alignment_dir, _alignment_index["db"]), 'rb')
@@ -907,15 +989,22 @@ class DataPipeline:
         msa_it = enumerate(zip(msa_list, deletion_mat_list))
         for i, (msas, deletion_mats) in msa_it:
             prec, post = sum(seq_lens[:i]), sum(seq_lens[i + 1:])
+            gap_id = residue_constants.HHBLITS_AA_TO_ID["-"]
             msas = [
-                [prec * '-' + seq + post * '-' for seq in msa] for msa in msas
+                np.pad(
+                    parsers.sequences_to_ids(msa)
+                    if not isinstance(msa, np.ndarray) else msa,
+                    ((0, 0), (prec, post)),
+                    constant_values=gap_id,
+                )
+                for msa in msas
             ]
             deletion_mats = [
-                [prec * [0] + dml + post * [0] for dml in deletion_mat] 
+                np.pad(np.asarray(deletion_mat), ((0, 0), (prec, post)))
                 for deletion_mat in deletion_mats
             ]
 
-            assert(len(msas[0][-1]) == len(input_sequence))
+            assert(msas[0].shape[-1] == len(input_sequence))
 
             final_msa.extend(msas)
             final_deletion_mat.extend(deletion_mats)
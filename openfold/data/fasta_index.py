@@ -0,0 +1,319 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A compact index of a large FASTA file, built once and memory-mapped by every
+MPI rank, so that ranks only read the sequences of their own shard.
+
+The index directory holds:
+    entries.npy:
+        One record per FASTA entry in file order: the byte range of its name
+        in names.bin, the byte range of its sequence lines in the FASTA file,
+        its length in residues and the group of identical sequences it
+        belongs to
+    groups.npy:
+        One record per unique sequence, sorted by length and then by name:
+        the range of its members in members.npy, its length and its
+        estimated cost
+    members.npy:
+        Entry indices of every group, each sorted by name
+    names.bin:
+        The concatenated UTF-8 names of the entries
+    meta.json:
+        The size and modification time of the FASTA file and the cost
+        coefficients. Written last, so that an index without it is
+        incomplete.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+ENTRY_DTYPE = np.dtype([
+    ("name_offset", "<i8"),
+    ("name_size", "<i4"),
+    ("seq_offset", "<i8"),
+    ("seq_size", "<i8"),
+    ("seq_len", "<i4"),
+    ("group", "<i4"),
+])
+
+GROUP_DTYPE = np.dtype([
+    ("member_begin", "<i8"),
+    ("member_count", "<i4"),
+    ("seq_len", "<i4"),
+    ("cost", "<f8"),
+])
+
+_META_FILE = "meta.json"
+
+
+def add_unique_suffix(input_chains):
+    """
+    Returns a list of chain names with additional suffix so that every name become unique.
+
+    Args:
+        input_chains:
+            A list of chain names
+    Returns:
+        A list of chain names
+    """
+
+    ret_chains = []
+    known_set = set()
+    input_set = set(input_chains)
+    for c in input_chains:
+       uc  = c
+       i = 0
+       while True:
+           if uc not in known_set and not (i > 0 and uc in input_set):
+               ret_chains.append(uc)
+               known_set.add(uc)
+               break
+
+           else:
+               uc = f"{c}_{i}"
+               i += 1
+
+    return ret_chains
+
+
+def iter_fasta_records(
+    fp
+) -> Iterator[Tuple[str, int, int, int, bytes]]:
+    """
+    Parses a FASTA file opened in binary mode line by line, in the same way
+    as parsers.parse_fasta.
+
+    Yields:
+        (name, seq_offset, seq_size, seq_len, seq_digest) tuples, where
+        seq_offset and seq_size are the byte range of the sequence lines
+    """
+    record = None
+    offset = 0
+    for line in fp:
+        stripped = line.strip()
+        if stripped.startswith(b">"):
+            if record is not None:
+                name, seq_offset, seq_len, h = record
+                seq_size = offset - seq_offset
+                yield name, seq_offset, seq_size, seq_len, h.digest()
+            record = [
+                stripped[1:].decode("utf-8"),
+                offset + len(line),
+                0,
+                hashlib.blake2b(digest_size=20),
+            ]
+        elif stripped and record is not None:
+            record[2] += len(stripped)
+            record[3].update(stripped)
+        offset += len(line)
+
+    if record is not None:
+        name, seq_offset, seq_len, h = record
+        yield name, seq_offset, offset - seq_offset, seq_len, h.digest()
+
+
+def build_fasta_index(
+    fasta_path: str,
+    index_dir: str,
+    cost_coeffs: Sequence[float],
+    unique_names: bool = False,
+):
+    """
+    Builds the index of a FASTA file.
+
+    Args:
+        fasta_path:
+            Path to the FASTA file
+        index_dir:
+            Output directory
+        cost_coeffs:
+            (a, b, c) of the estimated cost a*L^2 + b*L + c of a sequence
+        unique_names:
+            Whether to rename duplicated names with add_unique_suffix.
+            Otherwise, duplicated names are an error.
+    """
+    names = []
+    seq_offsets = []
+    seq_sizes = []
+    seq_lens = []
+    entry_groups = []
+    digest_to_group = {}
+    with open(fasta_path, "rb") as fp:
+        for name, seq_offset, seq_size, seq_len, digest in (
+            iter_fasta_records(fp)
+        ):
+            names.append(name)
+            seq_offsets.append(seq_offset)
+            seq_sizes.append(seq_size)
+            seq_lens.append(seq_len)
+            entry_groups.append(
+                digest_to_group.setdefault(digest, len(digest_to_group))
+            )
+    del digest_to_group
+
+    if unique_names:
+        names = add_unique_suffix(names)
+    elif len(names) != len(set(names)):
+        raise ValueError(
+            f"{fasta_path} contains duplicated names. Use unique_names."
+        )
+
+    # Members sorted by name, groups by length and then by their first name
+    members_of = [[] for _ in range(max(entry_groups, default=-1) + 1)]
+    for i in sorted(range(len(names)), key=lambda i: names[i]):
+        members_of[entry_groups[i]].append(i)
+    group_order = sorted(
+        range(len(members_of)),
+        key=lambda g: (seq_lens[members_of[g][0]], names[members_of[g][0]]),
+    )
+
+    os.makedirs(index_dir, exist_ok=True)
+    meta_path = os.path.join(index_dir, _META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    groups = np.zeros(len(members_of), dtype=GROUP_DTYPE)
+    members = np.zeros(len(names), dtype=np.int64)
+    new_group = np.zeros(len(members_of), dtype=np.int64)
+    begin = 0
+    for g_new, g in enumerate(group_order):
+        m = members_of[g]
+        new_group[g] = g_new
+        members[begin:begin + len(m)] = m
+        groups["member_begin"][g_new] = begin
+        groups["member_count"][g_new] = len(m)
+        groups["seq_len"][g_new] = seq_lens[m[0]]
+        begin += len(m)
+
+    a, b, c = cost_coeffs
+    seq_len = groups["seq_len"].astype(np.float64)
+    groups["cost"] = a * seq_len * seq_len + b * seq_len + c
+
+    entries = np.zeros(len(names), dtype=ENTRY_DTYPE)
+    entries["seq_offset"] = seq_offsets
+    entries["seq_size"] = seq_sizes
+    entries["seq_len"] = seq_lens
+    entries["group"] = new_group[np.asarray(entry_groups, dtype=np.int64)]
+
+    name_offset = 0
+    with open(os.path.join(index_dir, "names.bin"), "wb") as fp:
+        for i, name in enumerate(names):
+            name = name.encode("utf-8")
+            fp.write(name)
+            entries["name_offset"][i] = name_offset
+            entries["name_size"][i] = len(name)
+            name_offset += len(name)
+
+    np.save(os.path.join(index_dir, "entries.npy"), entries)
+    np.save(os.path.join(index_dir, "groups.npy"), groups)
+    np.save(os.path.join(index_dir, "members.npy"), members)
+
+    st = os.stat(fasta_path)
+    meta = {
+        "fasta_path": os.path.abspath(fasta_path),
+        "fasta_size": st.st_size,
+        "fasta_mtime_ns": st.st_mtime_ns,
+        "num_entries": len(entries),
+        "num_groups": len(groups),
+        "cost_coeffs": list(cost_coeffs),
+        "unique_names": unique_names,
+    }
+    with open(meta_path, "w") as fp:
+        json.dump(meta, fp, indent=4)
+
+    logging.info(
+        f"Indexed {len(entries)} entries ({len(groups)} unique sequences) "
+        f"of {fasta_path} in {index_dir}"
+    )
+
+
+class FastaIndex:
+    """A memory-mapped index written by build_fasta_index."""
+
+    def __init__(self, index_dir: str, fasta_path: Optional[str] = None):
+        """
+        Args:
+            index_dir:
+                The index directory
+            fasta_path:
+                Path to the FASTA file. Defaults to the path it was indexed
+                with. An error is raised if the file has changed since.
+        """
+        with open(os.path.join(index_dir, _META_FILE), "r") as fp:
+            self.meta = json.load(fp)
+
+        if fasta_path is None:
+            fasta_path = self.meta["fasta_path"]
+        st = os.stat(fasta_path)
+        if (st.st_size != self.meta["fasta_size"] or
+            st.st_mtime_ns != self.meta["fasta_mtime_ns"]):
+            raise ValueError(
+                f"{fasta_path} has changed since {index_dir} was built"
+            )
+
+        load = lambda f: np.load(os.path.join(index_dir, f), mmap_mode="r")
+        self.entries = load("entries.npy")
+        self.groups = load("groups.npy")
+        self.members = load("members.npy")
+        self._names = self._mmap(os.path.join(index_dir, "names.bin"))
+        self._fasta = self._mmap(fasta_path)
+
+    @staticmethod
+    def _mmap(path: str):
+        with open(path, "rb") as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def num_entries(self) -> int:
+        return len(self.entries)
+
+    @property
+    def num_groups(self) -> int:
+        return len(self.groups)
+
+    def name(self, i: int) -> str:
+        """Returns the name of the i-th entry."""
+        e = self.entries[i]
+        begin = int(e["name_offset"])
+        return self._names[begin:begin + int(e["name_size"])].decode("utf-8")
+
+    def sequence(self, i: int) -> str:
+        """Returns the sequence of the i-th entry."""
+        e = self.entries[i]
+        begin = int(e["seq_offset"])
+        block = self._fasta[begin:begin + int(e["seq_size"])]
+        return b"".join(l.strip() for l in block.splitlines()).decode("utf-8")
+
+    def group_members(self, g: int) -> np.ndarray:
+        """Returns the entry indices of the g-th group, sorted by name."""
+        group = self.groups[g]
+        begin = int(group["member_begin"])
+        return self.members[begin:begin + int(group["member_count"])]
+
+    def group(self, g: int) -> Tuple[str, List[str]]:
+        """Returns the (seq., [name, ...]) tuple of the g-th group."""
+        members = self.group_members(g)
+        return (
+            self.sequence(int(members[0])),
+            [self.name(int(i)) for i in members],
+        )
@@ -0,0 +1,193 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A content-addressed on-disk cache of feature dicts shared between runs."""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from typing import Any, List, Optional, Tuple
+
+import lz4.frame
+
+from openfold.data.alignment_store import AlignmentStore, is_alignment_store
+
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+_ALIGNMENT_EXTS = (".a3m", ".sto", ".hhr")
+
+# Eviction goes down to this fraction of max_bytes, so that it runs once in
+# many puts rather than on every put of a full cache
+_EVICT_LOW_WATER = 0.9
+
+# The running total only counts the puts of this process, so the directory
+# is scanned again every so many puts to account for the others
+_RESCAN_INTERVAL = 256
+
+
+def hash_file(path: str) -> str:
+    """Returns the hex digest of the contents of a file."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fp:
+        while True:
+            block = fp.read(_HASH_BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def hash_alignment_dir(alignment_dir: str) -> str:
+    """
+    Returns the hex digest of the names and contents of the MSA and template
+    hit files in an alignment directory, in the order DataPipeline reads them.
+    Directories of an alignment store are hashed by their records.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    store_dir, name = os.path.split(os.path.normpath(alignment_dir))
+    if is_alignment_store(store_dir):
+        store = AlignmentStore(store_dir)
+        if name in store:
+            h.update(store.raw_record(name))
+            return h.hexdigest()
+
+    if os.path.isdir(alignment_dir):
+        for dirpath, dirs, files in os.walk(alignment_dir):
+            dirs.sort()
+            for f in sorted(files):
+                if os.path.splitext(f)[-1] not in _ALIGNMENT_EXTS:
+                    continue
+
+                path = os.path.join(dirpath, f)
+                h.update(os.path.relpath(path, alignment_dir).encode())
+                h.update(hash_file(path).encode())
+
+    return h.hexdigest()
+
+
+def make_key(*parts: Any) -> str:
+    """Returns a cache key from the reprs of parts."""
+    h = hashlib.blake2b(digest_size=20)
+    for p in parts:
+        h.update(repr(p).encode())
+        h.update(b"\0")
+
+    return h.hexdigest()
+
+
+class FeatureCache:
+    """
+    Feature dicts stored as lz4-compressed pickles, one file per key.
+
+    Files are written under a temporary name and renamed, so that the cache
+    directory can be shared by processes on different nodes. When the total
+    size exceeds max_bytes, the least recently used entries are removed. The
+    last use of an entry is its modification time, updated on every hit.
+
+    The total size is kept as a running total from one scan of the
+    directory, so that a put only lists the directory when the total
+    crosses max_bytes or every _RESCAN_INTERVAL puts.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._bytes = None
+        self._puts = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the value of key, or None if it is not in the cache."""
+        path = self._path(key)
+        try:
+            with lz4.frame.LZ4FrameFile(path, "rb") as fp:
+                value = pickle.loads(fp.read())
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # e.g. truncated by a full filesystem
+            logging.warning(f"Ignoring broken cache entry {path}: {e}")
+            return None
+
+        return value
+
+    def put(self, key: str, value: Any):
+        """Stores value under key and evicts old entries if needed."""
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.cache_dir, suffix=".tmp"
+        )
+        os.close(fd)
+        try:
+            with lz4.frame.LZ4FrameFile(
+                tmp_path, "wb", compression_level=1
+            ) as fp:
+                fp.write(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+            size = os.path.getsize(tmp_path)
+            os.rename(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self.max_bytes is None:
+            return
+
+        self._puts += 1
+        if self._bytes is None or self._puts % _RESCAN_INTERVAL == 0:
+            self._bytes = self._scan()[1]
+        else:
+            self._bytes += size
+
+        if self._bytes > self.max_bytes:
+            self.evict(int(self.max_bytes * _EVICT_LOW_WATER))
+
+    def _scan(self) -> Tuple[List[Tuple[float, str, int]], int]:
+        """Returns the (mtime, file name, size) of all entries and their total."""
+        entries = []
+        total = 0
+        for f in os.listdir(self.cache_dir):
+            if not f.endswith(".pkl"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, f))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, f, st.st_size))
+            total += st.st_size
+
+        return entries, total
+
+    def evict(self, max_bytes: int):
+        """Removes the least recently used entries down to max_bytes."""
+        entries, total = self._scan()
+        entries.sort()
+        for _, f, size in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, f))
+                logging.info(f"Evicted {f} from the feature cache")
+            except FileNotFoundError:
+                # Evicted by another process
+                pass
+            total -= size
+
+        self._bytes = total
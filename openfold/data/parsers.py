@@ -17,13 +17,29 @@
 """Functions for parsing various file formats."""
 import collections
 import dataclasses
+import io
 import re
 import string
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import (
+    Dict, Iterable, List, Optional, Sequence, TextIO, Tuple, Union
+)
+
+import numpy as np
+
+from openfold.np import residue_constants
 
 
 DeletionMatrix = Sequence[Sequence[int]]
 
+# HHBLITS_AA_TO_ID indexed by ASCII code. -1 marks characters without an ID
+_HHBLITS_AA_TO_ID_TABLE = np.full(256, -1, dtype=np.int8)
+for _res, _id in residue_constants.HHBLITS_AA_TO_ID.items():
+    _HHBLITS_AA_TO_ID_TABLE[ord(_res)] = _id
+
+# Deletion counts saturate here. The deletion features flatten out long
+# before
+_MAX_DELETIONS = np.iinfo(np.int16).max
+
 
 @dataclasses.dataclass(frozen=True)
 class TemplateHit:
@@ -168,6 +184,168 @@ def parse_a3m(a3m_string: str) -> Tuple[Sequence[str], DeletionMatrix]:
     return aligned_sequences, deletion_matrix
 
 
+def _to_ids(codes: np.ndarray) -> np.ndarray:
+    """Translates ASCII codes to HHblits residue IDs."""
+    ids = _HHBLITS_AA_TO_ID_TABLE[codes]
+    unknown = ids < 0
+    if unknown.any():
+        raise ValueError(
+            f"Unknown residue in MSA: {chr(codes[unknown][0])!r}"
+        )
+
+    return ids
+
+
+def _to_deletion_matrix(counts: np.ndarray) -> np.ndarray:
+    return np.minimum(counts, _MAX_DELETIONS).astype(np.int16)
+
+
+def _empty_msa() -> Tuple[np.ndarray, np.ndarray]:
+    return np.zeros((0, 0), dtype=np.int8), np.zeros((0, 0), dtype=np.int16)
+
+
+def sequences_to_ids(sequences: Sequence[str]) -> np.ndarray:
+    """
+    Converts aligned sequences of equal length to an [N_seq, N_res] int8
+    array of HHblits residue IDs.
+    """
+    n_res = len(sequences[0]) if len(sequences) > 0 else 0
+    codes = np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8)
+    if len(codes) != len(sequences) * n_res:
+        raise ValueError("The sequences of the MSA differ in length")
+
+    return _to_ids(codes.reshape(len(sequences), n_res))
+
+
+def _fasta_sequences(fasta: bytes) -> List[bytes]:
+    """The sequences of a FASTA file, as parse_fasta."""
+    sequences = []
+    for record in (b"\n" + fasta).split(b"\n>")[1:]:
+        _, _, body = record.partition(b"\n")
+        sequences.append(b"".join(body.split()))
+
+    return sequences
+
+
+def parse_a3m_arrays(
+    a3m: Union[str, bytes]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized parse_a3m, returning arrays rather than lists.
+
+    Args:
+        a3m: The contents of an a3m file. The first sequence in the file
+            should be the query sequence.
+
+    Returns:
+        A tuple of:
+            * An [N_seq, N_res] int8 array of the HHblits residue IDs
+                (residue_constants.HHBLITS_AA_TO_ID) of the aligned
+                sequences. These might contain duplicates.
+            * The [N_seq, N_res] int16 deletion matrix, as in parse_a3m.
+    """
+    if isinstance(a3m, str):
+        a3m = a3m.encode()
+
+    sequences = _fasta_sequences(a3m)
+    if len(sequences) == 0:
+        return _empty_msa()
+
+    codes = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+    lengths = np.array([len(s) for s in sequences], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+
+    is_deletion = (codes >= ord("a")) & (codes <= ord("z"))
+    is_aligned = ~is_deletion
+    aligned_before = np.concatenate([[0], np.cumsum(is_aligned)])
+    n_aligned = aligned_before[starts + lengths] - aligned_before[starts]
+    n_res = int(n_aligned[0])
+    if (n_aligned != n_res).any():
+        raise ValueError("The aligned sequences of the a3m differ in length")
+    if n_res == 0:
+        return (
+            np.zeros((len(sequences), 0), dtype=np.int8),
+            np.zeros((len(sequences), 0), dtype=np.int16),
+        )
+
+    # [N_seq, N_res] positions of the aligned residues in codes
+    aligned_idx = np.flatnonzero(is_aligned).reshape(len(sequences), n_res)
+
+    # The deletions of an aligned residue are those since the previous one
+    deletions_before = np.cumsum(is_deletion) - is_deletion
+    counts = deletions_before[aligned_idx]
+    previous = np.empty_like(counts)
+    previous[:, 0] = deletions_before[starts]
+    previous[:, 1:] = counts[:, :-1]
+
+    msa = _to_ids(codes[aligned_idx])
+    deletion_matrix = _to_deletion_matrix(counts - previous)
+
+    return msa, deletion_matrix
+
+
+def parse_stockholm_arrays(
+    stockholm: Union[str, bytes],
+    max_sequences: Optional[int] = 30000,
+) -> Tuple[np.ndarray, np.ndarray, Sequence[str]]:
+    """Vectorized parse_stockholm, returning arrays rather than lists.
+
+    Args:
+        stockholm: The contents of a stockholm file. The first sequence in
+            the file should be the query sequence.
+
+    Returns:
+        A tuple of:
+            * An [N_seq, N_res] int8 array of the HHblits residue IDs
+                (residue_constants.HHBLITS_AA_TO_ID) of the sequences
+                aligned to the query. These might contain duplicates.
+            * The [N_seq, N_res] int16 deletion matrix, as in
+                parse_stockholm.
+            * The names of the targets matched, including the jackhmmer
+                subsequence suffix.
+    """
+    if isinstance(stockholm, str):
+        stockholm = stockholm.encode()
+
+    name_to_chunks = collections.OrderedDict()
+    for line in stockholm.splitlines():
+        line = line.strip()
+        if not line or line.startswith((b"#", b"//")):
+            continue
+        name, sequence = line.split()
+        if name not in name_to_chunks:
+            if max_sequences and len(name_to_chunks) >= max_sequences:
+                continue
+            name_to_chunks[name] = []
+        name_to_chunks[name].append(sequence)
+
+    names = [name.decode() for name in name_to_chunks]
+    sequences = [b"".join(chunks) for chunks in name_to_chunks.values()]
+    if len(sequences) == 0:
+        return (*_empty_msa(), names)
+
+    width = len(sequences[0])
+    if any(len(s) != width for s in sequences):
+        raise ValueError("The sequences of the stockholm differ in length")
+
+    # [N_seq, N_columns]
+    codes = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+    codes = codes.reshape(len(sequences), width)
+
+    # Columns with gaps in the query are removed, and the residues in them
+    # counted as deletions of the next column kept
+    gap = ord("-")
+    query_aligned = codes[0] != gap
+    is_deletion = (codes != gap) & ~query_aligned
+    deletions = np.cumsum(is_deletion, axis=-1)[:, query_aligned]
+
+    msa = _to_ids(codes[:, query_aligned])
+    deletion_matrix = _to_deletion_matrix(
+        np.diff(deletions, axis=-1, prepend=0)
+    )
+
+    return msa, deletion_matrix, names
+
+
 def _convert_sto_seq_to_a3m(
     query_non_gaps: Sequence[bool], sto_seq: str
 ) -> Iterable[str]:
@@ -178,58 +356,96 @@ def _convert_sto_seq_to_a3m(
             yield sequence_res.lower()
 
 
-def convert_stockholm_to_a3m(
-    stockholm_format: str, max_sequences: Optional[int] = None
-) -> str:
-    """Converts MSA in Stockholm format to the A3M format."""
+def _stream_stockholm_to_a3m(
+    lines: Iterable[str],
+    a3m_file: TextIO,
+    max_sequences: Optional[int] = None,
+):
+    """
+    Converts the lines of a Stockholm MSA to A3M in a single pass. Only the
+    first max_sequences sequences are kept, so that memory is bounded by
+    the A3M written.
+    """
     descriptions = {}
-    sequences = {}
-    reached_max_sequences = False
+    # Sequence name -> list of A3M chunks
+    a3m_chunks = {}
+    # Sequence name -> number of stockholm columns seen
+    widths = {}
+    query_name = None
+    query_non_gaps = []
 
-    for line in stockholm_format.splitlines():
-        reached_max_sequences = (
-            max_sequences and len(sequences) >= max_sequences
-        )
-        if line.strip() and not line.startswith(("#", "//")):
-            # Ignore blank lines, markup and end symbols - remainder are alignment
-            # sequence parts.
-            seqname, aligned_seq = line.split(maxsplit=1)
-            if seqname not in sequences:
-                if reached_max_sequences:
-                    continue
-                sequences[seqname] = ""
-            sequences[seqname] += aligned_seq
-
-    for line in stockholm_format.splitlines():
+    for line in lines:
         if line[:4] == "#=GS":
             # Description row - example format is:
             # #=GS UniRef90_Q9H5Z4/4-78            DE [subseq from] cDNA: FLJ22755 ...
+            # The rows come in the order of the sequences
             columns = line.split(maxsplit=3)
             seqname, feature = columns[1:3]
-            value = columns[3] if len(columns) == 4 else ""
             if feature != "DE":
                 continue
-            if reached_max_sequences and seqname not in sequences:
+            if max_sequences and len(descriptions) >= max_sequences:
                 continue
+            value = columns[3].rstrip() if len(columns) == 4 else ""
             descriptions[seqname] = value
-            if len(descriptions) == len(sequences):
-                break
-
-    # Convert sto format to a3m line by line
-    a3m_sequences = {}
-    # query_sequence is assumed to be the first sequence
-    query_sequence = next(iter(sequences.values()))
-    query_non_gaps = [res != "-" for res in query_sequence]
-    for seqname, sto_sequence in sequences.items():
-        a3m_sequences[seqname] = "".join(
-            _convert_sto_seq_to_a3m(query_non_gaps, sto_sequence)
-        )
+            continue
+
+        if not line.strip() or line.startswith(("#", "//")):
+            continue
+
+        seqname, aligned_seq = line.split(maxsplit=1)
+        aligned_seq = aligned_seq.rstrip()
+        if seqname not in a3m_chunks:
+            if max_sequences and len(a3m_chunks) >= max_sequences:
+                continue
+            a3m_chunks[seqname] = []
+            widths[seqname] = 0
+            if query_name is None:
+                query_name = seqname
+
+        # The query is assumed to be the first sequence, and to come first
+        # in each block
+        start = widths[seqname]
+        end = start + len(aligned_seq)
+        if seqname == query_name:
+            query_non_gaps.extend(res != "-" for res in aligned_seq)
+        if end > len(query_non_gaps):
+            raise ValueError(
+                f"Sequence {seqname} extends past the query in the stockholm"
+            )
+        a3m_chunks[seqname].append("".join(
+            _convert_sto_seq_to_a3m(query_non_gaps[start:end], aligned_seq)
+        ))
+        widths[seqname] = end
+
+    for seqname, chunks in a3m_chunks.items():
+        a3m_file.write(f">{seqname} {descriptions.get(seqname, '')}\n")
+        a3m_file.write("".join(chunks) + "\n")
+
 
-    fasta_chunks = (
-        f">{k} {descriptions.get(k, '')}\n{a3m_sequences[k]}"
-        for k in a3m_sequences
+def convert_stockholm_to_a3m(
+    stockholm_format: str, max_sequences: Optional[int] = None
+) -> str:
+    """Converts MSA in Stockholm format to the A3M format."""
+    a3m_file = io.StringIO()
+    _stream_stockholm_to_a3m(
+        stockholm_format.splitlines(), a3m_file, max_sequences
     )
-    return "\n".join(fasta_chunks) + "\n"  # Include terminating newline.
+    return a3m_file.getvalue()
+
+
+def convert_stockholm_file_to_a3m(
+    stockholm_path: str,
+    a3m_path: str,
+    max_sequences: Optional[int] = None,
+):
+    """
+    Converts an MSA in a Stockholm file to an A3M file, as
+    convert_stockholm_to_a3m. The Stockholm file is read line by line, so
+    that memory is bounded by the first max_sequences sequences rather than
+    the whole file.
+    """
+    with open(stockholm_path, "r") as sto_file, open(a3m_path, "w") as a3m_file:
+        _stream_stockholm_to_a3m(sto_file, a3m_file, max_sequences)
 
 
 def _get_hhr_line_regex_groups(
@@ -0,0 +1,242 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A memory-mapped store of named records, packing many small files into a few
+large ones. The records are pickled and lz4-compressed, and read by offset.
+
+The store directory holds:
+    shard_{i}.bin:
+        The records of the i-th shard, concatenated
+    shard_{i}.json:
+        The names of the records of the i-th shard and their byte ranges.
+        Written last, so that a shard without it is incomplete.
+    index.npy:
+        One entry per record, sorted by name: the byte range of its name in
+        names.bin, and its shard and the byte range of the record
+    names.bin:
+        The concatenated UTF-8 names of the records
+    meta.json:
+        The kind of the store and the number of records and shards. Written
+        last by finalize_store, so that a store without it is incomplete.
+
+Shards are written once and independently, e.g. by the ranks of an MPI job,
+and indexed by finalize_store. Records are added by writing a new shard and
+indexing all shards again.
+"""
+import json
+import logging
+import mmap
+import os
+import pickle
+from typing import Any, Iterable, List, Optional, Tuple
+
+import lz4.frame
+import numpy as np
+
+
+INDEX_DTYPE = np.dtype([
+    ("name_offset", "<i8"),
+    ("name_size", "<i4"),
+    ("shard", "<i4"),
+    ("offset", "<i8"),
+    ("size", "<i8"),
+])
+
+_META_FILE = "meta.json"
+
+
+def shard_path(store_dir: str, shard: int, ext: str) -> str:
+    return os.path.join(store_dir, f"shard_{shard:05d}{ext}")
+
+
+def is_record_store(path: str, kind: str) -> bool:
+    """Returns whether path is a complete store of the given kind."""
+    meta_path = os.path.join(path, _META_FILE)
+    if not os.path.isfile(meta_path):
+        return False
+
+    with open(meta_path, "r") as fp:
+        return json.load(fp).get("kind") == kind
+
+
+def write_shard(
+    records: Iterable[Tuple[str, Any]],
+    store_dir: str,
+    shard: int,
+):
+    """
+    Writes a shard of a store. Shards already written are skipped, without
+    consuming records, so that an interrupted build can be resumed.
+
+    Args:
+        records:
+            The names and records of the shard
+        store_dir:
+            Directory of the store
+        shard:
+            Index of the shard
+    """
+    index_path = shard_path(store_dir, shard, ".json")
+    if os.path.exists(index_path):
+        return
+
+    os.makedirs(store_dir, exist_ok=True)
+    entries = []
+    offset = 0
+    with open(shard_path(store_dir, shard, ".bin"), "wb") as fp:
+        for name, record in records:
+            blob = lz4.frame.compress(
+                pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+            )
+            fp.write(blob)
+            entries.append([name, offset, len(blob)])
+            offset += len(blob)
+
+    with open(index_path + ".tmp", "w") as fp:
+        json.dump(entries, fp)
+    os.rename(index_path + ".tmp", index_path)
+
+    logging.info(f"Wrote {len(entries)} records to shard {shard} of {store_dir}")
+
+
+def finalize_store(store_dir: str, num_shards: int, kind: str):
+    """Indexes the shards written by write_shard."""
+    meta_path = os.path.join(store_dir, _META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    names = []
+    shards = []
+    offsets = []
+    sizes = []
+    for shard in range(num_shards):
+        index_path = shard_path(store_dir, shard, ".json")
+        if not os.path.exists(index_path):
+            raise ValueError(f"Shard {shard} of {store_dir} is incomplete")
+
+        with open(index_path, "r") as fp:
+            for name, offset, size in json.load(fp):
+                names.append(name)
+                shards.append(shard)
+                offsets.append(offset)
+                sizes.append(size)
+
+    if len(names) != len(set(names)):
+        raise ValueError(f"{store_dir} contains duplicated records")
+
+    order = sorted(range(len(names)), key=lambda i: names[i])
+    index = np.zeros(len(names), dtype=INDEX_DTYPE)
+    index["shard"] = np.asarray(shards, dtype=np.int64)[order]
+    index["offset"] = np.asarray(offsets, dtype=np.int64)[order]
+    index["size"] = np.asarray(sizes, dtype=np.int64)[order]
+
+    name_offset = 0
+    with open(os.path.join(store_dir, "names.bin"), "wb") as fp:
+        for i, j in enumerate(order):
+            name = names[j].encode("utf-8")
+            fp.write(name)
+            index["name_offset"][i] = name_offset
+            index["name_size"][i] = len(name)
+            name_offset += len(name)
+
+    np.save(os.path.join(store_dir, "index.npy"), index)
+
+    meta = {
+        "kind": kind,
+        "num_records": len(index),
+        "num_shards": num_shards,
+    }
+    with open(meta_path, "w") as fp:
+        json.dump(meta, fp, indent=4)
+
+    logging.info(f"Indexed {len(index)} records in {store_dir}")
+
+
+def _mmap(path: str):
+    with open(path, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class RecordStore:
+    """A memory-mapped store written by write_shard and finalize_store."""
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, _META_FILE), "r") as fp:
+            self.meta = json.load(fp)
+
+        self.index = np.load(
+            os.path.join(store_dir, "index.npy"), mmap_mode="r"
+        )
+        self._names = _mmap(os.path.join(store_dir, "names.bin"))
+        self._shards = [
+            _mmap(shard_path(store_dir, shard, ".bin"))
+            for shard in range(self.meta["num_shards"])
+        ]
+
+    # Reopened rather than pickled, e.g. by DataLoader workers
+    def __getstate__(self):
+        return {"store_dir": self.store_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state["store_dir"])
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, name: str) -> bool:
+        return self._find(name) is not None
+
+    def name(self, i: int) -> str:
+        """Returns the name of the i-th record."""
+        e = self.index[i]
+        begin = int(e["name_offset"])
+        return self._names[begin:begin + int(e["name_size"])].decode("utf-8")
+
+    def names(self) -> List[str]:
+        """Returns the names of all records, sorted."""
+        return [self.name(i) for i in range(len(self))]
+
+    def _find(self, name: str) -> Optional[int]:
+        # Binary search over the sorted names
+        lo, hi = 0, len(self.index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.name(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(self.index) and self.name(lo) == name:
+            return lo
+
+        return None
+
+    def raw_record(self, name: str) -> bytes:
+        """Returns the compressed record of a name."""
+        i = self._find(name)
+        if i is None:
+            raise KeyError(name)
+
+        e = self.index[i]
+        begin = int(e["offset"])
+
+        return self._shards[int(e["shard"])][begin:begin + int(e["size"])]
+
+    def load(self, name: str) -> Any:
+        """Returns the record of a name."""
+        return pickle.loads(lz4.frame.decompress(self.raw_record(name)))
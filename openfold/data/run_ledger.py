@@ -0,0 +1,149 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Append-only ledgers of the items processed by the multi-node drivers.
+
+Every rank appends one JSON line per finished item to its own file in the
+ledger directory. merge_ledgers folds them into a single state file mapping
+each item to its latest record, which later jobs read at once instead of
+checking the outputs of every item on the shared filesystem.
+"""
+import glob
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, Optional
+
+
+STATE_OK = "OK"
+STATE_TIMEOUT = "NG_timeout"
+STATE_UNKNOWN = "NG_unknown"
+
+STATE_FILE = "state.json"
+
+_LEDGER_PATTERN = "rank_*.jsonl"
+
+
+def get_ledger_path(ledger_dir: str, rank: int) -> str:
+    return os.path.join(ledger_dir, f"rank_{rank:06d}.jsonl")
+
+
+class RunLedger:
+    """The ledger of a single rank."""
+
+    def __init__(self, ledger_dir: str, rank: int):
+        os.makedirs(ledger_dir, exist_ok=True)
+        self.path = get_ledger_path(ledger_dir, rank)
+        self.fp = open(self.path, "a")
+
+    def record(self, key: str, state: str, duration: float, **extra: Any):
+        """
+        Appends the result of an item.
+
+        Args:
+            key:
+                The item, e.g. the name of the output
+            state:
+                STATE_OK, STATE_TIMEOUT or STATE_UNKNOWN
+            duration:
+                The elapsed time in seconds
+            extra:
+                Other JSON-serializable values to be recorded
+        """
+        record = {
+            "key": key,
+            "state": state,
+            "duration": round(duration, 3),
+            "end": round(time.time(), 3),
+            **extra,
+        }
+        self.fp.write(json.dumps(record) + "\n")
+        # One line per item, so that a killed job loses at most one record
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+def read_ledgers(ledger_dir: str) -> Iterator[Dict[str, Any]]:
+    """Yields the records of every rank ledger in a directory."""
+    for path in sorted(glob.glob(os.path.join(ledger_dir, _LEDGER_PATTERN))):
+        with open(path, "r") as fp:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line of a killed job
+                    logging.warning(f"Ignoring a broken record in {path}")
+
+
+def load_state(state_path: str) -> Dict[str, Dict[str, Any]]:
+    """Returns the merged state, or an empty one if it doesn't exist."""
+    if not os.path.exists(state_path):
+        return {}
+
+    with open(state_path, "r") as fp:
+        return json.load(fp)
+
+
+def is_completed(state: Dict[str, Dict[str, Any]], key: str) -> bool:
+    return key in state and state[key]["state"] == STATE_OK
+
+
+def merge_ledgers(
+    ledger_dir: str,
+    state_path: Optional[str] = None,
+    remove: bool = False,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Folds the rank ledgers into the state file. Must not be run while a
+    job is writing to the ledgers.
+
+    For each item, the latest record is kept, together with the number of
+    attempts so far.
+
+    Args:
+        ledger_dir:
+            The ledger directory
+        state_path:
+            The state file. Defaults to STATE_FILE in ledger_dir
+        remove:
+            Whether to remove the rank ledgers once merged
+    Returns:
+        The merged state
+    """
+    if state_path is None:
+        state_path = os.path.join(ledger_dir, STATE_FILE)
+
+    state = load_state(state_path)
+    paths = glob.glob(os.path.join(ledger_dir, _LEDGER_PATTERN))
+    for record in sorted(read_ledgers(ledger_dir), key=lambda r: r["end"]):
+        prev = state.get(record["key"])
+        if prev is not None and record["end"] <= prev["end"]:
+            # Already merged
+            continue
+        attempts = 1 if prev is None else prev.get("attempts", 1) + 1
+        state[record["key"]] = {**record, "attempts": attempts}
+
+    with open(state_path + ".incomp", "w") as fp:
+        json.dump(state, fp)
+    os.rename(state_path + ".incomp", state_path)
+
+    if remove:
+        for path in paths:
+            os.remove(path)
+
+    return state
@@ -0,0 +1,174 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process LRU cache of parsed template structures."""
+import collections
+import logging
+from typing import Callable, Dict, Optional
+
+from openfold.data import mmcif_parsing
+from openfold.data.feature_cache import FeatureCache
+from openfold.data.structure_store import (
+    parsing_result_from_record,
+    structure_record,
+)
+
+
+# Rough sizes of the Python objects of an entry and of a Biopython atom
+_ENTRY_BYTES = 1024
+_BIOPYTHON_ATOM_BYTES = 1024
+
+
+def parsing_result_nbytes(parsing_result: mmcif_parsing.ParsingResult) -> int:
+    """Returns the approximate memory size of a parsed mmCIF file."""
+    nbytes = _ENTRY_BYTES
+    mmcif_object = parsing_result.mmcif_object
+    if mmcif_object is None:
+        return nbytes
+
+    nbytes += sum(len(s) for s in mmcif_object.chain_to_seqres.values())
+    if mmcif_object.atom_coords is not None:
+        for coords in mmcif_object.atom_coords.values():
+            if not isinstance(coords, Exception):
+                nbytes += sum(a.nbytes for a in coords)
+    else:
+        nbytes += _BIOPYTHON_ATOM_BYTES * sum(
+            1 for _ in mmcif_object.structure.get_atoms()
+        )
+
+    return nbytes
+
+
+class StructureCache:
+    """
+    Parsed template structures by PDB ID, up to max_bytes of them in memory.
+    The least recently used ones are dropped beyond it.
+
+    With shared_dir, structures without Biopython objects, i.e. those of .pkl
+    files and structure stores, are also kept there as a FeatureCache of
+    structure records, up to max_bytes as well. On a tmpfs such as /dev/shm,
+    it shares the parsed structures between the DataLoader workers or
+    featurization processes of a node, and between runs. Its size is tracked
+    incrementally, so a miss doesn't list the directory.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        shared_dir: Optional[str] = None,
+        log_interval: int = 1000,
+    ):
+        self.max_bytes = max_bytes
+        self.log_interval = log_interval
+        self._shared = None
+        if shared_dir is not None:
+            self._shared = FeatureCache(shared_dir, max_bytes)
+
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    # Forked workers inherit the entries. Others start empty.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_entries"] = collections.OrderedDict()
+        state["_bytes"] = 0
+        return state
+
+    def get(
+        self,
+        pdb_id: str,
+        load_fn: Callable[[str], mmcif_parsing.ParsingResult],
+    ) -> mmcif_parsing.ParsingResult:
+        """Returns the structure of a PDB ID, loaded by load_fn on a miss."""
+        entry = self._entries.get(pdb_id)
+        if entry is not None:
+            self._entries.move_to_end(pdb_id)
+            parsing_result, nbytes = entry
+            self.hits += 1
+            self.bytes_saved += nbytes
+            self._log_stats()
+            return parsing_result
+
+        record = None
+        if self._shared is not None:
+            record = self._shared.get(pdb_id)
+
+        if record is not None:
+            parsing_result = parsing_result_from_record(pdb_id, record)
+            nbytes = parsing_result_nbytes(parsing_result)
+            self.shared_hits += 1
+            self.bytes_saved += nbytes
+        else:
+            parsing_result = load_fn(pdb_id)
+            nbytes = parsing_result_nbytes(parsing_result)
+            self.misses += 1
+            if(self._shared is not None and
+               parsing_result.mmcif_object is not None and
+               parsing_result.mmcif_object.atom_coords is not None):
+                self._shared.put(pdb_id, structure_record(parsing_result))
+
+        self._put(pdb_id, parsing_result, nbytes)
+        self._log_stats()
+
+        return parsing_result
+
+    def _put(
+        self,
+        pdb_id: str,
+        parsing_result: mmcif_parsing.ParsingResult,
+        nbytes: int,
+    ):
+        if nbytes > self.max_bytes:
+            return
+
+        self._entries[pdb_id] = (parsing_result, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+            self._bytes -= evicted_nbytes
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the counters of the cache."""
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": (
+                (self.hits + self.shared_hits) / lookups if lookups else 0.
+            ),
+            "bytes_saved": self.bytes_saved,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def _log_stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        if self.log_interval <= 0 or lookups % self.log_interval != 0:
+            return
+
+        stats = self.stats()
+        logging.info(
+            "Template structure cache: "
+            f"{stats['hit_rate']:.1%} hit rate "
+            f"({stats['hits']} hits, {stats['shared_hits']} shared hits, "
+            f"{stats['misses']} misses), "
+            f"{stats['bytes_saved'] / (1 << 20):.1f} MiB saved, "
+            f"{stats['entries']} entries of "
+            f"{stats['bytes'] / (1 << 20):.1f} MiB"
+        )
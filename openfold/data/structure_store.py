@@ -0,0 +1,238 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A store of template structures, in place of a directory of per-entry .cif
+or .pkl files. Each entry keeps only what the template featurizer reads:
+the header, with the release date and resolution, and the SEQRES sequence,
+atom37 positions and atom mask of each protein chain. The positions of .cif
+inputs are zero-centered, as the featurizer does by default. Neither the
+raw mmCIF dict nor Biopython objects are kept, so records are small and
+quick to unpickle.
+
+Records are converted from and to ParsingResults by structure_record and
+parsing_result_from_record, which the shared tier of StructureCache uses as
+well. The store is a record store (see record_store.py) with one record per
+PDB ID. Its directory can be passed in place of the template mmCIF
+directory. See scripts/build_structure_store.py.
+"""
+import glob
+import multiprocessing
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from openfold.data import mmcif_parsing, record_store
+from openfold.data.tools.utils import load_cif
+
+
+_KIND = "structures"
+
+
+def is_structure_store(path: str) -> bool:
+    """Returns whether path is a complete structure store."""
+    return record_store.is_record_store(path, _KIND)
+
+
+def structure_record(
+    parsing_result: mmcif_parsing.ParsingResult,
+    zero_center: bool = False,
+) -> Dict[str, Any]:
+    """
+    Returns the record of a parsed mmCIF file. With zero_center, the
+    positions of each chain are translated so that the mean of its present
+    atoms is at the origin, as get_atom_coords does with
+    _zero_center_positions.
+    """
+    # The messages only end up in warnings
+    errors = {k: str(v) for k, v in parsing_result.errors.items()}
+    mmcif_object = parsing_result.mmcif_object
+    if mmcif_object is None:
+        return {"header": None, "chains": {}, "errors": errors}
+
+    chains = {}
+    for chain_id, seqres in mmcif_object.chain_to_seqres.items():
+        try:
+            positions, mask = mmcif_parsing.get_atom_coords(
+                mmcif_object, chain_id
+            )
+            positions = positions.astype(np.float32)
+            if zero_center:
+                binary_mask = mask.astype(bool)
+                translation_vec = positions[binary_mask].mean(axis=0)
+                positions[binary_mask] -= translation_vec
+            coords = {
+                "all_atom_positions": positions,
+                "all_atom_mask": mask.astype(bool),
+            }
+        except Exception as e:
+            # Raised again by get_atom_coords when the chain is read
+            coords = e
+
+        chains[chain_id] = {"seqres": seqres, "coords": coords}
+
+    return {"header": mmcif_object.header, "chains": chains, "errors": errors}
+
+
+def parsing_result_from_record(
+    pdb_id: str,
+    record: Dict[str, Any],
+) -> mmcif_parsing.ParsingResult:
+    """
+    Returns a record as a ParsingResult, as load_cif does for the .pkl files
+    of convert_mmcif/convert.py. Its MmcifObject has neither a structure nor
+    the SEQRES to structure mapping.
+    """
+    if record["header"] is None:
+        return mmcif_parsing.ParsingResult(
+            mmcif_object=None, errors=record["errors"]
+        )
+
+    chain_to_seqres = {}
+    atom_coords = {}
+    for chain_id, chain in record["chains"].items():
+        chain_to_seqres[chain_id] = chain["seqres"]
+        coords = chain["coords"]
+        if not isinstance(coords, Exception):
+            coords = (
+                coords["all_atom_positions"],
+                coords["all_atom_mask"].astype(np.float32),
+            )
+        atom_coords[chain_id] = coords
+
+    mmcif_object = mmcif_parsing.MmcifObject(
+        file_id=pdb_id,
+        header=record["header"],
+        structure=None,
+        chain_to_seqres=chain_to_seqres,
+        seqres_to_structure=None,
+        raw_string=None,
+        atom_coords=atom_coords,
+    )
+
+    return mmcif_parsing.ParsingResult(
+        mmcif_object=mmcif_object, errors=record["errors"]
+    )
+
+
+def read_structure(mmcif_dir: str, pdb_id: str) -> Dict[str, Any]:
+    """
+    Returns the record of the .cif or .pkl file of a PDB ID. The positions
+    of .cif files are zero-centered, as the template featurizer does by
+    default. Those of .pkl files are kept, as the featurizer reads them.
+    """
+    cif_path = os.path.join(mmcif_dir, pdb_id + ".cif")
+    if os.path.isfile(cif_path):
+        with open(cif_path, "r") as fp:
+            parsing_result = mmcif_parsing.parse(
+                file_id=pdb_id,
+                mmcif_string=fp.read(),
+                with_raw_string=False,
+                with_structure=False,
+            )
+        return structure_record(parsing_result, zero_center=True)
+
+    return structure_record(load_cif(cif_path, pdb_id))
+
+
+def write_structure_shard(
+    mmcif_dir: str,
+    pdb_ids: Sequence[str],
+    store_dir: str,
+    shard: int,
+):
+    """
+    Writes a shard of a structure store. Shards already written are
+    skipped, so that an interrupted build can be resumed.
+
+    Args:
+        mmcif_dir:
+            Directory of .cif files, or of the .pkl files written by
+            convert_mmcif/convert.py
+        pdb_ids:
+            PDB IDs of the shard
+        store_dir:
+            Directory of the store
+        shard:
+            Index of the shard
+    """
+    records = (
+        (pdb_id, read_structure(mmcif_dir, pdb_id)) for pdb_id in pdb_ids
+    )
+    record_store.write_shard(records, store_dir, shard)
+
+
+def finalize_structure_store(store_dir: str, num_shards: int):
+    """Indexes the shards written by write_structure_shard."""
+    record_store.finalize_store(store_dir, num_shards, _KIND)
+
+
+def list_pdb_ids(mmcif_dir: str) -> List[str]:
+    """Returns the sorted PDB IDs of the .cif and .pkl files of a directory."""
+    paths = (
+        glob.glob(os.path.join(mmcif_dir, "*.cif")) +
+        glob.glob(os.path.join(mmcif_dir, "*.pkl"))
+    )
+
+    return sorted(
+        set(os.path.splitext(os.path.basename(p))[0] for p in paths)
+    )
+
+
+def build_structure_store(
+    mmcif_dir: str,
+    store_dir: str,
+    num_workers: int = 1,
+    pdb_ids: Optional[Sequence[str]] = None,
+):
+    """
+    Builds a structure store from a directory of .cif or .pkl files, with
+    one shard per worker process.
+
+    Args:
+        mmcif_dir:
+            Directory of .cif files, or of the .pkl files written by
+            convert_mmcif/convert.py
+        store_dir:
+            Output directory
+        num_workers:
+            Number of processes parsing the files
+        pdb_ids:
+            PDB IDs to store. Defaults to all
+    """
+    if pdb_ids is None:
+        pdb_ids = list_pdb_ids(mmcif_dir)
+
+    num_shards = max(num_workers, 1)
+    jobs = [
+        (mmcif_dir, pdb_ids[shard::num_shards], store_dir, shard)
+        for shard in range(num_shards)
+    ]
+    if num_workers > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            pool.starmap(write_structure_shard, jobs)
+    else:
+        for job in jobs:
+            write_structure_shard(*job)
+
+    finalize_structure_store(store_dir, num_shards)
+
+
+class StructureStore(record_store.RecordStore):
+    """A memory-mapped store written by build_structure_store."""
+
+    def parsing_result(self, pdb_id: str) -> mmcif_parsing.ParsingResult:
+        """Returns the entry of a PDB ID as a ParsingResult."""
+        return parsing_result_from_record(pdb_id, self.load(pdb_id))
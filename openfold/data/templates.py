@@ -28,6 +28,8 @@ import numpy as np
 
 from openfold.data import parsers, mmcif_parsing
 from openfold.data.errors import Error
+from openfold.data.structure_cache import StructureCache
+from openfold.data.structure_store import StructureStore, is_structure_store
 from openfold.data.tools import kalign
 from openfold.data.tools.utils import to_date, load_cif
 from openfold.np import residue_constants
@@ -804,6 +806,8 @@ def _process_single_hit(
     kalign_binary_path: str,
     strict_error_check: bool = False,
     _zero_center_positions: bool = True,
+    structure_store: Optional[StructureStore] = None,
+    structure_cache: Optional[StructureCache] = None,
 ) -> SingleHitResult:
     """Tries to extract template features from a single HHSearch hit."""
     # Fail hard if we can't get the PDB ID and chain name from the hit.
@@ -832,8 +836,16 @@ def _process_single_hit(
         query_sequence,
         template_sequence,
     )
-    # Fail if we can't find the mmCIF file.
-    parsing_result = load_cif(cif_path, hit_pdb_code)
+    def load(pdb_id):
+        # Fail if we can't find the mmCIF file.
+        if structure_store is not None:
+            return structure_store.parsing_result(pdb_id)
+        return load_cif(cif_path, pdb_id)
+
+    if structure_cache is not None:
+        parsing_result = structure_cache.get(hit_pdb_code, load)
+    else:
+        parsing_result = load(hit_pdb_code)
 
     if parsing_result.mmcif_object is not None:
         hit_release_date = datetime.datetime.strptime(
@@ -929,13 +941,14 @@ class TemplateHitFeaturizer:
         strict_error_check: bool = False,
         _shuffle_top_k_prefiltered: Optional[int] = None,
         _zero_center_positions: bool = True,
+        structure_cache: Optional[StructureCache] = None,
     ):
         """Initializes the Template Search.
 
         Args:
             mmcif_dir: Path to a directory with mmCIF structures. Once a template ID
                 is found by HHSearch, this directory is used to retrieve the template
-                data.
+                data. May also be a store built by scripts/build_structure_store.py.
             max_template_date: The maximum date permitted for template structures. No
                 template with date higher than this date will be returned. In ISO8601
                 date format, YYYY-MM-DD.
@@ -952,9 +965,15 @@ class TemplateHitFeaturizer:
                 * If any template has identical PDB ID to the query.
                 * If any template is a duplicate of the query.
                 * Any feature computation errors.
+            structure_cache: An optional cache of the parsed template structures,
+                so that templates recurring across queries are read once.
         """
         self._mmcif_dir = mmcif_dir
-        if not glob.glob(os.path.join(self._mmcif_dir, "*.cif")) and \
+        self._structure_store = None
+        if is_structure_store(self._mmcif_dir):
+            logging.info("Using structure store %s.", self._mmcif_dir)
+            self._structure_store = StructureStore(self._mmcif_dir)
+        elif not glob.glob(os.path.join(self._mmcif_dir, "*.cif")) and \
            not glob.glob(os.path.join(self._mmcif_dir, "*.pkl")):
             logging.error("Could not find CIFs in %s", self._mmcif_dir)
             raise ValueError(f"Could not find CIFs in {self._mmcif_dir}")
@@ -989,6 +1008,7 @@ class TemplateHitFeaturizer:
 
         self._shuffle_top_k_prefiltered = _shuffle_top_k_prefiltered
         self._zero_center_positions = _zero_center_positions
+        self._structure_cache = structure_cache
 
     def get_templates(
         self,
@@ -1066,6 +1086,8 @@ class TemplateHitFeaturizer:
                 strict_error_check=self._strict_error_check,
                 kalign_binary_path=self._kalign_binary_path,
                 _zero_center_positions=self._zero_center_positions,
+                structure_store=self._structure_store,
+                structure_cache=self._structure_cache,
             )
 
             if result.error:
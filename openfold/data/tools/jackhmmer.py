@@ -99,8 +99,14 @@ class Jackhmmer:
             database_path: str,
             input_label: str,
             timeout: float=None,
-            preexec_fn: Callable=None) -> Mapping[str, Any]:
-        """Queries the database chunk using Jackhmmer."""
+            preexec_fn: Callable=None,
+            sto_fn: Optional[Callable[[str], Any]]=None) -> Mapping[str, Any]:
+        """Queries the database chunk using Jackhmmer.
+
+        If sto_fn is given, it's called with the path of the Stockholm
+        output, which is otherwise read whole, and its result is returned
+        in place of the output.
+        """
         with utils.tmpdir_manager(base_dir="/tmp") as query_tmp_dir:
             sto_path = os.path.join(query_tmp_dir, "output.sto")
 
@@ -176,8 +182,11 @@ class Jackhmmer:
                 with open(tblout_path) as f:
                     tbl = f.read()
 
-            with open(sto_path) as f:
-                sto = f.read()
+            if sto_fn is not None:
+                sto = sto_fn(sto_path)
+            else:
+                with open(sto_path) as f:
+                    sto = f.read()
 
         raw_output = dict(
             sto=sto,
@@ -194,14 +203,21 @@ class Jackhmmer:
             input_fasta_path: str,
             input_label: str,
             timeout: float=None,
-            preexec_fn: Callable=None) -> Sequence[Mapping[str, Any]]:
-        """Queries the database using Jackhmmer."""
+            preexec_fn: Callable=None,
+            sto_fn: Optional[Callable[[str], Any]]=None
+    ) -> Sequence[Mapping[str, Any]]:
+        """
+        Queries the database using Jackhmmer. See _query_chunk for sto_fn.
+        With streamed chunks, sto_fn is only called for the first chunk,
+        whose output is the one used by AlignmentRunner.
+        """
         if self.num_streamed_chunks is None:
             return [self._query_chunk(input_fasta_path,
                                       self.database_path,
                                       input_label,
                                       timeout=timeout,
-                                      preexec_fn=preexec_fn)]
+                                      preexec_fn=preexec_fn,
+                                      sto_fn=sto_fn)]
 
         db_basename = os.path.basename(self.database_path)
         db_remote_chunk = lambda db_idx: f"{self.database_path}.{db_idx}"
@@ -239,7 +255,8 @@ class Jackhmmer:
                                       db_local_chunk(i),
                                       input_label,
                                       timeout=timeout,
-                                      preexec_fn=preexec_fn)
+                                      preexec_fn=preexec_fn,
+                                      sto_fn=sto_fn if i == 1 else None)
                 )
 
                 # Remove the local copy of the chunk
@@ -214,7 +214,9 @@ class RecyclingEmbedder(nn.Module):
             z.copy_(z_update)
             z_update = z
 
-        # This squared method might become problematic in FP16 mode.
+        # This squared method might become problematic in FP16 mode, so
+        # the distances are binned in float32
+        x = x.float()
         bins = torch.linspace(
             self.min_bin,
             self.max_bin,
@@ -232,7 +234,7 @@ class RecyclingEmbedder(nn.Module):
         )
 
         # [*, N, N, no_bins]
-        d = ((d > squared_bins) * (d < upper)).type(x.dtype)
+        d = ((d > squared_bins) * (d < upper)).type(z.dtype)
 
         # [*, N, N, C_z]
         d = self.linear(d)
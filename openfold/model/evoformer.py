@@ -17,7 +17,7 @@
 import math
 import torch
 import torch.nn as nn
-from typing import Tuple, Sequence, Optional
+from typing import Dict, Tuple, Sequence, Optional
 from functools import partial
 
 from openfold.model.primitives import Linear, LayerNorm
@@ -38,28 +38,21 @@ from openfold.model.triangular_multiplicative_update import (
     TriangleMultiplicationOutgoing,
     TriangleMultiplicationIncoming,
 )
+from openfold.utils import dap
 from openfold.utils.checkpointing import checkpoint_blocks, get_checkpoint_fn
-from openfold.utils.chunk_utils import chunk_layer, ChunkSizeTuner
+from openfold.utils.chunk_utils import (
+    chunk_layer,
+    ChunkedModule,
+    ChunkPlanTuner,
+    ChunkSizeTuner,
+)
+from openfold.utils.offload_store import (
+    OffloadStore,
+    mapped_empty,
+    save_on_store,
+)
 from openfold.utils.tensor_utils import add
 
-import tempfile
-class save_on_file(torch.autograd.graph.saved_tensors_hooks):
-    def __init__(self, dir=None):
-        def pack_to_file(tensor):
-            f = tempfile.NamedTemporaryFile(dir=dir)
-            torch.save(tensor, f)
-            f.flush()
-            f.seek(0)
-            return (tensor.device, f)
-
-        def unpack_from_file(packed):
-            device, f = packed
-            tensor = torch.load(f, map_location=device)
-            f.close()
-            return tensor
-
-        super().__init__(pack_to_file, unpack_from_file)
-
 
 class MSATransition(nn.Module):
     """
@@ -195,6 +188,73 @@ class EvoformerBlockCore(nn.Module):
 
         self.ps_dropout_row_layer = DropoutRowwise(pair_dropout)
 
+    def _tiled_pair_update_(self,
+        m: torch.Tensor,
+        z: torch.Tensor,
+        msa_mask: torch.Tensor,
+        pair_mask: torch.Tensor,
+        pair_trans_mask: Optional[torch.Tensor],
+        tile_size: int,
+        planes: Optional[Tuple[torch.Tensor, ...]],
+        use_lma: bool,
+        _attn_chunk_size: Optional[int],
+        _transition_chunk_size: Optional[int],
+        _opm_chunk_size: Optional[int],
+        _dap: bool = False,
+    ) -> torch.Tensor:
+        """
+        Inference-only. The pair stack, with every module updating z
+        in-place, tile_size rows (or columns) at a time. No module allocates
+        a tensor the size of z, other than the planes of the triangle
+        multiplications, so z and the planes can be memory-mapped, with
+        only the working set of a tile resident.
+
+        With DAP, m is split by residue and z by row, the masks other than
+        pair_trans_mask are whole and each module exchanges what it needs
+        with the other ranks.
+        """
+        self.outer_product_mean(
+            m, 
+            mask=msa_mask, 
+            chunk_size=_opm_chunk_size, 
+            _add_to=z,
+            _dap=_dap,
+        )
+
+        for tri_mul in [self.tri_mul_out, self.tri_mul_in]:
+            tri_mul(
+                z,
+                mask=pair_mask,
+                inplace_safe=True,
+                _add_with_inplace=True,
+                _inplace_chunk_size=tile_size,
+                _planes=planes,
+                _dap=_dap,
+            )
+
+        for tri_att, transpose in [
+            (self.tri_att_start, False), (self.tri_att_end, True)
+        ]:
+            tri_att._tiled_add_(
+                z,
+                pair_mask,
+                tile_size,
+                transpose=transpose,
+                chunk_size=_attn_chunk_size,
+                use_memory_efficient_kernel=not use_lma,
+                use_lma=use_lma,
+                _dap=_dap,
+            )
+
+        self.pair_transition._tiled_add_(
+            z, 
+            pair_trans_mask, 
+            tile_size, 
+            chunk_size=_transition_chunk_size,
+        )
+
+        return z
+
     def forward(self,
         input_tensors: Sequence[torch.Tensor],
         msa_mask: torch.Tensor,
@@ -204,41 +264,88 @@ class EvoformerBlockCore(nn.Module):
         inplace_safe: bool = False,
         _mask_trans: bool = True,
         _attn_chunk_size: Optional[int] = None,
+        _transition_chunk_size: Optional[int] = None,
+        _opm_chunk_size: Optional[int] = None,
+        _tri_mul_chunk_size: Optional[int] = 256,
         _offload_inference: bool = False,
+        _offload_store: Optional[OffloadStore] = None,
+        _stream_tile_size: Optional[int] = None,
+        _stream_planes: Optional[Tuple[torch.Tensor, ...]] = None,
+        _dap: bool = False,
     ) -> Tuple[torch.Tensor, torch.Tensor]: 
         # DeepMind doesn't mask these transitions in the source, so _mask_trans
         # should be disabled to better approximate the exact activations of
         # the original.
         msa_trans_mask = msa_mask if _mask_trans else None
         pair_trans_mask = pair_mask if _mask_trans else None
+        if(_dap and _mask_trans):
+            # m is split by residue and z by row
+            msa_trans_mask = dap.shard(msa_mask, dim=-1)
+            pair_trans_mask = dap.shard(pair_mask, dim=-2)
       
         if(_attn_chunk_size is None):
             _attn_chunk_size = chunk_size
+        if(_transition_chunk_size is None):
+            _transition_chunk_size = chunk_size
+        if(_opm_chunk_size is None):
+            _opm_chunk_size = chunk_size
 
         m, z = input_tensors
         
         m = add(
             m,
             self.msa_transition(
-                m, mask=msa_trans_mask, chunk_size=chunk_size,
+                m, mask=msa_trans_mask, chunk_size=_transition_chunk_size,
             ),
             inplace=inplace_safe,
         ) 
 
+        if(_stream_tile_size is not None or _dap):
+            assert(inplace_safe)
+            z = self._tiled_pair_update_(
+                m,
+                z,
+                msa_mask=msa_mask,
+                pair_mask=pair_mask,
+                pair_trans_mask=pair_trans_mask,
+                tile_size=(
+                    _stream_tile_size or _tri_mul_chunk_size or z.shape[-3]
+                ),
+                planes=_stream_planes,
+                use_lma=use_lma,
+                _attn_chunk_size=_attn_chunk_size,
+                _transition_chunk_size=_transition_chunk_size,
+                _opm_chunk_size=_opm_chunk_size,
+                _dap=_dap,
+            )
+            return m, z
+
         if(_offload_inference and inplace_safe):
             del m, z
-            input_tensors[1] = input_tensors[1].cpu()
-            torch.cuda.empty_cache()
+            if(_offload_store is None):
+                input_tensors[1] = input_tensors[1].cpu()
+                torch.cuda.empty_cache()
+            else:
+                # Spilled by the block, and needed after the outer product
+                # mean
+                _offload_store.prefetch(input_tensors[1])
             m, z = input_tensors 
 
         opm = self.outer_product_mean(
-            m, mask=msa_mask, chunk_size=chunk_size, inplace_safe=inplace_safe
+            m, 
+            mask=msa_mask, 
+            chunk_size=_opm_chunk_size, 
+            inplace_safe=inplace_safe,
         )
 
         if(_offload_inference and inplace_safe):
             del m, z
-            input_tensors[0] = input_tensors[0].cpu()
-            input_tensors[1] = input_tensors[1].to(opm.device)
+            if(_offload_store is None):
+                input_tensors[0] = input_tensors[0].cpu()
+                input_tensors[1] = input_tensors[1].to(opm.device)
+            else:
+                input_tensors[0] = _offload_store.offload(input_tensors[0])
+                input_tensors[1] = _offload_store.load(input_tensors[1])
             m, z = input_tensors
 
         z = add(z, opm, inplace=inplace_safe)
@@ -249,6 +356,7 @@ class EvoformerBlockCore(nn.Module):
             mask=pair_mask,
             inplace_safe=inplace_safe,
             _add_with_inplace=True,
+            _inplace_chunk_size=_tri_mul_chunk_size,
         )
         if(not inplace_safe):
             z = z + self.ps_dropout_row_layer(tmu_update)
@@ -262,6 +370,7 @@ class EvoformerBlockCore(nn.Module):
             mask=pair_mask,
             inplace_safe=inplace_safe,
             _add_with_inplace=True,
+            _inplace_chunk_size=_tri_mul_chunk_size,
         )
         if(not inplace_safe):
             z = z + self.ps_dropout_row_layer(tmu_update)
@@ -278,7 +387,7 @@ class EvoformerBlockCore(nn.Module):
                     chunk_size=_attn_chunk_size, 
                     use_lma=use_lma,
                     inplace_safe=inplace_safe,
-                    use_memory_efficient_kernel=True,
+                    use_memory_efficient_kernel=not use_lma,
                 )
             ),
             inplace=inplace_safe,
@@ -297,7 +406,7 @@ class EvoformerBlockCore(nn.Module):
                     chunk_size=_attn_chunk_size,
                     use_lma=use_lma,
                     inplace_safe=inplace_safe,
-                    use_memory_efficient_kernel=True,
+                    use_memory_efficient_kernel=not use_lma,
                 )
             ),
             inplace=inplace_safe,
@@ -309,9 +418,13 @@ class EvoformerBlockCore(nn.Module):
             input_tensors[1] = z.contiguous()
             z = input_tensors[1]
 
+        if(_offload_inference and inplace_safe and _offload_store is not None):
+            # The MSA embedding is the next block's first input
+            _offload_store.prefetch(input_tensors[0])
+
         z = add(z,
             self.pair_transition(
-                z, mask=pair_trans_mask, chunk_size=chunk_size,
+                z, mask=pair_trans_mask, chunk_size=_transition_chunk_size,
             ),
             inplace=inplace_safe,
         )
@@ -319,8 +432,11 @@ class EvoformerBlockCore(nn.Module):
         if(_offload_inference and inplace_safe):
             device = z.device
             del m, z
-            input_tensors[0] = input_tensors[0].to(device)
-            input_tensors[1] = input_tensors[1].to(device)
+            if(_offload_store is None):
+                input_tensors[0] = input_tensors[0].to(device)
+                input_tensors[1] = input_tensors[1].to(device)
+            else:
+                input_tensors[0] = _offload_store.load(input_tensors[0])
             m, z = input_tensors
 
         return m, z
@@ -385,11 +501,21 @@ class EvoformerBlock(nn.Module):
         inplace_safe: bool = False,
         _mask_trans: bool = True,
         _attn_chunk_size: Optional[int] = None,
+        _msa_att_chunk_size: Optional[int] = None,
+        _transition_chunk_size: Optional[int] = None,
+        _opm_chunk_size: Optional[int] = None,
+        _tri_mul_chunk_size: Optional[int] = 256,
         _offload_inference: bool = False,
         _offloadable_inputs: Optional[Sequence[torch.Tensor]] = None,
+        _offload_store: Optional[OffloadStore] = None,
+        _stream_tile_size: Optional[int] = None,
+        _stream_planes: Optional[Tuple[torch.Tensor, ...]] = None,
+        _dap: bool = False,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         if(_attn_chunk_size is None):
             _attn_chunk_size = chunk_size
+        if(_msa_att_chunk_size is None):
+            _msa_att_chunk_size = chunk_size
 
         if(_offload_inference and inplace_safe):
             input_tensors = _offloadable_inputs
@@ -407,18 +533,34 @@ class EvoformerBlock(nn.Module):
                     mask=msa_mask, 
                     chunk_size=_attn_chunk_size,
                     use_lma=use_lma,
-                    use_memory_efficient_kernel=True,
+                    use_memory_efficient_kernel=not use_lma,
+                    _dap=_dap,
                 )
             ),
             inplace=inplace_safe,
         )
+
+        if(_offload_inference and inplace_safe and _offload_store is not None):
+            # The pair embedding isn't needed again until after the outer
+            # product mean
+            del m, z
+            input_tensors[1] = _offload_store.offload(input_tensors[1])
+            m, z = input_tensors
+
+        col_mask = msa_mask
+        if(_dap):
+            # From split by sequence to split by residue
+            input_tensors[0] = dap.all_to_all(m, split_dim=-2, cat_dim=-3)
+            m = input_tensors[0]
+            col_mask = dap.shard(msa_mask, dim=-1)
+
         m = add(m, 
             self.msa_att_col(
                 m, 
-                mask=msa_mask, 
-                chunk_size=chunk_size,
+                mask=col_mask, 
+                chunk_size=_msa_att_chunk_size,
                 use_lma=use_lma,
-                use_memory_efficient_kernel=True,
+                use_memory_efficient_kernel=not use_lma,
             ),
             inplace=inplace_safe,
         )
@@ -437,9 +579,19 @@ class EvoformerBlock(nn.Module):
             inplace_safe=inplace_safe,
             _mask_trans=_mask_trans,
             _attn_chunk_size=_attn_chunk_size,
+            _transition_chunk_size=_transition_chunk_size,
+            _opm_chunk_size=_opm_chunk_size,
+            _tri_mul_chunk_size=_tri_mul_chunk_size,
             _offload_inference=_offload_inference,
+            _offload_store=_offload_store,
+            _stream_tile_size=_stream_tile_size,
+            _stream_planes=_stream_planes,
+            _dap=_dap,
         )
 
+        if(_dap):
+            m = dap.all_to_all(m, split_dim=-3, cat_dim=-2)
+
         return m, z
 
 
@@ -512,11 +664,21 @@ class ExtraMSABlock(nn.Module):
         inplace_safe: bool = False,
         _mask_trans: bool = True,
         _attn_chunk_size: Optional[int] = None,
+        _msa_att_chunk_size: Optional[int] = None,
+        _transition_chunk_size: Optional[int] = None,
+        _opm_chunk_size: Optional[int] = None,
+        _tri_mul_chunk_size: Optional[int] = 256,
         _offload_inference: bool = False,
         _offloadable_inputs: Optional[Sequence[torch.Tensor]] = None,
+        _offload_store: Optional[OffloadStore] = None,
+        _stream_tile_size: Optional[int] = None,
+        _stream_planes: Optional[Tuple[torch.Tensor, ...]] = None,
+        _dap: bool = False,
     ) -> Tuple[torch.Tensor, torch.Tensor]:  
         if(_attn_chunk_size is None):
             _attn_chunk_size = chunk_size
+        if(_msa_att_chunk_size is None):
+            _msa_att_chunk_size = chunk_size
        
         if(_offload_inference and inplace_safe):
             input_tensors = _offloadable_inputs
@@ -537,22 +699,36 @@ class ExtraMSABlock(nn.Module):
                     use_memory_efficient_kernel=not use_lma,
                     _checkpoint_chunks=
                         self.ckpt if torch.is_grad_enabled() else False,
+                    _dap=_dap,
                 )
             ),
             inplace=inplace_safe,
         )
 
+        if(_offload_inference and inplace_safe and _offload_store is not None):
+            # The pair embedding isn't needed again until after the outer
+            # product mean
+            del m, z
+            input_tensors[1] = _offload_store.offload(input_tensors[1])
+            m, z = input_tensors
+
         if(not inplace_safe):
             input_tensors = [m, z]
 
+        col_mask = msa_mask
+        if(_dap):
+            # From split by sequence to split by residue
+            input_tensors[0] = dap.all_to_all(m, split_dim=-2, cat_dim=-3)
+            col_mask = dap.shard(msa_mask, dim=-1)
+
         del m, z
 
         def fn(input_tensors): 
             m = add(input_tensors[0], 
                 self.msa_att_col(
                     input_tensors[0], 
-                    mask=msa_mask, 
-                    chunk_size=chunk_size,
+                    mask=col_mask, 
+                    chunk_size=_msa_att_chunk_size,
                     use_lma=use_lma,
                 ),
                 inplace=inplace_safe,
@@ -572,7 +748,14 @@ class ExtraMSABlock(nn.Module):
                 inplace_safe=inplace_safe,
                 _mask_trans=_mask_trans,
                 _attn_chunk_size=_attn_chunk_size,
+                _transition_chunk_size=_transition_chunk_size,
+                _opm_chunk_size=_opm_chunk_size,
+                _tri_mul_chunk_size=_tri_mul_chunk_size,
                 _offload_inference=_offload_inference,
+                _offload_store=_offload_store,
+                _stream_tile_size=_stream_tile_size,
+                _stream_planes=_stream_planes,
+                _dap=_dap,
             )
             
             return m, z
@@ -583,9 +766,163 @@ class ExtraMSABlock(nn.Module):
         else:
             m, z = fn(input_tensors)
 
+        if(_dap):
+            m = dap.all_to_all(m, split_dim=-3, cat_dim=-2)
+
         return m, z
 
 
+def _dap_split(
+    m: torch.Tensor,
+    z: torch.Tensor,
+    msa_mask: Optional[torch.Tensor],
+    pair_mask: Optional[torch.Tensor],
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    The parts of the padded MSA and pair embeddings of this DAP rank, split
+    by sequence and by row, and the whole padded masks.
+    """
+    if(msa_mask is None):
+        msa_mask = m.new_ones(m.shape[:-1])
+    if(pair_mask is None):
+        pair_mask = z.new_ones(z.shape[:-1])
+
+    # Copied, so that the padded inputs can be freed
+    m = dap.shard(dap.pad(m, [-3, -2]), dim=-3).clone()
+    z = dap.shard(dap.pad(z, [-3, -2]), dim=-3).clone()
+    msa_mask = dap.pad(msa_mask, [-2, -1])
+    pair_mask = dap.pad(pair_mask, [-2, -1])
+
+    return m, z, msa_mask, pair_mask
+
+
+def _dap_merge(
+    m: Optional[torch.Tensor],
+    z: torch.Tensor,
+    n_seq: Optional[int],
+    n_res: int,
+) -> Tuple[Optional[torch.Tensor], torch.Tensor]:
+    """Reverses _dap_split. m is skipped if None."""
+    if(m is not None):
+        m = dap.gather(m, dim=-3)
+        m = dap.unpad(dap.unpad(m, [-3], n_seq), [-2], n_res)
+    z = dap.unpad(dap.gather(z, dim=-3), [-3, -2], n_res)
+
+    return m, z
+
+
+def _mapped_tri_mul_planes(
+    block: nn.Module,
+    z: torch.Tensor,
+    dir: Optional[str],
+    dap: bool = False,
+) -> Optional[Tuple[torch.Tensor, ...]]:
+    """
+    Memory-mapped planes of the triangle multiplications of an
+    EvoformerBlock or ExtraMSABlock, shared by all blocks of a stack: one,
+    or two with DAP. None on accelerators, whose planes are allocated by
+    the modules.
+    """
+    if(z.device.type != "cpu"):
+        return None
+
+    n_res = z.shape[-2]
+    shape = (block.core.tri_mul_out.c_hidden, n_res, n_res)
+    return tuple(
+        mapped_empty(shape, z.dtype, dir=dir) for _ in range(2 if dap else 1)
+    )
+
+
+def _get_chunked_modules(
+    block: nn.Module,
+    m: torch.Tensor,
+    z: torch.Tensor,
+    msa_mask: Optional[torch.Tensor],
+    pair_mask: Optional[torch.Tensor],
+    use_lma: bool,
+) -> Dict[str, ChunkedModule]:
+    """
+    Representative calls of the chunked modules of an EvoformerBlock or
+    ExtraMSABlock for ChunkPlanTuner. The keys are the block arguments set
+    from the tuned plan.
+    """
+    n_seq, n_res = m.shape[-3], m.shape[-2]
+    c_max = max(m.shape[-1], z.shape[-1])
+    itemsize = m.element_size()
+    core = block.core
+
+    if(isinstance(block, ExtraMSABlock)):
+        # Global attention over [N_seq, C_m] per column
+        col_kwargs = {}
+        col_bytes = n_seq * (m.shape[-1] + block.msa_att_col.no_heads)
+    else:
+        # [*, N_res, H, N_seq, N_seq] logits
+        col_kwargs = {"use_memory_efficient_kernel": not use_lma}
+        col_bytes = block.msa_att_col.no_heads * n_seq ** 2
+
+    def msa_att(c):
+        return block.msa_att_col(
+            m, mask=msa_mask, chunk_size=c, use_lma=use_lma, **col_kwargs
+        )
+
+    def attn(c):
+        block.msa_att_row(
+            m, 
+            z=z, 
+            mask=msa_mask, 
+            chunk_size=c, 
+            use_lma=use_lma,
+            use_memory_efficient_kernel=not use_lma,
+        )
+        core.tri_att_start(
+            z, 
+            mask=pair_mask, 
+            chunk_size=c, 
+            use_lma=use_lma,
+            use_memory_efficient_kernel=not use_lma,
+        )
+
+    def transition(c):
+        core.msa_transition(m, chunk_size=c)
+        core.pair_transition(z, chunk_size=c)
+
+    def opm(c):
+        return core.outer_product_mean(m, mask=msa_mask, chunk_size=c)
+
+    def tri_mul(c):
+        # Cloned, since the inplace update writes to its input
+        return core.tri_mul_out(
+            z.clone(),
+            mask=pair_mask,
+            inplace_safe=True,
+            _add_with_inplace=True,
+            _inplace_chunk_size=c,
+        )
+
+    attn_heads = max(block.msa_att_row.no_heads, core.tri_att_start.no_heads)
+    modules = {
+        "_msa_att_chunk_size": ChunkedModule(
+            msa_att, n_res, col_bytes * itemsize,
+        ),
+        "_attn_chunk_size": ChunkedModule(
+            attn, max(n_seq, n_res), attn_heads * n_res ** 2 * itemsize,
+        ),
+        "_transition_chunk_size": ChunkedModule(
+            transition, 
+            max(n_seq, n_res), 
+            n_res * core.msa_transition.n * c_max * itemsize,
+        ),
+        "_opm_chunk_size": ChunkedModule(
+            opm, n_res, n_res * core.outer_product_mean.c_hidden ** 2 * itemsize,
+        ),
+        "_tri_mul_chunk_size": ChunkedModule(
+            tri_mul, n_res, 4 * n_res * core.tri_mul_out.c_hidden * itemsize,
+        ),
+    }
+
+    return modules
+
+
 class EvoformerStack(nn.Module):
     """
     Main Evoformer trunk.
@@ -613,6 +950,8 @@ class EvoformerStack(nn.Module):
         eps: float,
         clear_cache_between_blocks: bool = False, 
         tune_chunk_size: bool = False,
+        chunk_plan_path: Optional[str] = None,
+        chunk_memory_budget: Optional[float] = None,
         **kwargs,
     ):
         """
@@ -651,6 +990,13 @@ class EvoformerStack(nn.Module):
                 stack. Slows down each block but can reduce fragmentation
             tune_chunk_size:
                 Whether to dynamically tune the module's chunk size
+            chunk_plan_path:
+                If set along with tune_chunk_size, the chunk size of each
+                chunked module is tuned separately by wall time, and the
+                plans are saved to and loaded from this JSON file
+            chunk_memory_budget:
+                Maximum activation memory of a chunked module in GiB when
+                tuning chunk plans
         """
         super(EvoformerStack, self).__init__()
 
@@ -681,10 +1027,22 @@ class EvoformerStack(nn.Module):
 
         self.tune_chunk_size = tune_chunk_size
         self.chunk_size_tuner = None
-        if(tune_chunk_size):
+        self.chunk_plan_tuner = None
+        if(tune_chunk_size and chunk_plan_path is not None):
+            self.chunk_plan_tuner = ChunkPlanTuner(
+                "evoformer", chunk_plan_path, chunk_memory_budget
+            )
+        elif(tune_chunk_size):
             self.chunk_size_tuner = ChunkSizeTuner()
         self.save_activation_to_file = kwargs['save_activation_to_file']
         self.activation_tmp_dir = kwargs['activation_tmp_dir']
+        self.activation_store = None
+
+    def close_activation_store(self):
+        """Removes the activations saved by the last forward pass."""
+        if(self.activation_store is not None):
+            self.activation_store.close()
+            self.activation_store = None
 
     def _prep_blocks(self, 
         m: torch.Tensor, 
@@ -695,6 +1053,9 @@ class EvoformerStack(nn.Module):
         pair_mask: Optional[torch.Tensor],
         inplace_safe: bool,
         _mask_trans: bool,
+        _stream_tile_size: Optional[int] = None,
+        _stream_dir: Optional[str] = None,
+        _dap: bool = False,
     ):
         blocks = [
             partial(
@@ -716,7 +1077,23 @@ class EvoformerStack(nn.Module):
 
             blocks = [partial(block_with_cache_clear, b) for b in blocks]
 
-        if(chunk_size is not None and self.chunk_size_tuner is not None):
+        # The representative calls of the tuners copy z
+        tune = (
+            chunk_size is not None and _stream_tile_size is None and not _dap
+        )
+        if(tune and self.chunk_plan_tuner is not None):
+            assert(not self.training)
+            plan = self.chunk_plan_tuner.tune_chunk_plan(
+                _get_chunked_modules(
+                    self.blocks[0], m, z, msa_mask, pair_mask, use_lma
+                ),
+                n_res=m.shape[-2],
+                n_seq=m.shape[-3],
+                dtype=m.dtype,
+                min_chunk_size=chunk_size,
+            )
+            blocks = [partial(b, **plan) for b in blocks]
+        elif(tune and self.chunk_size_tuner is not None):
             assert(not self.training)
             tuned_chunk_size = self.chunk_size_tuner.tune_chunk_size(
                 representative_fn=blocks[0],
@@ -733,6 +1110,20 @@ class EvoformerStack(nn.Module):
                 ) for b in blocks
             ]
 
+        if(_stream_tile_size is not None):
+            planes = _mapped_tri_mul_planes(
+                self.blocks[0], z, _stream_dir, dap=_dap,
+            )
+            blocks = [
+                partial(b,
+                    _stream_tile_size=_stream_tile_size,
+                    _stream_planes=planes,
+                ) for b in blocks
+            ]
+
+        if(_dap):
+            blocks = [partial(b, _dap=True) for b in blocks]
+
         return blocks
 
     def _forward_offload(self,
@@ -742,6 +1133,7 @@ class EvoformerStack(nn.Module):
         chunk_size: int,
         use_lma: bool = False,
         _mask_trans: bool = True,
+        offload_store: Optional[OffloadStore] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         assert(not (self.training or torch.is_grad_enabled()))
         blocks = self._prep_blocks(
@@ -757,16 +1149,20 @@ class EvoformerStack(nn.Module):
             _mask_trans=_mask_trans,
         )
 
-        for b in blocks:
+        for i, b in enumerate(blocks):
             m, z = b(
                 None, 
                 None, 
                 _offload_inference=True,
                 _offloadable_inputs=input_tensors,
+                _offload_store=offload_store,
             )
             input_tensors[0] = m
             input_tensors[1] = z
             del m, z
+
+            if(offload_store is not None):
+                offload_store.end_block(f"evoformer block {i}")
         
         m, z = input_tensors
         
@@ -783,6 +1179,9 @@ class EvoformerStack(nn.Module):
         use_lma: bool = False,
         inplace_safe: bool = False,
         _mask_trans: bool = True,
+        _stream_tile_size: Optional[int] = None,
+        _stream_dir: Optional[str] = None,
+        _dap: bool = False,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         Args:
@@ -798,6 +1197,18 @@ class EvoformerStack(nn.Module):
                 Inference-time subbatch size. Acts as a minimum if 
                 self.tune_chunk_size is True
             use_lma: Whether to use low-memory attention during inference
+            _stream_tile_size:
+                Inference-only. If set, the pair stack of each block runs
+                by tiles of this many rows, without allocating tensors the
+                size of z other than the memory-mapped planes of the
+                triangle multiplications. z can then be memory-mapped too
+                (see mapped_empty)
+            _stream_dir:
+                Directory of the memory-mapped planes
+            _dap:
+                Inference-only. Whether to split the blocks among the ranks
+                of the DAP process group (see openfold/utils/dap.py). Every
+                rank passes the whole inputs and gets the whole outputs
         Returns:
             m:
                 [*, N_seq, N_res, C_m] MSA embedding
@@ -806,6 +1217,11 @@ class EvoformerStack(nn.Module):
             s:
                 [*, N_res, C_s] single embedding (or None if extra MSA stack)
         """ 
+        if(_dap):
+            assert(inplace_safe)
+            n_seq, n_res = m.shape[-3:-1]
+            m, z, msa_mask, pair_mask = _dap_split(m, z, msa_mask, pair_mask)
+
         blocks = self._prep_blocks(
             m=m,
             z=z,
@@ -815,14 +1231,21 @@ class EvoformerStack(nn.Module):
             pair_mask=pair_mask,
             inplace_safe=inplace_safe,
             _mask_trans=_mask_trans,
+            _stream_tile_size=_stream_tile_size,
+            _stream_dir=_stream_dir,
+            _dap=_dap,
         )
 
         blocks_per_ckpt = self.blocks_per_ckpt
         if(not torch.is_grad_enabled()):
             blocks_per_ckpt = None
 
-        if self.save_activation_to_file:
-            with save_on_file(dir=self.activation_tmp_dir):
+        if self.save_activation_to_file and torch.is_grad_enabled():
+            # Kept open until the next forward pass, since the backward pass
+            # reads the activations back
+            self.close_activation_store()
+            self.activation_store = OffloadStore(self.activation_tmp_dir)
+            with save_on_store(self.activation_store):
                 m, z = checkpoint_blocks(
                     blocks,
                     args=(m, z),
@@ -835,6 +1258,9 @@ class EvoformerStack(nn.Module):
                 blocks_per_ckpt=blocks_per_ckpt,
             )
 
+        if(_dap):
+            m, z = _dap_merge(m, z, n_seq, n_res)
+
         s = self.linear(m[..., 0, :, :])
 
         return m, z, s
@@ -862,6 +1288,8 @@ class ExtraMSAStack(nn.Module):
         ckpt: bool,
         clear_cache_between_blocks: bool = False,
         tune_chunk_size: bool = False,
+        chunk_plan_path: Optional[str] = None,
+        chunk_memory_budget: Optional[float] = None,
         **kwargs,
     ):
         super(ExtraMSAStack, self).__init__()
@@ -890,7 +1318,12 @@ class ExtraMSAStack(nn.Module):
             
         self.tune_chunk_size = tune_chunk_size
         self.chunk_size_tuner = None
-        if(tune_chunk_size):
+        self.chunk_plan_tuner = None
+        if(tune_chunk_size and chunk_plan_path is not None):
+            self.chunk_plan_tuner = ChunkPlanTuner(
+                "extra_msa", chunk_plan_path, chunk_memory_budget
+            )
+        elif(tune_chunk_size):
             self.chunk_size_tuner = ChunkSizeTuner()
 
     def _prep_blocks(self, 
@@ -902,6 +1335,9 @@ class ExtraMSAStack(nn.Module):
         pair_mask: Optional[torch.Tensor],
         inplace_safe: bool,
         _mask_trans: bool,
+        _stream_tile_size: Optional[int] = None,
+        _stream_dir: Optional[str] = None,
+        _dap: bool = False,
     ):
         blocks = [
             partial(
@@ -922,7 +1358,22 @@ class ExtraMSAStack(nn.Module):
         if(self.clear_cache_between_blocks):
             blocks = [partial(clear_cache, b) for b in blocks]
 
-        if(chunk_size is not None and self.chunk_size_tuner is not None):
+        # The representative calls of the tuners copy z
+        tune = (
+            chunk_size is not None and _stream_tile_size is None and not _dap
+        )
+        if(tune and self.chunk_plan_tuner is not None):
+            plan = self.chunk_plan_tuner.tune_chunk_plan(
+                _get_chunked_modules(
+                    self.blocks[0], m, z, msa_mask, pair_mask, use_lma
+                ),
+                n_res=m.shape[-2],
+                n_seq=m.shape[-3],
+                dtype=m.dtype,
+                min_chunk_size=chunk_size,
+            )
+            blocks = [partial(b, **plan) for b in blocks]
+        elif(tune and self.chunk_size_tuner is not None):
             tuned_chunk_size = self.chunk_size_tuner.tune_chunk_size(
                 representative_fn=blocks[0],
                 # Tensors cloned to avoid getting written to in-place
@@ -940,6 +1391,20 @@ class ExtraMSAStack(nn.Module):
                 ) for b in blocks
             ]
 
+        if(_stream_tile_size is not None):
+            planes = _mapped_tri_mul_planes(
+                self.blocks[0], z, _stream_dir, dap=_dap,
+            )
+            blocks = [
+                partial(b,
+                    _stream_tile_size=_stream_tile_size,
+                    _stream_planes=planes,
+                ) for b in blocks
+            ]
+
+        if(_dap):
+            blocks = [partial(b, _dap=True) for b in blocks]
+
         return blocks
 
     def _forward_offload(self,
@@ -949,6 +1414,7 @@ class ExtraMSAStack(nn.Module):
         msa_mask: Optional[torch.Tensor] = None,
         pair_mask: Optional[torch.Tensor] = None,
         _mask_trans: bool = True,
+        offload_store: Optional[OffloadStore] = None,
     ) -> torch.Tensor:
         assert(not (self.training or torch.is_grad_enabled()))
         blocks = self._prep_blocks(
@@ -964,17 +1430,21 @@ class ExtraMSAStack(nn.Module):
             _mask_trans=_mask_trans,
         )
 
-        for b in blocks:
+        for i, b in enumerate(blocks):
             m, z = b(
                 None, 
                 None, 
                 _offload_inference=True,
                 _offloadable_inputs=input_tensors,
+                _offload_store=offload_store,
             )
             input_tensors[0] = m
             input_tensors[1] = z
             del m, z
 
+            if(offload_store is not None):
+                offload_store.end_block(f"extra_msa block {i}")
+
         return input_tensors[1]
 
     def forward(self,
@@ -986,6 +1456,9 @@ class ExtraMSAStack(nn.Module):
         pair_mask: Optional[torch.Tensor] = None,
         inplace_safe: bool = False,
         _mask_trans: bool = True,
+        _stream_tile_size: Optional[int] = None,
+        _stream_dir: Optional[str] = None,
+        _dap: bool = False,
     ) -> torch.Tensor:
         """
         Args:
@@ -999,9 +1472,25 @@ class ExtraMSAStack(nn.Module):
                 Optional [*, N_extra, N_res] MSA mask
             pair_mask:
                 Optional [*, N_res, N_res] pair mask
+            _stream_tile_size:
+                Inference-only. If set, the pair stack of each block runs
+                by tiles of this many rows, without allocating tensors the
+                size of z other than the memory-mapped planes of the
+                triangle multiplications. z can then be memory-mapped too
+            _stream_dir:
+                Directory of the memory-mapped planes
+            _dap:
+                Inference-only. Whether to split the blocks among the ranks
+                of the DAP process group (see openfold/utils/dap.py). Every
+                rank passes the whole inputs and gets the whole outputs
         Returns:
             [*, N_res, N_res, C_z] pair update
         """
+        if(_dap):
+            assert(inplace_safe)
+            n_res = z.shape[-2]
+            m, z, msa_mask, pair_mask = _dap_split(m, z, msa_mask, pair_mask)
+
         checkpoint_fn = get_checkpoint_fn()
         blocks = self._prep_blocks(
             m=m,
@@ -1012,6 +1501,9 @@ class ExtraMSAStack(nn.Module):
             pair_mask=pair_mask,
             inplace_safe=inplace_safe,
             _mask_trans=_mask_trans,
+            _stream_tile_size=_stream_tile_size,
+            _stream_dir=_stream_dir,
+            _dap=_dap,
         )
 
         for b in blocks:
@@ -1020,4 +1512,7 @@ class ExtraMSAStack(nn.Module):
             else:
                 m, z = b(m, z)
 
+        if(_dap):
+            _, z = _dap_merge(None, z, None, n_res)
+
         return z
@@ -56,8 +56,9 @@ class AuxiliaryHeads(nn.Module):
         lddt_logits = self.plddt(outputs["sm"]["single"])
         aux_out["lddt_logits"] = lddt_logits
 
-        # Required for relaxation later on
-        aux_out["plddt"] = compute_plddt(lddt_logits)
+        # Required for relaxation later on. The confidence metrics are
+        # computed in float32 even when the model runs in bfloat16
+        aux_out["plddt"] = compute_plddt(lddt_logits.float())
 
         distogram_logits = self.distogram(outputs["pair"])
         aux_out["distogram_logits"] = distogram_logits
@@ -76,11 +77,11 @@ class AuxiliaryHeads(nn.Module):
             tm_logits = self.tm(outputs["pair"])
             aux_out["tm_logits"] = tm_logits
             aux_out["predicted_tm_score"] = compute_tm(
-                tm_logits, **self.config.tm
+                tm_logits.float(), **self.config.tm
             )
             aux_out.update(
                 compute_predicted_aligned_error(
-                    tm_logits,
+                    tm_logits.float(),
                     **self.config.tm,
                 )
             )
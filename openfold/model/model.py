@@ -46,6 +46,7 @@ from openfold.utils.feats import (
 from openfold.utils.loss import (
     compute_plddt,
 )
+from openfold.utils.offload_store import OffloadStore, mapped_copy
 from openfold.utils.tensor_utils import (
     add,
     dict_multimap,
@@ -110,6 +111,7 @@ class AlphaFold(nn.Module):
 
         import openfold.utils.kernel.attention_core as attention_core
         attention_core._recompute = self.globals.recompute_attention
+        attention_core._flash = self.globals.flash_attention
 
     def embed_templates(self, batch, z, pair_mask, templ_dim, inplace_safe): 
         if(self.template_config.offload_templates):
@@ -171,6 +173,7 @@ class AlphaFold(nn.Module):
             use_lma=self.globals.use_lma,
             inplace_safe=inplace_safe,
             _mask_trans=self.config._mask_trans,
+            _dap=self.globals.dap and inplace_safe,
         )
         del t_pair
 
@@ -266,9 +269,10 @@ class AlphaFold(nn.Module):
                 requires_grad=False,
             )
 
+        # Kept in the precision of the structure module
         x_prev = pseudo_beta_fn(
             feats["aatype"], x_prev, None
-        ).to(dtype=z.dtype)
+        )
 
         # The recycling embedder is memory-intensive, so we offload first
         if(self.globals.offload_inference and inplace_safe):
@@ -332,68 +336,99 @@ class AlphaFold(nn.Module):
                     dim=-2
                 )
 
-        # Embed extra MSA features + merge with pairwise embeddings
-        if self.config.extra_msa.enabled:
-            # [*, S_e, N, C_e]
-            a = self.extra_msa_embedder(build_extra_msa_feat(feats))
+        # Spills the activations to local storage, rather than the CPU
+        offload_store = None
+        if(self.globals.offload_inference and self.globals.offload_dir):
+            offload_store = OffloadStore(self.globals.offload_dir)
+
+        try:
+            # Splits the stacks among the DAP ranks
+            use_dap = (
+                self.globals.dap and
+                not self.globals.offload_inference and
+                inplace_safe
+            )
 
-            if(self.globals.offload_inference):
-                # To allow the extra MSA stack (and later the evoformer) to
-                # offload its inputs, we remove all references to them here
-                input_tensors = [a, z]
-                del a, z
+            # Streams the pair embedding through memory instead
+            stream_tile_size = None
+            if(not (self.globals.offload_inference or use_dap) and inplace_safe):
+                stream_tile_size = self.globals.stream_tile_size
+            if(stream_tile_size is not None and z.device.type == "cpu"):
+                z = mapped_copy(z, dir=self.globals.offload_dir)
+
+            # Embed extra MSA features + merge with pairwise embeddings
+            if self.config.extra_msa.enabled:
+                # [*, S_e, N, C_e]
+                a = self.extra_msa_embedder(build_extra_msa_feat(feats))
+
+                if(self.globals.offload_inference):
+                    # To allow the extra MSA stack (and later the evoformer) to
+                    # offload its inputs, we remove all references to them here
+                    input_tensors = [a, z]
+                    del a, z
+    
+                    # [*, N, N, C_z]
+                    z = self.extra_msa_stack._forward_offload(
+                        input_tensors,
+                        msa_mask=feats["extra_msa_mask"].to(dtype=m.dtype),
+                        chunk_size=self.globals.chunk_size,
+                        use_lma=self.globals.use_lma,
+                        pair_mask=pair_mask.to(dtype=m.dtype),
+                        _mask_trans=self.config._mask_trans,
+                        offload_store=offload_store,
+                    )
     
-                # [*, N, N, C_z]
-                z = self.extra_msa_stack._forward_offload(
+                    del input_tensors
+                else:
+                    # [*, N, N, C_z]
+                    z = self.extra_msa_stack(
+                        a, z,
+                        msa_mask=feats["extra_msa_mask"].to(dtype=m.dtype),
+                        chunk_size=self.globals.chunk_size,
+                        use_lma=self.globals.use_lma,
+                        pair_mask=pair_mask.to(dtype=m.dtype),
+                        inplace_safe=inplace_safe,
+                        _mask_trans=self.config._mask_trans,
+                        _stream_tile_size=stream_tile_size,
+                        _stream_dir=self.globals.offload_dir,
+                        _dap=use_dap,
+                    )
+
+            # Run MSA + pair embeddings through the trunk of the network
+            # m: [*, S, N, C_m]
+            # z: [*, N, N, C_z]
+            # s: [*, N, C_s]          
+            if(self.globals.offload_inference):
+                input_tensors = [m, z]
+                del m, z
+                m, z, s = self.evoformer._forward_offload(
                     input_tensors,
-                    msa_mask=feats["extra_msa_mask"].to(dtype=m.dtype),
+                    msa_mask=msa_mask.to(dtype=input_tensors[0].dtype),
+                    pair_mask=pair_mask.to(dtype=input_tensors[1].dtype),
                     chunk_size=self.globals.chunk_size,
                     use_lma=self.globals.use_lma,
-                    pair_mask=pair_mask.to(dtype=m.dtype),
                     _mask_trans=self.config._mask_trans,
+                    offload_store=offload_store,
                 )
     
                 del input_tensors
             else:
-                # [*, N, N, C_z]
-                z = self.extra_msa_stack(
-                    a, z,
-                    msa_mask=feats["extra_msa_mask"].to(dtype=m.dtype),
+                m, z, s = self.evoformer(
+                    m,
+                    z,
+                    msa_mask=msa_mask.to(dtype=m.dtype),
+                    pair_mask=pair_mask.to(dtype=z.dtype),
                     chunk_size=self.globals.chunk_size,
                     use_lma=self.globals.use_lma,
-                    pair_mask=pair_mask.to(dtype=m.dtype),
                     inplace_safe=inplace_safe,
                     _mask_trans=self.config._mask_trans,
+                    _stream_tile_size=stream_tile_size,
+                    _stream_dir=self.globals.offload_dir,
+                    _dap=use_dap,
                 )
-
-        # Run MSA + pair embeddings through the trunk of the network
-        # m: [*, S, N, C_m]
-        # z: [*, N, N, C_z]
-        # s: [*, N, C_s]          
-        if(self.globals.offload_inference):
-            input_tensors = [m, z]
-            del m, z
-            m, z, s = self.evoformer._forward_offload(
-                input_tensors,
-                msa_mask=msa_mask.to(dtype=input_tensors[0].dtype),
-                pair_mask=pair_mask.to(dtype=input_tensors[1].dtype),
-                chunk_size=self.globals.chunk_size,
-                use_lma=self.globals.use_lma,
-                _mask_trans=self.config._mask_trans,
-            )
-    
-            del input_tensors
-        else:
-            m, z, s = self.evoformer(
-                m,
-                z,
-                msa_mask=msa_mask.to(dtype=m.dtype),
-                pair_mask=pair_mask.to(dtype=z.dtype),
-                chunk_size=self.globals.chunk_size,
-                use_lma=self.globals.use_lma,
-                inplace_safe=inplace_safe,
-                _mask_trans=self.config._mask_trans,
-            )
+        finally:
+            if(offload_store is not None):
+                offload_store.close()
 
         outputs["msa"] = m[..., :n_seq, :, :]
         outputs["pair"] = z
@@ -26,6 +26,7 @@ from openfold.model.primitives import (
     GlobalAttention, 
     _attention_chunked_trainable,
 )
+from openfold.utils import dap
 from openfold.utils.checkpointing import get_checkpoint_fn
 from openfold.utils.chunk_utils import chunk_layer
 from openfold.utils.tensor_utils import (
@@ -120,6 +121,7 @@ class MSAAttention(nn.Module):
         z: Optional[torch.Tensor],
         mask: Optional[torch.Tensor],
         inplace_safe: bool = False,
+        _dap: bool = False,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: 
         n_seq, n_res = m.shape[-3:-1]
         if mask is None:
@@ -127,6 +129,8 @@ class MSAAttention(nn.Module):
             mask = m.new_ones(
                 m.shape[:-3] + (n_seq, n_res),
             )
+        elif(_dap):
+            mask = dap.shard(mask, dim=-2)
 
         # [*, N_seq, 1, 1, N_res]
         mask_bias = (self.inf * (mask - 1))[..., :, None, None, :]
@@ -154,6 +158,9 @@ class MSAAttention(nn.Module):
             # [*, 1, no_heads, N_res, N_res]
             z = permute_final_dims(z, (2, 0, 1)).unsqueeze(-4)
 
+            if(_dap):
+                z = dap.gather(z, dim=-2)
+
         return m, mask_bias, z
 
     @torch.jit.ignore
@@ -214,6 +221,7 @@ class MSAAttention(nn.Module):
         inplace_safe: bool = False,
         _chunk_logits: Optional[int] = None,
         _checkpoint_chunks: Optional[bool] = None,
+        _dap: bool = False,
     ) -> torch.Tensor:
         """
         Args:
@@ -228,7 +236,9 @@ class MSAAttention(nn.Module):
                 Size of chunks into which the inputs are split along their
                 batch dimensions. A low value decreases memory overhead at the 
                 cost of slower execution. Chunking is not performed by default.
-                
+            _dap:
+                Inference-only. Whether m is split by sequence and z by row
+                among the DAP ranks. The mask is then whole
         """
         if(_chunk_logits is not None):
             return self._chunked_msa_attn(
@@ -239,7 +249,7 @@ class MSAAttention(nn.Module):
             )           
 
         m, mask_bias, z = self._prep_inputs(
-            m, z, mask, inplace_safe=inplace_safe
+            m, z, mask, inplace_safe=inplace_safe, _dap=_dap,
         )
 
         biases = [mask_bias]
@@ -21,9 +21,15 @@ import torch
 import torch.nn as nn
 
 from openfold.model.primitives import Linear
+from openfold.utils import dap
 from openfold.utils.chunk_utils import chunk_layer
 
 
+# Rows of the pair update computed at once by the inference-time OPM when
+# no chunk size is given
+DEFAULT_OPM_CHUNK_SIZE = 32
+
+
 def einsum_bac_dae_bdce(a, b):
     dim_notation_n = a.shape[:-3]
     dim_notation_a = a.shape[-2]
@@ -42,14 +48,8 @@ def einsum_bac_dae_bdce(a, b):
     # ...ay <- ...ade
     b = b.reshape(-1, dim_notation_a, dim_notation_d * dim_notation_e)
 
-    # ...xy <- ...xa * ...ay
-    if a.shape[0] == 1:
-        # mm
-        r = torch.matmul(a[0,...], b[0,...])
-    else:
-        r = torch.empty([a.shape[0]] + [dim_notation_b * dim_notation_c, dim_notation_d * dim_notation_e])
-        for i in range(a.shape[0]):
-            r[i,...] = torch.matmul(a[i,...], b[i,...])
+    # ...xy <- ...xa * ...ay, as a single batched GEMM
+    r = torch.bmm(a, b)
 
     # ...bcde <- ...xy
     r = r.reshape(list(dim_notation_n) + [dim_notation_b, dim_notation_c, dim_notation_d, dim_notation_e])
@@ -99,6 +99,105 @@ class OuterProductMean(nn.Module):
 
         return outer
 
+    @torch.jit.ignore
+    def _opm_inference(self,
+        a: torch.Tensor,
+        b: torch.Tensor,
+        mask: torch.Tensor,
+        chunk_size: int,
+        add_to: Optional[torch.Tensor] = None,
+        mask_b: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """
+        The whole OPM for inference. Each block of rows of the pair update
+        is one GEMM over the sequences followed by linear_out, which writes
+        straight into the output, so that only chunk_size rows of the
+        [*, N_res, N_res, C * C] outer products are ever alive. The buffers
+        are reused by all blocks.
+
+        Args:
+            a:
+                [*, N_seq, N_a, C] masked projection of the MSA, for the
+                rows of the update
+            b:
+                [*, N_seq, N_b, C] masked projection of the MSA, for the
+                columns of the update
+            mask:
+                [*, N_seq, N_a] MSA mask
+            add_to:
+                Optional [*, N_a, N_b, C_z] tensor to which the blocks are
+                added in-place, instead of allocating the update
+            mask_b:
+                [*, N_seq, N_b] MSA mask. Defaults to mask
+        Returns:
+            [*, N_a, N_b, C_z] pair embedding update, or add_to
+        """
+        if(mask_b is None):
+            mask_b = mask
+
+        batch_dims = a.shape[:-3]
+        n_seq, n_a, c = a.shape[-3:]
+        n_b = b.shape[-2]
+
+        a = a.reshape((-1, n_seq, n_a * c))
+        b = b.reshape((-1, n_seq, n_b * c))
+        mask = mask.reshape((-1, n_seq, n_a)).to(dtype=a.dtype)
+        mask_b = mask_b.reshape((-1, n_seq, n_b)).to(dtype=a.dtype)
+
+        if(add_to is None):
+            out = a.new_empty((a.shape[0], n_a, n_b, self.c_z))
+        else:
+            out = add_to.view((-1, n_a, n_b, self.c_z))
+
+        rows = min(chunk_size, n_a)
+        prod = a.new_empty((rows * c, n_b * c))
+        outer = a.new_empty((rows, n_b, c * c))
+        update = None
+        if(add_to is not None):
+            update = a.new_empty((rows, n_b, self.c_z))
+        weight = self.linear_out.weight.t()
+        for a_i, b_i, mask_i, mask_b_i, out_i in zip(a, b, mask, mask_b, out):
+            # [N_a * C, N_seq]
+            a_i = a_i.t()
+            for start in range(0, n_a, rows):
+                end = min(start + rows, n_a)
+                n = end - start
+
+                # [n * C, N_b * C]
+                p = prod[:n * c]
+                torch.mm(a_i[start * c:end * c], b_i, out=p)
+
+                # [n, N_b, C * C]
+                o = outer[:n]
+                o.view(n, n_b, c, c).copy_(
+                    p.view(n, c, n_b, c).transpose(-3, -2)
+                )
+
+                # [n, N_b, C_z]
+                if(update is None):
+                    out_block = out_i[start:end]
+                else:
+                    out_block = update[:n]
+                torch.addmm(
+                    self.linear_out.bias,
+                    o.view(-1, c * c),
+                    weight,
+                    out=out_block.view(-1, self.c_z),
+                )
+
+                # [n, N_b]
+                norm = torch.mm(mask_i[:, start:end].t(), mask_b_i)
+                norm += self.eps
+                out_block /= norm.unsqueeze(-1)
+
+                if(update is not None):
+                    out_i[start:end] += out_block
+
+        if(add_to is not None):
+            return add_to
+
+        return out.reshape(batch_dims + out.shape[1:])
+
     @torch.jit.ignore
     def _chunk(self, 
         a: torch.Tensor, 
@@ -135,6 +234,8 @@ class OuterProductMean(nn.Module):
         mask: Optional[torch.Tensor] = None,
         chunk_size: Optional[int] = None,
         inplace_safe: bool = False,
+        _add_to: Optional[torch.Tensor] = None,
+        _dap: bool = False,
     ) -> torch.Tensor:
         """
         Args:
@@ -142,25 +243,53 @@ class OuterProductMean(nn.Module):
                 [*, N_seq, N_res, C_m] MSA embedding
             mask:
                 [*, N_seq, N_res] MSA mask
+            _add_to:
+                Inference-only. A [*, N_res, N_res, C_z] pair embedding to
+                which the update is added in-place, block by block
+            _dap:
+                Inference-only. Whether m is split by residue among the DAP
+                ranks, and the update by row. The mask is then whole
         Returns:
-            [*, N_res, N_res, C_z] pair embedding update
+            [*, N_res, N_res, C_z] pair embedding update, or _add_to
         """
+        mask_b = None
         if mask is None:
             mask = m.new_ones(m.shape[:-1])
+        elif(_dap):
+            mask_b = mask
+            mask = dap.shard(mask, dim=-1)
 
         # [*, N_seq, N_res, C_m]
         ln = self.layer_norm(m)
 
         # [*, N_seq, N_res, C]
-        mask = mask.unsqueeze(-1)
         a = self.linear_1(ln) 
-        a = a * mask
+        a = a * mask.unsqueeze(-1)
         
         b = self.linear_2(ln) 
-        b = b * mask
+        b = b * mask.unsqueeze(-1)
 
         del ln
 
+        if(_dap):
+            # The columns of the update span all residues
+            b = dap.gather(b, dim=-2)
+            if(mask_b is None):
+                mask_b = dap.gather(mask, dim=-1)
+
+        if(not torch.is_grad_enabled()):
+            return self._opm_inference(
+                a, 
+                b, 
+                mask, 
+                chunk_size if chunk_size is not None 
+                else DEFAULT_OPM_CHUNK_SIZE,
+                add_to=_add_to,
+                mask_b=mask_b,
+            )
+
+        mask = mask.unsqueeze(-1)
+
         a = a.transpose(-2, -3)
         b = b.transpose(-2, -3)
 
@@ -97,3 +97,39 @@ class PairTransition(nn.Module):
             z = self._transition(z=z, mask=mask)
 
         return z
+
+    @torch.jit.ignore
+    def _tiled_add_(self,
+        z: torch.Tensor,
+        mask: Optional[torch.Tensor],
+        tile_size: int,
+        chunk_size: Optional[int] = None,
+    ) -> torch.Tensor:
+        """
+        Inference-only. Adds the update to z in-place, tile_size rows at a
+        time, so that only the transients of a tile are held in addition to
+        z, which may be memory-mapped.
+
+        Args:
+            z:
+                [*, N_res, N_res, C_z] pair embedding
+            mask:
+                [*, N_res, N_res] pair mask
+        Returns:
+            A reference to z
+        """
+        if mask is None:
+            mask = z.new_ones(z.shape[:-1])
+
+        n = z.shape[-3]
+        for start in range(0, n, tile_size):
+            end = min(start + tile_size, n)
+            z_tile = z[..., start:end, :, :]
+            z_tile += self(
+                z_tile, 
+                mask=mask[..., start:end, :], 
+                chunk_size=chunk_size,
+            )
+            del z_tile
+
+        return z
@@ -43,7 +43,11 @@ from openfold.utils.tensor_utils import (
 if torch.cuda.is_available():
     attn_core_inplace_cuda = importlib.import_module("attn_core_inplace_cuda")
 else:
-    import openfold.utils.kernel.attention_core_cpu as attn_core_inplace_cuda
+    try:
+        # Built by setup.py from csrc/softmax_cpu.cpp
+        attn_core_inplace_cuda = importlib.import_module("attn_core_inplace_cpu")
+    except ImportError:
+        import openfold.utils.kernel.attention_core_cpu as attn_core_inplace_cuda
 
 
 class AngleResnetBlock(nn.Module):
@@ -775,8 +779,10 @@ class StructureModule(nn.Module):
             )
 
     def torsion_angles_to_frames(self, r, alpha, f):
-        # Lazily initialize the residue constants on the correct device
-        self._init_residue_constants(alpha.dtype, alpha.device)
+        # Lazily initialize the residue constants on the correct device.
+        # They follow the frames, which are always float32, rather than
+        # the angles, which are in the dtype of the model
+        self._init_residue_constants(r.get_rots().dtype, alpha.device)
         # Separated purely to make testing less annoying
         return torsion_angles_to_frames(r, alpha, f, self.default_frames)
 
@@ -33,6 +33,7 @@ from openfold.model.triangular_multiplicative_update import (
     TriangleMultiplicationOutgoing,
     TriangleMultiplicationIncoming,
 )
+from openfold.utils import dap
 from openfold.utils.checkpointing import checkpoint_blocks
 from openfold.utils.chunk_utils import (
     chunk_layer,
@@ -204,10 +205,17 @@ class TemplatePairStackBlock(nn.Module):
         inplace_safe: bool = False,
         _mask_trans: bool = True,
         _attn_chunk_size: Optional[int] = None,
+        _dap: bool = False,
     ):
         if(_attn_chunk_size is None):
             _attn_chunk_size = chunk_size
 
+        if(_dap):
+            self._dap_forward_(
+                z, mask, chunk_size, _attn_chunk_size, use_lma, _mask_trans
+            )
+            return z
+
         single_templates = [
             t.unsqueeze(-4) for t in torch.unbind(z, dim=-4)
         ]
@@ -288,6 +296,52 @@ class TemplatePairStackBlock(nn.Module):
 
         return z
 
+    def _dap_forward_(self,
+        z: torch.Tensor,
+        mask: torch.Tensor,
+        chunk_size: Optional[int],
+        attn_chunk_size: Optional[int],
+        use_lma: bool,
+        mask_trans: bool,
+    ):
+        """
+        Inference-only. Updates the rows of z local to this DAP rank
+        in-place. The mask is that of the whole padded embedding.
+        """
+        for t in range(z.shape[-4]):
+            single = z[..., t:t + 1, :, :, :]
+            single_mask = mask[..., t:t + 1, :, :]
+            n_rows = single.shape[-3]
+
+            for tri_att, transpose in [
+                (self.tri_att_start, False), (self.tri_att_end, True)
+            ]:
+                tri_att._tiled_add_(
+                    single,
+                    single_mask,
+                    tile_size=n_rows,
+                    transpose=transpose,
+                    chunk_size=attn_chunk_size,
+                    use_lma=use_lma,
+                    _dap=True,
+                )
+
+            for tri_mul in [self.tri_mul_out, self.tri_mul_in]:
+                tri_mul(
+                    single,
+                    mask=single_mask,
+                    inplace_safe=True,
+                    _add_with_inplace=True,
+                    _dap=True,
+                )
+
+            self.pair_transition._tiled_add_(
+                single,
+                dap.shard(single_mask, dim=-2) if mask_trans else None,
+                tile_size=n_rows,
+                chunk_size=chunk_size,
+            )
+
 
 class TemplatePairStack(nn.Module):
     """
@@ -357,6 +411,7 @@ class TemplatePairStack(nn.Module):
         use_lma: bool = False,
         inplace_safe: bool = False,
         _mask_trans: bool = True,
+        _dap: bool = False,
     ):
         """
         Args:
@@ -364,6 +419,9 @@ class TemplatePairStack(nn.Module):
                 [*, N_templ, N_res, N_res, C_t] template embedding
             mask:
                 [*, N_templ, N_res, N_res] mask
+            _dap:
+                Inference-only. Whether to split the blocks among the ranks
+                of the DAP process group by row
         Returns:
             [*, N_templ, N_res, N_res, C_t] template embedding update
         """
@@ -372,6 +430,12 @@ class TemplatePairStack(nn.Module):
             expand_idx[-3] = t.shape[-4]
             mask = mask.expand(*expand_idx)
 
+        if(_dap):
+            assert(inplace_safe)
+            n_res = t.shape[-2]
+            t = dap.shard(dap.pad(t, [-3, -2]), dim=-3).clone()
+            mask = dap.pad(mask, [-2, -1])
+
         blocks = [
             partial(
                 b,
@@ -380,11 +444,13 @@ class TemplatePairStack(nn.Module):
                 use_lma=use_lma,
                 inplace_safe=inplace_safe,
                 _mask_trans=_mask_trans,
+                _dap=_dap,
             )
             for b in self.blocks
         ]
 
-        if(chunk_size is not None and self.chunk_size_tuner is not None):
+        if(chunk_size is not None and self.chunk_size_tuner is not None
+            and not _dap):
             assert(not self.training)
             tuned_chunk_size = self.chunk_size_tuner.tune_chunk_size(
                 representative_fn=blocks[0],
@@ -404,6 +470,9 @@ class TemplatePairStack(nn.Module):
             blocks_per_ckpt=self.blocks_per_ckpt if self.training else None,
         )
 
+        if(_dap):
+            t = dap.unpad(dap.gather(t, dim=-3), [-3, -2], n_res)
+
         t = self.layer_norm(t)
 
         return t
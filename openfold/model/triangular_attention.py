@@ -21,6 +21,7 @@ import torch
 import torch.nn as nn
 
 from openfold.model.primitives import Linear, LayerNorm, Attention
+from openfold.utils import dap
 from openfold.utils.chunk_utils import chunk_layer
 from openfold.utils.tensor_utils import (
     permute_final_dims,
@@ -147,6 +148,111 @@ class TriangleAttention(nn.Module):
 
         return x
 
+    @torch.jit.ignore
+    def _tiled_add_(self,
+        z: torch.Tensor,
+        mask: Optional[torch.Tensor],
+        tile_size: int,
+        transpose: bool = False,
+        chunk_size: Optional[int] = None,
+        use_memory_efficient_kernel: bool = False,
+        use_lma: bool = False,
+        _dap: bool = False,
+    ) -> torch.Tensor:
+        """
+        Inference-only. Adds the update to z in-place, tile_size rows at a
+        time. The triangle bias is computed from all tiles first, after
+        which the update of a tile only depends on the tile itself. Only
+        the [*, H, I, J] bias and the transients of a tile are held in
+        addition to z, which may be memory-mapped.
+
+        Args:
+            z:
+                [*, I, J, C_in] input tensor (e.g. the pair representation)
+            mask:
+                [*, I, J] mask
+            transpose:
+                Whether to attend over the columns of z instead, as the
+                ending node does, without a transposed copy of z
+            _dap:
+                Whether z is split by row among the DAP ranks. The mask is
+                then whole. The columns are made local by an all-to-all if
+                transpose is set
+        Returns:
+            A reference to z
+        """
+        if mask is None:
+            mask = z.new_ones(z.shape[:-1])
+            if(_dap):
+                mask = dap.gather(mask, dim=-2)
+
+        x = z
+        if(_dap and transpose):
+            x = dap.all_to_all(x, split_dim=-2, cat_dim=-3)
+            mask = dap.shard(mask, dim=-1)
+        elif(_dap):
+            mask = dap.shard(mask, dim=-2)
+
+        if(transpose):
+            x = x.transpose(-2, -3)
+            mask = mask.transpose(-1, -2)
+
+        n = x.shape[-3]
+
+        # [*, H, I, J]
+        triangle_bias = x.new_empty(
+            x.shape[:-3] + (self.no_heads,) + x.shape[-3:-1]
+        )
+        for start in range(0, n, tile_size):
+            end = min(start + tile_size, n)
+            tile = self.layer_norm(x[..., start:end, :, :])
+            triangle_bias[..., start:end, :] = permute_final_dims(
+                self.linear(tile), (2, 0, 1)
+            )
+            del tile
+
+        if(_dap):
+            triangle_bias = dap.gather(triangle_bias, dim=-2)
+
+        # [*, 1, H, I, J]
+        triangle_bias = triangle_bias.unsqueeze(-4)
+
+        # [*, I, 1, 1, J]
+        mask_bias = (self.inf * (mask - 1))[..., :, None, None, :]
+
+        for start in range(0, n, tile_size):
+            end = min(start + tile_size, n)
+            x_tile = x[..., start:end, :, :]
+            tile = self.layer_norm(x_tile)
+            biases = [mask_bias[..., start:end, :, :, :], triangle_bias]
+            if chunk_size is not None:
+                tile = self._chunk(
+                    tile,
+                    biases,
+                    chunk_size,
+                    use_memory_efficient_kernel=use_memory_efficient_kernel,
+                    use_lma=use_lma,
+                    inplace_safe=True,
+                )
+            else:
+                tile = self.mha(
+                    q_x=tile,
+                    kv_x=tile,
+                    biases=biases,
+                    use_memory_efficient_kernel=use_memory_efficient_kernel,
+                    use_lma=use_lma
+                )
+
+            x_tile += tile
+            del x_tile, tile
+
+        if(_dap and transpose):
+            z.copy_(
+                dap.all_to_all(x.transpose(-2, -3), split_dim=-3, cat_dim=-2)
+            )
+
+        return z
+
 
 # Implements Algorithm 13
 TriangleAttentionStartingNode = TriangleAttention
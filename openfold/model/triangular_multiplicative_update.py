@@ -15,15 +15,22 @@
 # limitations under the License.
 
 from functools import partialmethod
-from typing import Optional
+from typing import Optional, Tuple
 
 import torch
 import torch.nn as nn
 
 from openfold.model.primitives import Linear, LayerNorm
+from openfold.utils import dap
 from openfold.utils.chunk_utils import chunk_layer
 from openfold.utils.tensor_utils import add, permute_final_dims
 
+
+# Rows of z in a tile of the inference-time update when no tile size is
+# given. Bounds the [t, N, 4 * C_hidden] projections of a tile
+DEFAULT_INPLACE_CHUNK_SIZE = 256
+
+
 class ContiguousGrad(torch.autograd.Function):
     @staticmethod
     def forward(ctx, x):
@@ -62,6 +69,9 @@ class TriangleMultiplicativeUpdate(nn.Module):
         self.sigmoid = nn.Sigmoid()
         self.contiguous_grad = ContiguousGrad.apply
 
+        # See _fused_projection
+        self._fused_projections = {}
+
     def _combine_projections(self,
         a: torch.Tensor,
         b: torch.Tensor,
@@ -97,11 +107,60 @@ class TriangleMultiplicativeUpdate(nn.Module):
 
         return permute_final_dims(p, (1, 2, 0))
 
+    def _fused_projection(self,
+        names: Tuple[str, ...],
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Weights and biases of the named Linears stacked along their outputs,
+        for a single GEMM. Cached until any of the parameters is moved or
+        written to, e.g. by load_state_dict.
+        """
+        linears = [getattr(self, name) for name in names]
+        key = tuple(
+            (p.data_ptr(), p._version)
+            for l in linears for p in (l.weight, l.bias)
+        )
+        cached = self._fused_projections.get(names)
+        if(cached is None or cached[0] != key):
+            w = torch.cat([l.weight for l in linears], dim=0)
+            bias = torch.cat([l.bias for l in linears], dim=0)
+            cached = (key, w, bias)
+            self._fused_projections[names] = cached
+
+        return cached[1], cached[2]
+
+    def _gated_projection(self,
+        pair: torch.Tensor,
+        mask: torch.Tensor,
+        names: Tuple[str, ...],
+    ) -> torch.Tensor:
+        """
+        Projections of a layer-normed tile of z by the named Linears, in a
+        single GEMM. The gate channels of every (projection, gate) pair of
+        Linears in front are overwritten with the masked, gated projection;
+        the channels of a trailing unpaired Linear are left as is.
+        """
+        w, bias = self._fused_projection(names)
+        p = torch.addmm(bias, pair.reshape(-1, self.c_z), w.t())
+        p = p.view(pair.shape[:-1] + (-1,))
+
+        c = self.c_hidden
+        for start in range(0, 2 * (len(names) // 2) * c, 2 * c):
+            p_p = p[..., start:start + c]
+            p_g = p[..., start + c:start + 2 * c]
+            p_g.sigmoid_()
+            p_g *= p_p
+            p_g *= mask
+
+        return p
+
     def _inference_forward(self,
         z: torch.Tensor,
         mask: Optional[torch.Tensor] = None,
         inplace_chunk_size: Optional[int] = None,
         with_add: bool = True,
+        planes: Optional[Tuple[torch.Tensor, ...]] = None,
+        _dap: bool = False,
     ):
         """
         Args:
@@ -110,261 +169,218 @@ class TriangleMultiplicativeUpdate(nn.Module):
             mask:
                 A [*, N, N] pair mask
             inplace_chunk_size:
-                Size of chunks used in the main computation. Increase to trade
-                memory for speed.
+                Number of rows (or columns) of z in a tile. Increase to
+                trade memory for speed. Defaults to
+                DEFAULT_INPLACE_CHUNK_SIZE
             with_add:
                 If True, z is overwritten with (z + update). Otherwise, it is
                 overwritten with (update).
+            planes:
+                Optional [C_hidden, N, N] buffers to use for the resident
+                projections, e.g. memory-mapped ones: one, or two with DAP.
+                Allocated if not given
+            _dap:
+                Whether z is split by row among the DAP ranks. The mask is
+                then whole
         Returns:
             A reference to the overwritten z
 
-        More memory-efficient, inference-only version of the forward function.
-        Uses in-place operations, fusion of the addition that happens after
-        this module in the Evoformer, a smidge of recomputation, and 
-        a cache of overwritten values to lower peak memory consumption of this
-        module from 5x the size of the input tensor z to 2.5x its size. Useful
-        for inference on extremely long sequences. 
-        
-        It works as follows. We will make reference to variables used in the
-        default forward implementation below. Naively, triangle multiplication
-        attention requires the manifestation of 5 tensors the size of z:
-        1) z, the "square" input tensor, 2) a, the first projection of z, 
-        3) b, the second projection of b, 4) g, a z-sized mask, and 5) a 
-        z-sized tensor for intermediate computations. For large N, this is 
-        prohibitively expensive; for N=4000, for example, z is more than 8GB 
-        alone. To avoid this problem, we compute b, g, and all intermediate
-        tensors in small chunks, noting that the chunks required to compute a
-        chunk of the output depend only on the tensor a and corresponding 
-        vertical and horizontal chunks of z. This suggests an algorithm that 
-        loops over pairs of chunks of z: hereafter "columns" and "rows" of
-        z, even though each "column" and "row" in fact contains
-        inplace_chunk_size contiguous true columns and rows of z. Writing 
-        output chunks to a new tensor would bring total memory consumption
-        down to 3x the size of z. However, more memory can be saved by writing
-        output chunks directly to z in-place. WLOG, we choose to write output
-        chunks vertically, overwriting the ith "column" of z at the end of
-        the ith iteration of the main loop. Despite this overwriting, the 
-        ith column is always one column ahead of previously overwritten columns 
-        and can be recovered directly from z. After the first iteration,
-        however, the ith row of z is always at least partially overwritten. For
-        this reason, we introduce the z-cache, a tensor one-half the size of 
-        z. The z-cache initially contains the left half (2nd and 3rd quadrants)
-        of z. For 0 < i < N/2, the missing left part of the ith row of z is
-        recovered from this cache at the beginning of the ith iteration. Once i 
-        exceeds n/2, the cache is "reoriented" to encompass the 3rd and 4th 
-        quadrants of z instead. Though the 3rd quadrant of the original z is 
-        entirely overwritten at this point, it can be recovered from the z-cache 
-        itself. Thereafter, the ith row of z can be recovered in its entirety 
-        from the reoriented z-cache. After the final iteration, z has been 
-        completely overwritten and contains the triangular multiplicative 
-        update. If with_add is True, it instead contains the sum of z and the
-        triangular multiplicative update. In either case, peak memory 
-        consumption is just 2.5x the size of z, disregarding memory used for 
-        chunks and other small variables.
+        Tiled, inference-only version of the forward function, which makes
+        two sweeps over tiles of inplace_chunk_size rows (or columns) of z.
+
+        The update of every channel c is a[c] @ b[c]^T once the projections
+        are laid out channel-first, as [C, N, N] planes. The first sweep
+        computes one of them, b for the outgoing variant and a for the 
+        incoming one, by tiles of rows of z, and keeps it resident.
+
+        The second sweep computes the other projection from a tile of z, in
+        the same GEMM as the gate of the update, multiplies it with the
+        resident plane, then applies the output layer norm, projection and
+        gate while the tile is in cache. The tile is one of rows of z for
+        the outgoing variant and one of columns for the incoming one: in
+        both cases, that is the only part of z that the tile of the update
+        depends on besides the resident plane, so the update is written to
+        z in-place. In addition to z, peak memory consumption is that of 
+        the plane, C_hidden / C_z times that of z, and of the transients of
+        a tile. The memory planner counts both.
+
+        With DAP, z is split by row, so the first sweep computes both
+        projections of the local rows. b is then gathered from all ranks,
+        and the incoming variant moves the split of a from its columns to
+        its rows with an all-to-all, so that the second sweep covers the
+        local rows of the update.
         """
+        if(_dap):
+            return self._inference_forward_dap(
+                z, mask, inplace_chunk_size, with_add, planes,
+            )
+
         if mask is None:
             mask = z.new_ones(z.shape[:-1])
 
-        mask = mask.unsqueeze(-1)
-       
-        def compute_projection_helper(pair, mask, a=True):
-            if(a):
-                linear_g = self.linear_a_g
-                linear_p = self.linear_a_p
-            else:
-                linear_g = self.linear_b_g
-                linear_p = self.linear_b_p
-            
-            pair = self.layer_norm_in(pair)
-            p = linear_g(pair)
-            p.sigmoid_()
-            p *= linear_p(pair)
-            p *= mask
-            p = permute_final_dims(p, (2, 0, 1))
-            return p
-
-        def compute_projection(pair, mask, a=True, chunked=True): 
-            need_transpose = self._outgoing ^ a
-            if(not chunked):
-                p = compute_projection_helper(pair, mask, a)
-                if(need_transpose):
-                    p = p.transpose(-1, -2)
-            else:
-                # This computation is chunked so as not to exceed our 2.5x 
-                # budget with a large intermediate tensor
-                linear_g = self.linear_a_g if a else self.linear_b_g
-                c = linear_g.bias.shape[-1]
-                out_shape = pair.shape[:-3] + (c,) + pair.shape[-3:-1]
-                p = pair.new_zeros(out_shape)
-                for i in range(0, pair.shape[-3], inplace_chunk_size):
-                    pair_chunk = pair[..., i: i + inplace_chunk_size, :, :]
-                    mask_chunk = mask[..., i: i + inplace_chunk_size, :, :]
-                    pair_chunk = compute_projection_helper(
-                        pair[..., i: i + inplace_chunk_size, :, :],
-                        mask[..., i: i + inplace_chunk_size, :, :], 
-                        a,
-                    )
-                    if(need_transpose):
-                        pair_chunk = pair_chunk.transpose(-1, -2)
-                        p[..., i: i + inplace_chunk_size] = pair_chunk
-                    else:
-                        p[..., i: i + inplace_chunk_size, :] = pair_chunk
-                    
-                    del pair_chunk
-
-            return p
-
-        # We start by fully manifesting a. In addition to the input, this
-        # brings total memory consumption to 2x z (disregarding size of chunks)
-        # [*, N, N, c]
-        a = compute_projection(z, mask, True, chunked=True)
-
-        if(inplace_chunk_size is not None):
-            n = a.shape[-1]
-            half_n = n // 2 + n % 2
-            row_dim = -3
-            col_dim = -2
-            b_chunk_dim = row_dim if self._outgoing else col_dim
-            
-            def empty_slicer(t):
-                return [slice(None) for _ in t.shape]
-            
-            def slice_tensor(t, start, end, dim):
-                # Slices start:end from the dim dimension of t
-                s = empty_slicer(t)
-                s[dim] = slice(start, end)
-                return t[s]
-
-            def flip_z_cache_(z_cache, z):
-                # "Reorient" the z_cache (see below), filling it with quadrants
-                # 3---recovered from the z_cache---and 4---recovered from z---
-                # of the input tensor z. 
-                quadrant_3 = slice_tensor(
-                    z_cache, half_n, None, row_dim
-                )
-                z_cache = z_cache.transpose(row_dim, col_dim)
-                
-                # If n is odd, we need to shrink the z_cache by one row
-                z_cache = z_cache[..., :(n // 2), :, :]
-
-                # Move the 3rd quadrant of z into the 
-                first_half_slicer = empty_slicer(z_cache)
-                first_half_slicer[col_dim] = slice(0, half_n)
-                z_cache[first_half_slicer] = quadrant_3
-               
-                # Get the fourth quadrant of z
-                quadrant_4 = slice_tensor(z, half_n, None, row_dim)
-                quadrant_4 = slice_tensor(
-                    quadrant_4, half_n, None, col_dim
+        n = z.shape[-2]
+        c = self.c_hidden
+        tile_size = inplace_chunk_size or DEFAULT_INPLACE_CHUNK_SIZE
+        if(self._outgoing):
+            resident = ("linear_b_p", "linear_b_g")
+            tiled = ("linear_a_p", "linear_a_g", "linear_g")
+        else:
+            resident = ("linear_a_p", "linear_a_g")
+            tiled = ("linear_b_p", "linear_b_g", "linear_g")
+
+        # Views, so that z is written in-place
+        z_flat = z.view((-1,) + z.shape[-3:])
+        mask_flat = mask.reshape((-1,) + mask.shape[-2:])
+        for z_i, mask_i in zip(z_flat, mask_flat):
+            # b[c, j, k] if outgoing, a[c, i, k] if incoming
+            plane = z.new_empty((c, n, n)) if planes is None else planes[0]
+            for start in range(0, n, tile_size):
+                end = min(start + tile_size, n)
+
+                # [t, N, 2 * C]
+                p = self._gated_projection(
+                    self.layer_norm_in(z_i[start:end]),
+                    mask_i[start:end, :, None],
+                    resident,
                 )
+                p = p[..., c:]
+                if(self._outgoing):
+                    plane[:, start:end, :] = p.permute(2, 0, 1)
+                else:
+                    plane[:, :, start:end] = p.permute(2, 1, 0)
 
-                # Insert said quadrant into the rotated z-cache
-                quadrant_3_slicer = empty_slicer(z_cache)
-                quadrant_3_slicer[col_dim] = slice(half_n, None)
-
-                z_cache[quadrant_3_slicer] = quadrant_4
-
-                return z_cache
-
-            # Initialize the z cache to the left half of z.
-            z_cache_shape = list(z.shape)
-            z_cache_shape[col_dim] = half_n
-            z_cache = z.new_zeros(z_cache_shape)
-            z_cache_slicer = empty_slicer(z_cache)
-            z_cache_slicer[col_dim] = slice(0, half_n)
-            z_cache.copy_(z[z_cache_slicer])
-            z_cache_rotated = False
-
-            # We need to reorient the z-cache at the halfway point, and we 
-            # don't want a single chunk to straddle that point. We contract one
-            # of the chunks in the middle to address that problem.
-            i_range = list(range(0, half_n, inplace_chunk_size))
-            initial_offsets = [
-                i_2 - i_1 for i_1, i_2 in zip(i_range, i_range[1:] + [half_n])
-            ]
-            after_half = list(range(half_n, n, inplace_chunk_size))
-            after_half_offsets = [inplace_chunk_size for _ in after_half]
-            combined_range_with_offsets = zip(
-                i_range + after_half, initial_offsets + after_half_offsets
-            )
-            for i, offset in combined_range_with_offsets:
-                if(not z_cache_rotated and i >= half_n):
-                    z_cache = flip_z_cache_(z_cache, z)
-                    z_cache_rotated = True
+                del p
 
-                z_chunk_b = slice_tensor(
-                    z, i, i + offset, b_chunk_dim,
-                )
-                mask_chunk = slice_tensor(
-                    mask, i, i + offset, b_chunk_dim,
-                )
+            for start in range(0, n, tile_size):
+                end = min(start + tile_size, n)
 
-                z_chunk_b = z_chunk_b.clone()
-                if(b_chunk_dim == col_dim):
-                    z_chunk_b = slice_tensor(
-                        z, i, i + offset, col_dim
-                    )
-                else: # b_chunk_dim == row_dim
-                    # In this case, the b-dimension (b_chunk_dim) is partially 
-                    # overwritten at the end of each iteration. We need to 
-                    # restore the missing component from the z-cache.
-                    if(not z_cache_rotated):
-                        z_chunk_slicer = empty_slicer(z_chunk_b)
-                        z_chunk_slicer[col_dim] = slice(0, half_n)
-                        z_chunk_b[z_chunk_slicer] = slice_tensor(
-                            z_cache, i, i + offset, row_dim,
-                        )
-                    else:
-                        z_cache_offset = i - half_n
-                        z_chunk_b = slice_tensor(
-                            z_cache, 
-                            z_cache_offset, z_cache_offset + offset, 
-                            row_dim
-                        )
-
-                b_chunk = compute_projection(
-                    z_chunk_b, mask_chunk, a=False, chunked=False
-                )
-                del z_chunk_b
+                # [t, N, C_z] if outgoing, [N, t, C_z] if incoming
+                if(self._outgoing):
+                    z_tile = z_i[start:end]
+                    tile_mask = mask_i[start:end, :, None]
+                else:
+                    z_tile = z_i[:, start:end]
+                    tile_mask = mask_i[:, start:end, None]
 
-                x_chunk = torch.matmul(
-                     a,
-                     b_chunk.contiguous(),
-                )
-                x_chunk = permute_final_dims(x_chunk, (1, 2, 0))
-                x_chunk = self.layer_norm_out(x_chunk)
-                x_chunk = self.linear_z(x_chunk)
-
-                # The g dimension (col_dim) is parallel to and ahead of the 
-                # overwrites in z. We can extract the g chunk normally.
-                z_chunk_g = slice_tensor(
-                    z, i, i + offset, col_dim
+                # [*, 2 * C + C_z]
+                p = self._gated_projection(
+                    self.layer_norm_in(z_tile), tile_mask, tiled,
                 )
-                g_chunk = self.linear_g(self.layer_norm_in(z_chunk_g)) 
-                g_chunk.sigmoid_()
-                del z_chunk_g
-                
-                x_chunk *= g_chunk
-
-                # Write the columns into z in-place
-                z_slicer = empty_slicer(z)
-                z_slicer[col_dim] = slice(i, i + offset)
+                p_tile = p[..., c:2 * c].permute(2, 0, 1)
+                g = p[..., 2 * c:]
+
+                # [C, t, N] if outgoing, [C, N, t] if incoming
+                if(self._outgoing):
+                    x = torch.bmm(p_tile, plane.transpose(-1, -2))
+                else:
+                    x = torch.bmm(plane, p_tile)
+
+                del p_tile
+
+                x = self.layer_norm_out(x.permute(1, 2, 0))
+                x = self.linear_z(x)
+                g.sigmoid_()
+                x *= g
+                del p, g
+
                 if(with_add):
-                    z[z_slicer] += x_chunk
+                    z_tile += x
                 else:
-                    z[z_slicer] = x_chunk
+                    z_tile.copy_(x)
+
+                del x
+
+            del plane
+
+        return z
+
+    def _inference_forward_dap(self,
+        z: torch.Tensor,
+        mask: Optional[torch.Tensor],
+        inplace_chunk_size: Optional[int],
+        with_add: bool,
+        planes: Optional[Tuple[torch.Tensor, ...]],
+    ):
+        """
+        _inference_forward with z split by row among the DAP ranks, which
+        keeps both projections resident.
+        """
+        if mask is None:
+            mask = z.new_ones(z.shape[:-1])
         else:
-            b = compute_projection(z, mask, False, False)
-            x = torch.matmul(a, b)
-            x = self.layer_norm_out(x)
-            x = self.linear_z(x)
-            g = self.linear_g(z)
-            g.sigmoid_()
-            x *= g
-            if(with_add):
-                z += x
+            mask = dap.shard(mask, dim=-2)
+
+        # Rows are local
+        n_rows = z.shape[-3]
+        n = z.shape[-2]
+        c = self.c_hidden
+        tile_size = inplace_chunk_size or DEFAULT_INPLACE_CHUNK_SIZE
+        names = ("linear_a_p", "linear_a_g", "linear_b_p", "linear_b_g")
+
+        # Views, so that z is written in-place
+        z_flat = z.view((-1,) + z.shape[-3:])
+        mask_flat = mask.reshape((-1,) + mask.shape[-2:])
+        for z_i, mask_i in zip(z_flat, mask_flat):
+            # [C, N_rows, N] if outgoing, [C, N, N_rows] if incoming
+            shape = (c, n_rows, n) if self._outgoing else (c, n, n_rows)
+            if(planes is None):
+                a = z.new_empty(shape)
+                b = z.new_empty(shape)
             else:
-                z = x
+                a, b = [p[:shape[0], :shape[1], :shape[2]] for p in planes]
+            for start in range(0, n_rows, tile_size):
+                end = min(start + tile_size, n_rows)
+
+                # [t, N, 4 * C]
+                p = self._gated_projection(
+                    self.layer_norm_in(z_i[start:end]),
+                    mask_i[start:end, :, None],
+                    names,
+                )
+                a_g = p[..., c:2 * c]
+                b_g = p[..., 3 * c:]
+
+                # [C, t, N] if outgoing, [C, N, t] if incoming
+                if(self._outgoing):
+                    a[:, start:end, :] = a_g.permute(2, 0, 1)
+                    b[:, start:end, :] = b_g.permute(2, 0, 1)
+                else:
+                    a[:, :, start:end] = a_g.permute(2, 1, 0)
+                    b[:, :, start:end] = b_g.permute(2, 1, 0)
+
+                del p, a_g, b_g
+
+            if(self._outgoing):
+                b = dap.gather(b, dim=-2)
+            else:
+                a = dap.all_to_all(a, split_dim=-2, cat_dim=-1)
+                b = dap.gather(b, dim=-1)
+
+            b_t = b.transpose(-1, -2)
+            for start in range(0, n_rows, tile_size):
+                end = min(start + tile_size, n_rows)
+
+                # [C, t, N]
+                x = torch.bmm(a[:, start:end, :], b_t)
+
+                # [t, N, C_z]
+                x = self.layer_norm_out(x.permute(1, 2, 0))
+                x = self.linear_z(x)
+
+                z_tile = z_i[start:end]
+                g = self.linear_g(self.layer_norm_in(z_tile))
+                g.sigmoid_()
+                x *= g
+                del g
+
+                if(with_add):
+                    z_tile += x
+                else:
+                    z_tile.copy_(x)
+
+                del x
+
+            del a, b, b_t
 
         return z
 
@@ -373,7 +389,9 @@ class TriangleMultiplicativeUpdate(nn.Module):
         mask: Optional[torch.Tensor] = None,
         inplace_safe: bool = False,
         _add_with_inplace: bool = False,
-        _inplace_chunk_size: Optional[int] = 256,
+        _inplace_chunk_size: Optional[int] = DEFAULT_INPLACE_CHUNK_SIZE,
+        _planes: Optional[Tuple[torch.Tensor, ...]] = None,
+        _dap: bool = False,
     ) -> torch.Tensor:
         """
         Args:
@@ -390,6 +408,8 @@ class TriangleMultiplicativeUpdate(nn.Module):
                 mask, 
                 inplace_chunk_size=_inplace_chunk_size,
                 with_add=_add_with_inplace,
+                planes=_planes,
+                _dap=_dap,
             )
             return x
 
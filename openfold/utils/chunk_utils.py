@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from functools import partial
+import json
 import logging
 import math
-from typing import Tuple, List, Callable, Any, Dict, Sequence, Optional
+import os
+import tempfile
+import time
+from typing import (
+    Tuple, List, Callable, Any, Dict, NamedTuple, Sequence, Optional
+)
 
 import torch
 
@@ -425,3 +431,194 @@ class ChunkSizeTuner:
             self.cached_arg_data = arg_data
 
         return self.cached_chunk_size
+
+
+class ChunkedModule(NamedTuple):
+    """A chunked module of a block, as seen by ChunkPlanTuner."""
+    # Runs the module on representative inputs with the given chunk size
+    fn: Callable[[int], Any]
+    # The size of the chunked dimension
+    max_chunk_size: int
+    # Estimated activation memory per unit of chunk size, in bytes
+    bytes_per_chunk: int
+
+
+def _size_bucket(n: int) -> int:
+    return 2 ** max(math.ceil(math.log2(max(n, 1))), 0)
+
+
+def load_chunk_plans(plan_path: str) -> Dict[str, Dict[str, int]]:
+    """Returns the chunk plans saved at plan_path, if any."""
+    if(not os.path.exists(plan_path)):
+        return {}
+
+    with open(plan_path, "r") as fp:
+        return json.load(fp)
+
+
+def save_chunk_plan(plan_path: str, key: str, plan: Dict[str, int]):
+    """
+    Adds a plan to the file at plan_path. The file is re-read and replaced
+    atomically, so that concurrent processes only risk losing each other's
+    plans, not corrupting the file.
+    """
+    plan_dir = os.path.dirname(os.path.abspath(plan_path))
+    os.makedirs(plan_dir, exist_ok=True)
+
+    plans = load_chunk_plans(plan_path)
+    plans[key] = plan
+
+    fd, tmp_path = tempfile.mkstemp(dir=plan_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            json.dump(plans, fp, indent=4, sort_keys=True)
+        os.rename(tmp_path, plan_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class ChunkPlanTuner:
+    """
+    Tunes the chunk size of each chunked module of a block separately.
+
+    Unlike ChunkSizeTuner, candidates are compared by wall time rather than
+    by whether they raise, which is what matters on CPUs, where running out
+    of memory doesn't surface as a RuntimeError. Candidates whose estimated
+    activations exceed the memory budget are skipped instead.
+
+    The winning plans are saved to a JSON file keyed by the stack, the
+    N_res and N_seq buckets, the dtype and the number of threads, so that
+    later runs load them instead of tuning again.
+    """
+    def __init__(self,
+        name: str,
+        plan_path: Optional[str] = None,
+        memory_budget: Optional[float] = None,
+        no_repeats: int = 2,
+    ):
+        """
+        Args:
+            name:
+                Name of the tuned stack, part of the plan keys
+            plan_path:
+                JSON file of the plans. Plans are only kept in memory if
+                None
+            memory_budget:
+                Maximum activation memory of a chunked module, in GiB
+            no_repeats:
+                Number of timed runs per candidate. The fastest one counts
+        """
+        self.name = name
+        self.plan_path = plan_path
+        self.memory_budget = (
+            None if memory_budget is None else int(memory_budget * 1024**3)
+        )
+        self.no_repeats = no_repeats
+
+        self.plans = {}
+        if(plan_path is not None):
+            self.plans = load_chunk_plans(plan_path)
+
+    def _plan_key(self, n_res: int, n_seq: int, dtype: torch.dtype) -> str:
+        return "/".join([
+            self.name,
+            f"res{_size_bucket(n_res)}",
+            f"seq{_size_bucket(n_seq)}",
+            str(dtype).replace("torch.", ""),
+            f"threads{torch.get_num_threads()}",
+        ])
+
+    def _fits(self, chunk_size: int, module: ChunkedModule) -> bool:
+        return (
+            self.memory_budget is None or
+            min(chunk_size, module.max_chunk_size) * module.bytes_per_chunk
+                <= self.memory_budget
+        )
+
+    def _time(self, fn: Callable[[int], Any], chunk_size: int) -> float:
+        best = math.inf
+        with torch.no_grad():
+            for _ in range(self.no_repeats):
+                start = time.perf_counter()
+                fn(chunk_size)
+                best = min(best, time.perf_counter() - start)
+
+        return best
+
+    def _determine_fastest_chunk_size(self,
+        module: ChunkedModule,
+        min_chunk_size: int,
+    ) -> int:
+        candidates = [min_chunk_size]
+        while(candidates[-1] < module.max_chunk_size):
+            candidates.append(min(candidates[-1] * 2, module.max_chunk_size))
+        candidates = [c for c in candidates if self._fits(c, module)]
+        if(len(candidates) == 0):
+            return min_chunk_size
+
+        best_chunk_size, best_time = None, math.inf
+        for c in candidates:
+            t = self._time(module.fn, c)
+            if(t < best_time):
+                best_chunk_size, best_time = c, t
+            elif(t > 1.1 * best_time):
+                # Past the optimum. Larger chunks only use more memory
+                break
+
+        return best_chunk_size
+
+    def _fit_plan(self,
+        plan: Dict[str, int],
+        modules: Dict[str, ChunkedModule],
+        min_chunk_size: int,
+    ) -> Dict[str, int]:
+        # A loaded plan may come from smaller inputs of the same bucket
+        fitted = {}
+        for name, chunk_size in plan.items():
+            while(chunk_size > min_chunk_size and
+                  not self._fits(chunk_size, modules[name])):
+                chunk_size = max(chunk_size // 2, min_chunk_size)
+            fitted[name] = chunk_size
+
+        return fitted
+
+    def tune_chunk_plan(self,
+        modules: Dict[str, ChunkedModule],
+        n_res: int,
+        n_seq: int,
+        dtype: torch.dtype,
+        min_chunk_size: int,
+    ) -> Dict[str, int]:
+        """
+        Args:
+            modules:
+                The chunked modules to tune, by name
+            n_res:
+                Number of residues of the inputs
+            n_seq:
+                Number of sequences of the inputs
+            dtype:
+                Data type of the activations
+            min_chunk_size:
+                The smallest chunk size to consider
+        Returns:
+            The chunk size of each module
+        """
+        key = self._plan_key(n_res, n_seq, dtype)
+        plan = self.plans.get(key)
+        if(plan is not None and set(plan.keys()) == set(modules.keys())):
+            return self._fit_plan(plan, modules, min_chunk_size)
+
+        logging.info(f"Tuning chunk sizes for {key}...")
+        plan = {
+            name: self._determine_fastest_chunk_size(module, min_chunk_size)
+            for name, module in modules.items()
+        }
+        logging.info(f"Chunk sizes for {key}: {plan}")
+
+        self.plans[key] = plan
+        if(self.plan_path is not None):
+            save_chunk_plan(self.plan_path, key, plan)
+
+        return plan
@@ -0,0 +1,175 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Dynamic axial parallelism (DAP) for inference, after FastFold. The stacks
+of a single input are split among the ranks of the default process group:
+pair embeddings by row, and the MSA embedding by sequence for the row
+attention and by residue for the rest of a block. Axial operations along
+the split dimension are preceded by an all-to-all transpose, or by an
+all-gather of their small per-pair inputs, e.g. attention biases.
+
+Both dimensions are padded to a multiple of the number of ranks. The
+padding is masked, so that the predictions don't depend on the number of
+ranks beyond rounding.
+"""
+import os
+from typing import Any, Sequence, Tuple
+
+import torch
+import torch.distributed as dist
+
+
+# Rank and world size variables set by the launchers, in order of priority
+_ENV_VARS = [
+    ("RANK", "WORLD_SIZE"), # torchrun
+    ("OMPI_COMM_WORLD_RANK", "OMPI_COMM_WORLD_SIZE"), # Open MPI, Fujitsu MPI
+    ("PMI_RANK", "PMI_SIZE"), # MPICH
+]
+
+
+def _rank_from_env() -> Tuple[int, int]:
+    for rank_var, size_var in _ENV_VARS:
+        if(rank_var in os.environ and size_var in os.environ):
+            return int(os.environ[rank_var]), int(os.environ[size_var])
+
+    return 0, 1
+
+
+def init_dap(backend: str = "gloo", init_method: str = "env://"):
+    """
+    Initializes the default process group, unless already initialized.
+
+    Args:
+        backend:
+            "gloo" or "mpi". With "gloo", the rank and world size are read
+            from the variables set by torchrun or mpiexec
+        init_method:
+            URL of the rendezvous. With "env://", MASTER_ADDR and
+            MASTER_PORT must be set. "file://" URLs on a shared file
+            system need neither
+    """
+    if(is_initialized()):
+        return
+
+    kwargs = {}
+    if(backend != "mpi"):
+        kwargs["rank"], kwargs["world_size"] = _rank_from_env()
+
+    dist.init_process_group(backend, init_method=init_method, **kwargs)
+
+
+def is_initialized() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_initialized() else 1
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_initialized() else 0
+
+
+def broadcast_object(obj: Any, src: int = 0) -> Any:
+    """Returns the object of the source rank on all ranks."""
+    if(get_world_size() == 1):
+        return obj
+
+    objs = [obj]
+    dist.broadcast_object_list(objs, src=src)
+
+    return objs[0]
+
+
+def pad(t: torch.Tensor, dims: Sequence[int]) -> torch.Tensor:
+    """Zero-pads dimensions of a tensor to a multiple of the world size."""
+    world_size = get_world_size()
+    for dim in dims:
+        n = t.shape[dim]
+        padding = -n % world_size
+        if(padding == 0):
+            continue
+
+        shape = list(t.shape)
+        shape[dim] = padding
+        t = torch.cat([t, t.new_zeros(shape)], dim=dim)
+
+    return t
+
+
+def unpad(t: torch.Tensor, dims: Sequence[int], n: int) -> torch.Tensor:
+    """Removes the padding of pad() from dimensions originally of size n."""
+    for dim in dims:
+        t = t.narrow(dim, 0, n)
+
+    return t
+
+
+def shard(t: torch.Tensor, dim: int) -> torch.Tensor:
+    """The part of a padded tensor along a dimension local to this rank."""
+    world_size = get_world_size()
+    if(world_size == 1):
+        return t
+
+    size = t.shape[dim] // world_size
+
+    return t.narrow(dim, get_rank() * size, size)
+
+
+def gather(t: torch.Tensor, dim: int) -> torch.Tensor:
+    """Concatenates the parts of a tensor of all ranks along a dimension."""
+    world_size = get_world_size()
+    if(world_size == 1):
+        return t
+
+    t = t.contiguous()
+    parts = [torch.empty_like(t) for _ in range(world_size)]
+    dist.all_gather(parts, t)
+
+    return torch.cat(parts, dim=dim)
+
+
+def all_to_all(
+    t: torch.Tensor,
+    split_dim: int,
+    cat_dim: int,
+) -> torch.Tensor:
+    """
+    Moves the split of a tensor among the ranks from one dimension to
+    another. The tensor is split along split_dim, the i-th part is sent to
+    rank i and the parts received are concatenated along cat_dim.
+    """
+    world_size = get_world_size()
+    if(world_size == 1):
+        return t
+
+    rank = get_rank()
+    parts = [p.contiguous() for p in torch.chunk(t, world_size, dim=split_dim)]
+    received = [torch.empty_like(p) for p in parts]
+    if(dist.get_backend() == "gloo"):
+        # Gloo has no all-to-all
+        requests = []
+        for peer in range(world_size):
+            if(peer == rank):
+                received[peer] = parts[peer]
+                continue
+            requests.append(dist.isend(parts[peer], peer))
+            requests.append(dist.irecv(received[peer], peer))
+        for request in requests:
+            request.wait()
+    else:
+        dist.all_to_all(received, parts)
+
+    return torch.cat(received, dim=cat_dim)
@@ -21,13 +21,19 @@ import torch
 if torch.cuda.is_available():
     attn_core_inplace_cuda = importlib.import_module("attn_core_inplace_cuda")
 else:
-    import openfold.utils.kernel.attention_core_cpu as attn_core_inplace_cuda
+    try:
+        # Built by setup.py from csrc/softmax_cpu.cpp
+        attn_core_inplace_cuda = importlib.import_module("attn_core_inplace_cpu")
+    except ImportError:
+        import openfold.utils.kernel.attention_core_cpu as attn_core_inplace_cuda
 
 
 SUPPORTED_DTYPES = [torch.float32, torch.bfloat16]
 
 _recompute = False
+_flash = False
 chunk_size = 256
+kv_chunk_size = 256
 seq_dim = -4
 
 def split_chunks(tensor, dim_size, chunk_size, dim):
@@ -192,4 +198,183 @@ class AttentionCoreFunction(torch.autograd.Function):
 
         return grad_q, grad_k, grad_v, grad_bias_1, grad_bias_2
 
-attention_core = AttentionCoreFunction.apply
+
+
+def _kv_slice(bias, kv_s, kv_e):
+    if bias is None or bias.shape[-1] == 1:
+        return bias
+    return bias[..., kv_s:kv_e]
+
+
+def _block_logits(q, k, bias_1, bias_2, kv_s, kv_e):
+    # [*, H, Q, K_blk], in float32 so that the running statistics of
+    # bfloat16 inputs don't lose precision
+    s = torch.matmul(q, k[..., kv_s:kv_e, :].transpose(-1, -2)).float()
+    for b in (bias_1, bias_2):
+        if(b is not None):
+            s += _kv_slice(b, kv_s, kv_e)
+    return s
+
+
+def _accumulate_bias_grad(grad_bias, ds, kv_s, kv_e):
+    # Sums the gradient of the logits over the broadcast dims of the bias
+    lead = ds.dim() - grad_bias.dim()
+    if(lead > 0):
+        ds = torch.sum(ds, dim=tuple(range(lead)))
+    dims = tuple(
+        i for i, d in enumerate(grad_bias.shape[:-1])
+        if d == 1 and ds.shape[i] != 1
+    )
+    if(len(dims) > 0):
+        ds = torch.sum(ds, dim=dims, keepdim=True)
+    if(grad_bias.shape[-1] == 1):
+        grad_bias.add_(torch.sum(ds, dim=-1, keepdim=True))
+    else:
+        grad_bias[..., kv_s:kv_e].add_(ds)
+
+
+class FlashAttentionCoreFunction(torch.autograd.Function):
+    """
+    Single-pass attention streaming over blocks of kv_chunk_size keys and
+    values. The softmax is computed online with a running max and sum as
+    in _lma in primitives.py, so that the [*, H, Q, K] logits are never
+    materialized. Only their log-sum-exp is kept for the backward pass,
+    which recomputes the probabilities block by block.
+    """
+    @staticmethod
+    def forward(ctx, q, k, v, bias_1=None, bias_2=None):
+        if(bias_1 is None and bias_2 is not None):
+            raise ValueError("bias_1 must be specified before bias_2")
+        if(q.dtype not in SUPPORTED_DTYPES):
+            raise ValueError("Unsupported datatype")
+
+        q = q.contiguous()
+        k = k.contiguous()
+        v = v.contiguous()
+        no_kv = k.shape[-2]
+
+        o = torch.empty_like(q)
+        # [*, H, Q]
+        lse = torch.empty(q.shape[:-1], dtype=torch.float32, device=q.device)
+
+        for q_c, k_c, v_c, b1_c, b2_c, o_c, lse_c in zip(torch.split(q, chunk_size, dim=seq_dim),
+                                                         torch.split(k, chunk_size, dim=seq_dim),
+                                                         torch.split(v, chunk_size, dim=seq_dim),
+                                                         split_chunks(bias_1, q.shape[seq_dim], chunk_size, dim=seq_dim),
+                                                         split_chunks(bias_2, q.shape[seq_dim], chunk_size, dim=seq_dim),
+                                                         torch.split(o, chunk_size, dim=seq_dim),
+                                                         torch.split(lse, chunk_size, dim=seq_dim + 1)):
+            max_s = sum_p = acc = None
+            for kv_s in range(0, no_kv, kv_chunk_size):
+                kv_e = kv_s + kv_chunk_size
+                s = _block_logits(q_c, k_c, b1_c, b2_c, kv_s, kv_e)
+                block_max = torch.amax(s, dim=-1, keepdim=True)
+                if(max_s is None):
+                    new_max = block_max
+                else:
+                    new_max = torch.maximum(max_s, block_max)
+
+                # [*, H, Q, K_blk]
+                p = s.sub_(new_max).exp_()
+                pv = torch.matmul(p.to(v_c.dtype), v_c[..., kv_s:kv_e, :])
+                if(max_s is None):
+                    sum_p = torch.sum(p, dim=-1, keepdim=True)
+                    acc = pv.float()
+                else:
+                    scale = torch.exp(max_s - new_max)
+                    sum_p.mul_(scale).add_(torch.sum(p, dim=-1, keepdim=True))
+                    acc.mul_(scale).add_(pv)
+                max_s = new_max
+
+            o_c.copy_(acc.div_(sum_p))
+            lse_c.copy_((max_s + torch.log(sum_p)).squeeze(-1))
+
+        ctx.save_for_backward(q, k, v, o, lse, bias_1, bias_2)
+
+        return o
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        q, k, v, o, lse, bias_1, bias_2 = ctx.saved_tensors
+        no_kv = k.shape[-2]
+
+        grad_q = torch.empty_like(q)
+        grad_k = torch.empty_like(k)
+        grad_v = torch.empty_like(v)
+        grad_bias_1 = grad_bias_2 = None
+        if(bias_1 is not None and ctx.needs_input_grad[3]):
+            grad_bias_1 = torch.zeros(
+                bias_1.shape, dtype=torch.float32, device=q.device
+            )
+        if(bias_2 is not None and ctx.needs_input_grad[4]):
+            grad_bias_2 = torch.zeros(
+                bias_2.shape, dtype=torch.float32, device=q.device
+            )
+
+        for q_c, k_c, v_c, b1_c, b2_c, o_c, lse_c, g_out_c, g_q_c, g_k_c, g_v_c, g_b1_c, g_b2_c in \
+            zip(torch.split(q, chunk_size, dim=seq_dim),
+                torch.split(k, chunk_size, dim=seq_dim),
+                torch.split(v, chunk_size, dim=seq_dim),
+                split_chunks(bias_1, q.shape[seq_dim], chunk_size, dim=seq_dim),
+                split_chunks(bias_2, q.shape[seq_dim], chunk_size, dim=seq_dim),
+                torch.split(o, chunk_size, dim=seq_dim),
+                torch.split(lse, chunk_size, dim=seq_dim + 1),
+                torch.split(grad_output, chunk_size, dim=seq_dim),
+                torch.split(grad_q, chunk_size, dim=seq_dim),
+                torch.split(grad_k, chunk_size, dim=seq_dim),
+                torch.split(grad_v, chunk_size, dim=seq_dim),
+                split_chunks(grad_bias_1, q.shape[seq_dim], chunk_size, dim=seq_dim),
+                split_chunks(grad_bias_2, q.shape[seq_dim], chunk_size, dim=seq_dim),
+            ):
+            g_out_c = g_out_c.contiguous()
+            lse_c = lse_c.unsqueeze(-1)
+            # [*, H, Q, 1], the sum of P * dP over the keys
+            delta = torch.sum(
+                g_out_c.float() * o_c.float(), dim=-1, keepdim=True
+            )
+
+            g_q_acc = torch.zeros(
+                q_c.shape, dtype=torch.float32, device=q.device
+            )
+            for kv_s in range(0, no_kv, kv_chunk_size):
+                kv_e = kv_s + kv_chunk_size
+                k_b = k_c[..., kv_s:kv_e, :]
+                v_b = v_c[..., kv_s:kv_e, :]
+
+                # [*, H, Q, K_blk]
+                p = _block_logits(q_c, k_c, b1_c, b2_c, kv_s, kv_e)
+                p.sub_(lse_c).exp_()
+
+                g_v_c[..., kv_s:kv_e, :] = torch.matmul(
+                    p.to(v_b.dtype).transpose(-1, -2), g_out_c
+                )
+
+                # dS = P * (dP - delta)
+                dp = torch.matmul(g_out_c, v_b.transpose(-1, -2)).float()
+                ds = p.mul_(dp.sub_(delta))
+
+                if(g_b1_c is not None):
+                    _accumulate_bias_grad(g_b1_c, ds, kv_s, kv_e)
+                if(g_b2_c is not None):
+                    _accumulate_bias_grad(g_b2_c, ds, kv_s, kv_e)
+
+                ds = ds.to(q_c.dtype)
+                g_q_acc.add_(torch.matmul(ds, k_b))
+                g_k_c[..., kv_s:kv_e, :] = torch.matmul(
+                    ds.transpose(-1, -2), q_c
+                )
+
+            g_q_c.copy_(g_q_acc)
+
+        if(grad_bias_1 is not None):
+            grad_bias_1 = grad_bias_1.to(bias_1.dtype)
+        if(grad_bias_2 is not None):
+            grad_bias_2 = grad_bias_2.to(bias_2.dtype)
+
+        return grad_q, grad_k, grad_v, grad_bias_1, grad_bias_2
+
+
+def attention_core(q, k, v, bias_1=None, bias_2=None):
+    if _flash:
+        return FlashAttentionCoreFunction.apply(q, k, v, bias_1, bias_2)
+    return AttentionCoreFunction.apply(q, k, v, bias_1, bias_2)
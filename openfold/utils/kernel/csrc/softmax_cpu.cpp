@@ -0,0 +1,227 @@
+// Copyright 2023 RIKEN & Fujitsu Limited
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+// CPU counterpart of softmax_cuda.cpp with the same interface. Rows are
+// distributed over the OpenMP threads of ATen and every row is processed
+// in a float buffer with loops written to be vectorized by the compiler.
+
+#include <torch/extension.h>
+#include <ATen/Parallel.h>
+
+#include <cmath>
+#include <limits>
+#include <vector>
+
+#include "compat.h"
+
+#define CHECK_CPU(x) TORCH_CHECK(!x.is_cuda(), #x " must be a CPU tensor")
+#define CHECK_DTYPE(x) \
+    TORCH_CHECK(x.scalar_type() == at::kFloat || x.scalar_type() == at::kBFloat16, \
+                #x " must be float32 or bfloat16")
+#define CHECK_INPUT(x) \
+    CHECK_CPU(x);      \
+    CHECK_DTYPE(x)
+
+// Rows handed to a thread at once
+constexpr int64_t GRAIN_SIZE = 16;
+
+
+template<typename T>
+void softmax_rows_(T *input, int64_t begin, int64_t end, int cols) {
+    std::vector<float> buf(cols);
+    float *b = buf.data();
+
+    for (int64_t row = begin; row < end; row++) {
+        T *x = input + row * cols;
+
+        float row_max = -std::numeric_limits<float>::infinity();
+        #pragma omp simd reduction(max:row_max)
+        for (int i = 0; i < cols; i++) {
+            b[i] = static_cast<float>(x[i]);
+            row_max = b[i] > row_max ? b[i] : row_max;
+        }
+
+        float sum = 0.f;
+        #pragma omp simd reduction(+:sum)
+        for (int i = 0; i < cols; i++) {
+            b[i] = std::exp(b[i] - row_max);
+            sum += b[i];
+        }
+
+        const float inv_sum = 1.f / sum;
+        #pragma omp simd
+        for (int i = 0; i < cols; i++) {
+            x[i] = static_cast<T>(b[i] * inv_sum);
+        }
+    }
+}
+
+
+template<typename T>
+void softmax_grad_rows_(
+    T *output,
+    const T *d_ov,
+    const T *values,
+    int64_t begin, int64_t end,
+    int64_t rows_per_matrix,
+    int cols_output,
+    int cols_values
+) {
+    std::vector<float> y_buf(cols_output);
+    std::vector<float> dy_buf(cols_output);
+    std::vector<float> d_ov_buf(cols_values);
+    float *y = y_buf.data();
+    float *dy = dy_buf.data();
+    float *g = d_ov_buf.data();
+
+    for (int64_t row = begin; row < end; row++) {
+        T *row_output = output + row * cols_output;
+        const T *row_d_ov = d_ov + row * cols_values;
+        // The cols_output x cols_values value matrix of the row
+        const T *row_values =
+            values + (row / rows_per_matrix) * cols_output * cols_values;
+
+        #pragma omp simd
+        for (int j = 0; j < cols_values; j++) {
+            g[j] = static_cast<float>(row_d_ov[j]);
+        }
+
+        // The output gradient of the row, computed on the fly
+        float sum = 0.f;
+        for (int i = 0; i < cols_output; i++) {
+            const T *v = row_values + (int64_t)i * cols_values;
+            float dot = 0.f;
+            #pragma omp simd reduction(+:dot)
+            for (int j = 0; j < cols_values; j++) {
+                dot += g[j] * static_cast<float>(v[j]);
+            }
+            dy[i] = dot;
+            y[i] = static_cast<float>(row_output[i]);
+            sum += y[i] * dot;
+        }
+
+        #pragma omp simd
+        for (int i = 0; i < cols_output; i++) {
+            row_output[i] = static_cast<T>((dy[i] - sum) * y[i]);
+        }
+    }
+}
+
+
+void attn_softmax_inplace_forward_(
+    at::Tensor input,
+    long long rows, int cols
+) {
+    CHECK_INPUT(input);
+    TORCH_CHECK(input.numel() == rows * cols, "input must have rows * cols elements");
+
+    at::Tensor x = input.contiguous();
+
+    if (x.scalar_type() == at::kFloat) {
+        float *ptr = x.DATA_PTR<float>();
+        at::parallel_for(0, rows, GRAIN_SIZE, [&](int64_t begin, int64_t end) {
+            softmax_rows_<float>(ptr, begin, end, cols);
+        });
+    }
+    else {
+        at::BFloat16 *ptr = x.DATA_PTR<at::BFloat16>();
+        at::parallel_for(0, rows, GRAIN_SIZE, [&](int64_t begin, int64_t end) {
+            softmax_rows_<at::BFloat16>(ptr, begin, end, cols);
+        });
+    }
+
+    if (!input.is_contiguous()) {
+        input.copy_(x);
+    }
+}
+
+
+void attn_softmax_inplace_backward_(
+    at::Tensor output,
+    at::Tensor d_ov,
+    at::Tensor values,
+    long long rows,
+    int cols_output,
+    int cols_values
+) {
+    CHECK_INPUT(output);
+    CHECK_INPUT(d_ov);
+    CHECK_INPUT(values);
+    TORCH_CHECK(
+        d_ov.scalar_type() == output.scalar_type() &&
+        values.scalar_type() == output.scalar_type(),
+        "output, d_ov and values must have the same dtype"
+    );
+    TORCH_CHECK(output.numel() == rows * cols_output, "output must have rows * cols_output elements");
+    TORCH_CHECK(d_ov.numel() == rows * cols_values, "d_ov must have rows * cols_values elements");
+
+    // Unlike the CUDA kernel, the number of rows sharing a value matrix
+    // needn't equal cols_output
+    int64_t matrix_size = (int64_t)cols_output * cols_values;
+    TORCH_CHECK(
+        matrix_size > 0 && values.numel() % matrix_size == 0,
+        "values must consist of cols_output x cols_values matrices"
+    );
+    int64_t no_matrices = values.numel() / matrix_size;
+    TORCH_CHECK(
+        no_matrices > 0 && rows % no_matrices == 0,
+        "rows must be a multiple of the number of value matrices"
+    );
+    int64_t rows_per_matrix = rows / no_matrices;
+
+    at::Tensor y = output.contiguous();
+    at::Tensor g = d_ov.contiguous();
+    at::Tensor v = values.contiguous();
+
+    if (y.scalar_type() == at::kFloat) {
+        float *y_ptr = y.DATA_PTR<float>();
+        const float *g_ptr = g.DATA_PTR<float>();
+        const float *v_ptr = v.DATA_PTR<float>();
+        at::parallel_for(0, rows, GRAIN_SIZE, [&](int64_t begin, int64_t end) {
+            softmax_grad_rows_<float>(
+                y_ptr, g_ptr, v_ptr, begin, end,
+                rows_per_matrix, cols_output, cols_values
+            );
+        });
+    }
+    else {
+        at::BFloat16 *y_ptr = y.DATA_PTR<at::BFloat16>();
+        const at::BFloat16 *g_ptr = g.DATA_PTR<at::BFloat16>();
+        const at::BFloat16 *v_ptr = v.DATA_PTR<at::BFloat16>();
+        at::parallel_for(0, rows, GRAIN_SIZE, [&](int64_t begin, int64_t end) {
+            softmax_grad_rows_<at::BFloat16>(
+                y_ptr, g_ptr, v_ptr, begin, end,
+                rows_per_matrix, cols_output, cols_values
+            );
+        });
+    }
+
+    if (!output.is_contiguous()) {
+        output.copy_(y);
+    }
+}
+
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+    m.def(
+        "forward_",
+        &attn_softmax_inplace_forward_,
+        "Softmax forward (CPU)"
+    );
+    m.def(
+        "backward_",
+        &attn_softmax_inplace_backward_,
+        "Softmax backward (CPU)"
+    );
+}
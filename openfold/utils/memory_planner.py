@@ -0,0 +1,426 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Chooses the inference settings of the model from a memory budget.
+
+The peak activation memory of every stage of the model is estimated from
+the input sizes and the settings that trade speed for memory: the chunk
+size, low-memory attention, offloading and template averaging. The first
+candidate that fits the budget is taken, in an order of increasing
+expected slowdown.
+"""
+import contextlib
+import dataclasses
+import logging
+from typing import Any, Dict, Iterator, Optional
+
+import ml_collections as mlc
+
+
+# Chunk sizes considered, from the fastest
+CHUNK_SIZES = [None, 1024, 512, 256, 128, 64, 32, 16, 8, 4, 2, 1]
+
+# DEFAULT_LMA_Q_CHUNK_SIZE and DEFAULT_LMA_KV_CHUNK_SIZE in primitives.py
+LMA_Q_CHUNK_SIZE = 1024
+LMA_KV_CHUNK_SIZE = 4096
+
+# DEFAULT_OPM_CHUNK_SIZE in outer_product_mean.py
+OPM_CHUNK_SIZE = 32
+
+# DEFAULT_INPLACE_CHUNK_SIZE in triangular_multiplicative_update.py
+TRI_MUL_TILE_SIZE = 256
+
+# chunk_size and kv_chunk_size in utils/kernel/attention_core.py
+FLASH_SEQ_CHUNK_SIZE = 256
+FLASH_KV_CHUNK_SIZE = 256
+
+STAGES = [
+    "input_embedder",
+    "template_stack",
+    "extra_msa_stack",
+    "evoformer",
+    "structure_module",
+]
+
+
+@dataclasses.dataclass(frozen=True)
+class InferencePlan:
+    chunk_size: Optional[int]
+    use_lma: bool
+    offload_inference: bool
+    offload_templates: bool
+    average_templates: bool
+    # Estimated peak activation memory of each stage in bytes
+    stage_memory: Dict[str, int]
+
+    @property
+    def peak_memory(self) -> int:
+        return max(self.stage_memory.values())
+
+    def __str__(self) -> str:
+        gib = lambda b: f"{b / 1024**3:.2f}GiB"
+        return ", ".join([
+            f"chunk_size={self.chunk_size}",
+            f"use_lma={self.use_lma}",
+            f"offload_inference={self.offload_inference}",
+            f"offload_templates={self.offload_templates}",
+            f"average_templates={self.average_templates}",
+            f"peak_memory={gib(self.peak_memory)}",
+        ] + [f"{k}={gib(v)}" for k, v in self.stage_memory.items()])
+
+
+def _rows(chunk_size: Optional[int], n: int) -> int:
+    return n if chunk_size is None else min(chunk_size, n)
+
+
+def _attention_memory(
+    rows: int,
+    no_heads: int,
+    q: int,
+    k: int,
+    use_lma: bool,
+    flash_attention: bool,
+) -> int:
+    """Number of logits elements alive in an attention over rows rows."""
+    if(use_lma):
+        # The logits and their exponentials
+        return 2 * rows * no_heads * min(q, LMA_Q_CHUNK_SIZE) * min(
+            k, LMA_KV_CHUNK_SIZE
+        )
+    elif(flash_attention):
+        # Float32 regardless of the activations, hence counted twice for
+        # bfloat16
+        return 2 * min(rows, FLASH_SEQ_CHUNK_SIZE) * no_heads * q * min(
+            k, FLASH_KV_CHUNK_SIZE
+        )
+
+    return rows * no_heads * q * k
+
+
+def _tri_mul_memory(n_res: int, c_hidden: int, c_z: int) -> int:
+    """
+    Number of elements alive in the inplace triangle multiplicative update:
+    the resident [C_hidden, N, N] plane and the transients of a tile, at
+    most its projections and gate, its update and the layer norm of the
+    latter in the second sweep.
+    """
+    tile = min(TRI_MUL_TILE_SIZE, n_res) * n_res
+    return n_res ** 2 * c_hidden + tile * (2 * c_z + 4 * c_hidden)
+
+
+def _block_transient(
+    stack_config: mlc.ConfigDict,
+    n_res: int,
+    n_seq: int,
+    chunk_size: Optional[int],
+    use_lma: bool,
+    flash_attention: bool,
+    global_column_attention: bool,
+) -> int:
+    """Largest transient of an Evoformer or extra MSA block, in elements."""
+    c = stack_config
+    c_max = max(c.c_m, c.c_z)
+
+    if(global_column_attention):
+        msa_col = _rows(chunk_size, n_res) * n_seq * 3 * c.c_m
+    else:
+        msa_col = _attention_memory(
+            _rows(chunk_size, n_res), c.no_heads_msa, n_seq, n_seq,
+            use_lma, flash_attention,
+        )
+
+    transients = [
+        # MSA row attention with pair bias
+        _attention_memory(
+            _rows(chunk_size, n_seq), c.no_heads_msa, n_res, n_res,
+            use_lma, flash_attention,
+        ) + n_res ** 2 * c.no_heads_msa,
+        msa_col,
+        # Outer product mean and its output. Computed by blocks of rows
+        # even without chunking
+        _rows(chunk_size or OPM_CHUNK_SIZE, n_res) * n_res *
+            c.c_hidden_opm ** 2 + n_res ** 2 * c.c_z,
+        # Inplace triangle multiplicative update
+        _tri_mul_memory(n_res, c.c_hidden_mul, c.c_z),
+        # Triangle attention
+        _attention_memory(
+            _rows(chunk_size, n_res), c.no_heads_pair, n_res, n_res,
+            use_lma, flash_attention,
+        ) + n_res ** 2 * c.no_heads_pair,
+        # Transitions
+        _rows(chunk_size, max(n_seq, n_res)) * n_res * c.transition_n * c_max,
+    ]
+
+    return max(transients)
+
+
+def estimate_stage_memory(
+    model_config: mlc.ConfigDict,
+    n_res: int,
+    n_msa: int,
+    n_extra: int,
+    n_templ: int,
+    chunk_size: Optional[int],
+    use_lma: bool = False,
+    offload_inference: bool = False,
+    offload_templates: bool = False,
+    average_templates: bool = False,
+    flash_attention: bool = False,
+    batch_size: int = 1,
+    itemsize: int = 4,
+) -> Dict[str, int]:
+    """
+    Estimates the peak activation memory of each stage of the model.
+
+    Args:
+        model_config:
+            The "model" section of the config
+        n_res:
+            Number of residues
+        n_msa:
+            Number of MSA clusters, including template rows
+        n_extra:
+            Number of extra MSA sequences
+        n_templ:
+            Number of templates
+        chunk_size:
+            Inference-time subbatch size
+        use_lma:
+            Whether low-memory attention is used
+        offload_inference:
+            Whether MSA and pair activations are offloaded to the CPU
+        offload_templates:
+            Whether template embeddings are offloaded to the CPU
+        average_templates:
+            Whether template embeddings are averaged on the fly
+        flash_attention:
+            Whether the single-pass attention kernel is used
+        batch_size:
+            Number of inputs in the batch
+        itemsize:
+            Size of an activation element in bytes
+    Returns:
+        The estimated peak activation memory of each stage in bytes
+    """
+    c_m = model_config.evoformer_stack.c_m
+    c_z = model_config.evoformer_stack.c_z
+    c_e = model_config.extra_msa.extra_msa_stack.c_m
+    n_res2 = n_res ** 2
+
+    # MSA, pair and recycled pair embeddings
+    msa = n_msa * n_res * c_m
+    pair = 2 * n_res2 * c_z
+    extra = n_extra * n_res * c_e
+
+    stages = {}
+
+    relpos_bins = 2 * model_config.input_embedder.relpos_k + 1
+    stages["input_embedder"] = (
+        n_res2 * (2 * c_z + relpos_bins) +
+        n_msa * n_res * (c_m + model_config.input_embedder.msa_dim)
+    )
+
+    templ = model_config.template
+    if(templ.enabled and n_templ > 0):
+        tps = templ.template_pair_stack
+        kept_templ = n_templ
+        if(offload_templates or average_templates):
+            kept_templ = 1
+        templ_transient = max(
+            n_res2 * templ.template_pair_embedder.c_in,
+            _tri_mul_memory(n_res, tps.c_hidden_tri_mul, tps.c_t),
+            _attention_memory(
+                _rows(chunk_size, n_res), tps.no_heads, n_res, n_res,
+                use_lma, flash_attention,
+            ),
+            _rows(chunk_size, n_res) * n_res * tps.pair_transition_n * tps.c_t,
+            # Pointwise attention over the templates
+            n_res2 * n_templ * templ.template_pointwise_attention.no_heads,
+        )
+        stages["template_stack"] = (
+            pair + msa + kept_templ * n_res2 * tps.c_t + templ_transient
+        )
+
+    ems = model_config.extra_msa.extra_msa_stack
+    if(model_config.extra_msa.enabled and n_extra > 0):
+        # The extra MSA and pair embeddings take turns on the device
+        resident = max(extra, pair) if offload_inference else extra + pair
+        stages["extra_msa_stack"] = msa + resident + _block_transient(
+            ems, n_res, n_extra, chunk_size, use_lma, flash_attention,
+            global_column_attention=True,
+        )
+
+    resident = max(msa, pair) if offload_inference else msa + pair
+    stages["evoformer"] = resident + _block_transient(
+        model_config.evoformer_stack, n_res, n_msa, chunk_size, use_lma,
+        flash_attention, global_column_attention=False,
+    )
+
+    sm = model_config.structure_module
+    heads = model_config.heads
+    no_bins = heads.distogram.no_bins
+    if(heads.tm.enabled):
+        no_bins += heads.tm.no_bins
+    stages["structure_module"] = msa + pair + n_res2 * (
+        c_z + 3 * sm.no_heads_ipa + no_bins
+    )
+
+    return {
+        k: v * batch_size * itemsize for k, v in stages.items()
+    }
+
+
+def _candidates(
+    templates_used: bool,
+    offload: bool,
+    offload_templates: bool,
+) -> Iterator[Dict[str, bool]]:
+    # Chunking is preferred to LMA and offloading, which are slower.
+    # Averaging templates changes the results slightly, so it comes last
+    template_modes = [(False, False)]
+    if(templates_used and offload_templates):
+        template_modes.append((True, False))
+    average_modes = [False, True] if templates_used else [False]
+    for average_templates in average_modes:
+        for use_lma in (False, True):
+            for offload_inference in ((False, True) if offload else (False,)):
+                for offload_templates, _ in template_modes:
+                    if(average_templates and offload_templates):
+                        continue
+                    for chunk_size in CHUNK_SIZES:
+                        yield {
+                            "chunk_size": chunk_size,
+                            "use_lma": use_lma,
+                            "offload_inference": offload_inference,
+                            "offload_templates": offload_templates,
+                            "average_templates": average_templates,
+                        }
+
+
+def plan_inference(
+    model_config: mlc.ConfigDict,
+    n_res: int,
+    n_msa: int,
+    n_extra: int,
+    n_templ: int,
+    memory_budget: float,
+    offload: bool = False,
+    offload_templates: Optional[bool] = None,
+    flash_attention: bool = False,
+    batch_size: int = 1,
+    itemsize: int = 4,
+    fixed: Optional[Dict[str, Any]] = None,
+) -> InferencePlan:
+    """
+    Picks the fastest settings whose estimated peak activation memory fits
+    the budget.
+
+    Args:
+        model_config:
+            The "model" section of the config
+        n_res, n_msa, n_extra, n_templ:
+            Input sizes, as in estimate_stage_memory
+        memory_budget:
+            Activation memory available to the process in GiB
+        offload:
+            Whether offloading the MSA and pair activations is an option,
+            i.e. whether the model runs on an accelerator or spills them
+            to local storage
+        offload_templates:
+            Whether offloading template embeddings to the CPU is an option.
+            Defaults to offload
+        flash_attention:
+            Whether the single-pass attention kernel is used
+        batch_size:
+            Number of inputs in the batch
+        itemsize:
+            Size of an activation element in bytes
+        fixed:
+            Settings chosen by the user, e.g. {"offload_inference": True},
+            which every candidate keeps
+    Returns:
+        The plan. If nothing fits, the one using the least memory
+    """
+    budget = int(memory_budget * 1024**3)
+    templates_used = model_config.template.enabled and n_templ > 0
+
+    if(offload_templates is None):
+        offload_templates = offload
+
+    best = None
+    fixed = fixed or {}
+    for candidate in _candidates(templates_used, offload, offload_templates):
+        if(any(candidate[k] != v for k, v in fixed.items())):
+            continue
+        plan = InferencePlan(
+            stage_memory=estimate_stage_memory(
+                model_config,
+                n_res,
+                n_msa,
+                n_extra,
+                n_templ,
+                flash_attention=flash_attention,
+                batch_size=batch_size,
+                itemsize=itemsize,
+                **candidate,
+            ),
+            **candidate,
+        )
+        if(plan.peak_memory <= budget):
+            return plan
+        if(best is None or plan.peak_memory < best.peak_memory):
+            best = plan
+
+    if(best is None):
+        raise ValueError(f"No inference settings have {fixed}")
+
+    logging.warning(
+        f"No inference settings fit in {memory_budget}GiB. Using the most "
+        f"frugal ones"
+    )
+
+    return best
+
+
+@contextlib.contextmanager
+def applied_inference_plan(model, plan: InferencePlan):
+    """
+    Sets the options of an AlphaFold model chosen by the plan within the
+    block, and restores the previous ones on exit, so that a plan only
+    applies to the inputs it was made for.
+    """
+    template_config = model.config.template
+    saved = (
+        model.globals.chunk_size,
+        model.globals.use_lma,
+        model.globals.offload_inference,
+        template_config.offload_templates,
+        template_config.average_templates,
+    )
+    model.globals.chunk_size = plan.chunk_size
+    model.globals.use_lma = plan.use_lma
+    model.globals.offload_inference = plan.offload_inference
+    template_config.offload_templates = plan.offload_templates
+    template_config.average_templates = plan.average_templates
+    try:
+        yield
+    finally:
+        (
+            model.globals.chunk_size,
+            model.globals.use_lma,
+            model.globals.offload_inference,
+            template_config.offload_templates,
+            template_config.average_templates,
+        ) = saved
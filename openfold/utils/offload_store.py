@@ -0,0 +1,301 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Spills activations that don't fit in memory to a node-local SSD or the LLIO
+cache. Tensors are written to memory-mapped files and read back into memory
+by a background thread ahead of their use. Alternatively, tensors can live
+in memory-mapped files altogether, and be paged in and out by the kernel.
+"""
+import concurrent.futures
+import dataclasses
+import logging
+import math
+import os
+import shutil
+import tempfile
+import time
+import weakref
+from typing import Optional, Sequence
+
+import torch
+
+
+@dataclasses.dataclass
+class OffloadStats:
+    name: str
+    bytes_written: int
+    bytes_read: int
+    # Time spent waiting for tensors to be read back
+    stall_time: float
+
+    def __str__(self) -> str:
+        mib = lambda b: f"{b / 1024**2:.1f}MiB"
+        return (
+            f"{self.name}: wrote {mib(self.bytes_written)}, read "
+            f"{mib(self.bytes_read)}, stalled {self.stall_time:.3f}s"
+        )
+
+
+class SpilledTensor:
+    """A tensor written to an OffloadStore, in place of the tensor itself."""
+    def __init__(self,
+        path: str,
+        shape: torch.Size,
+        dtype: torch.dtype,
+        device: torch.device,
+    ):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+        self.device = device
+        self.write = None
+        self.read = None
+
+    def __del__(self):
+        # Tensors never read back, e.g. those saved for a backward pass
+        # that didn't happen
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    @property
+    def numel(self) -> int:
+        return self.shape.numel()
+
+    @property
+    def nbytes(self) -> int:
+        return self.numel * torch.empty((), dtype=self.dtype).element_size()
+
+
+def _write(spilled: SpilledTensor, tensor: torch.Tensor):
+    if(spilled.numel == 0):
+        return
+
+    # Extends the file. The kernel writes the pages back in the background
+    mapped = torch.from_file(
+        spilled.path, shared=True, size=spilled.numel, dtype=spilled.dtype
+    )
+    mapped.copy_(tensor.reshape(-1))
+
+
+def _read(spilled: SpilledTensor) -> torch.Tensor:
+    tensor = torch.empty(spilled.shape, dtype=spilled.dtype)
+    if(spilled.numel == 0):
+        return tensor
+
+    if(spilled.write is not None):
+        spilled.write.result()
+
+    mapped = torch.from_file(
+        spilled.path, shared=False, size=spilled.numel, dtype=spilled.dtype
+    )
+    tensor.view(-1).copy_(mapped)
+    del mapped
+    os.remove(spilled.path)
+
+    return tensor
+
+
+def _close_store(
+    executor: concurrent.futures.ThreadPoolExecutor,
+    store_dir: str,
+):
+    executor.shutdown(wait=True)
+    shutil.rmtree(store_dir, ignore_errors=True)
+
+
+class OffloadStore:
+    """
+    A directory of spilled tensors.
+
+    offload() writes a tensor in the background and returns a SpilledTensor
+    standing in for it. The memory of the tensor is released once it is
+    written, provided the caller drops its references. prefetch() starts
+    reading it back and load() waits for the read, which is counted as
+    stall time. The traffic and stall time are reported per block by
+    end_block().
+    """
+    def __init__(self, root_dir: str, num_workers: int = 2):
+        """
+        Args:
+            root_dir:
+                Directory on fast node-local storage, e.g. /local or the
+                LLIO cache. The tensors are written to a temporary
+                subdirectory, removed by close()
+            num_workers:
+                Number of threads writing and reading tensors
+        """
+        os.makedirs(root_dir, exist_ok=True)
+        self.dir = tempfile.mkdtemp(prefix="openfold_offload_", dir=root_dir)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_workers
+        )
+        self._count = 0
+
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.stall_time = 0.
+        self.block_stats = []
+        self._last = OffloadStats("", 0, 0, 0.)
+
+        # Also removes the directory of a store that was never closed
+        self._finalizer = weakref.finalize(
+            self, _close_store, self._executor, self.dir
+        )
+
+    def offload(self,
+        tensor: torch.Tensor,
+        asynchronous: bool = True,
+    ) -> SpilledTensor:
+        """
+        Spills a tensor.
+
+        Args:
+            tensor:
+                The tensor. It must not be modified in-place until written
+            asynchronous:
+                Whether to return before the tensor is written
+        Returns:
+            The SpilledTensor to pass to prefetch() and load()
+        """
+        spilled = SpilledTensor(
+            os.path.join(self.dir, f"{self._count}.bin"),
+            tensor.shape,
+            tensor.dtype,
+            tensor.device,
+        )
+        self._count += 1
+
+        tensor = tensor.detach().cpu()
+        if(asynchronous):
+            spilled.write = self._executor.submit(_write, spilled, tensor)
+        else:
+            _write(spilled, tensor)
+
+        self.bytes_written += spilled.nbytes
+
+        return spilled
+
+    def prefetch(self, spilled: SpilledTensor):
+        """Starts reading a spilled tensor back in the background."""
+        if(spilled.read is None):
+            spilled.read = self._executor.submit(_read, spilled)
+
+    def load(self, spilled: SpilledTensor) -> torch.Tensor:
+        """Returns a spilled tensor, on its original device."""
+        self.prefetch(spilled)
+
+        t = time.perf_counter()
+        tensor = spilled.read.result()
+        self.stall_time += time.perf_counter() - t
+        self.bytes_read += spilled.nbytes
+
+        spilled.write = None
+        spilled.read = None
+
+        return tensor.to(spilled.device)
+
+    def end_block(self, name: str) -> OffloadStats:
+        """Records and logs the traffic and stall time since the last call."""
+        stats = OffloadStats(
+            name,
+            self.bytes_written - self._last.bytes_written,
+            self.bytes_read - self._last.bytes_read,
+            self.stall_time - self._last.stall_time,
+        )
+        self._last = OffloadStats(
+            "", self.bytes_written, self.bytes_read, self.stall_time
+        )
+        self.block_stats.append(stats)
+        logging.info(str(stats))
+
+        return stats
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def mapped_empty(
+    shape: Sequence[int],
+    dtype: torch.dtype = torch.float32,
+    dir: Optional[str] = None,
+) -> torch.Tensor:
+    """
+    Returns an uninitialized CPU tensor backed by a memory-mapped file, whose
+    pages the kernel writes back and reads in as needed, so that the tensor
+    may be larger than the memory of the node. The file is unlinked at
+    once and freed with the tensor.
+
+    Args:
+        shape:
+            Shape of the tensor
+        dtype:
+            Dtype of the tensor
+        dir:
+            Directory of the file, e.g. on a node-local SSD. Defaults to the
+            temporary directory
+    """
+    numel = math.prod(shape)
+    if(dir is not None):
+        os.makedirs(dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="openfold_mapped_", dir=dir)
+    os.close(fd)
+    try:
+        mapped = torch.from_file(
+            path, shared=True, size=max(numel, 1), dtype=dtype
+        )
+    finally:
+        os.remove(path)
+
+    return mapped[:numel].view(shape)
+
+
+def mapped_copy(tensor: torch.Tensor, dir: Optional[str] = None):
+    """Copies a tensor to one returned by mapped_empty."""
+    mapped = mapped_empty(tensor.shape, tensor.dtype, dir=dir)
+    mapped.copy_(tensor)
+    return mapped
+
+
+class save_on_store(torch.autograd.graph.saved_tensors_hooks):
+    """
+    Spills the tensors saved for the backward pass to an OffloadStore. The
+    backward pass unpacks them in the reverse order, so each unpack starts
+    reading back the tensor saved before it.
+    """
+    def __init__(self, store: OffloadStore):
+        saved = []
+
+        def pack(tensor):
+            # Written synchronously, since the forward pass goes on using
+            # the tensor
+            saved.append(store.offload(tensor, asynchronous=False))
+            return len(saved) - 1
+
+        def unpack(idx):
+            if(idx > 0 and saved[idx - 1] is not None):
+                store.prefetch(saved[idx - 1])
+            tensor = store.load(saved[idx])
+            saved[idx] = None
+            return tensor
+
+        super().__init__(pack, unpack)
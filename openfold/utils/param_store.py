@@ -0,0 +1,188 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A flat, memory-mappable file format for converted model parameters.
+
+The file starts with the length of a JSON header as a little-endian uint64,
+followed by the header and a raw buffer holding the tensors in state_dict
+order. The header maps each state_dict key to its dtype, shape and byte range
+in the buffer, and "__metadata__" to a dict of strings. The buffer and every
+tensor in it are aligned to ALIGNMENT bytes, so that the tensors can be used
+directly from the mapped file.
+"""
+import json
+import struct
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+ALIGNMENT = 64
+
+_METADATA_KEY = "__metadata__"
+
+
+def _align(n: int) -> int:
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def save_param_store(
+    state_dict: Dict[str, torch.Tensor],
+    path: str,
+    metadata: Optional[Dict[str, str]] = None,
+):
+    """
+    Writes a state_dict to a parameter store.
+
+    Args:
+        state_dict:
+            A dict of tensors, e.g. the output of model.state_dict()
+        path:
+            The output path
+        metadata:
+            Optional dict of strings stored in the header
+    """
+    header = {_METADATA_KEY: dict(metadata or {})}
+    tensors = []
+    offset = 0
+    for k, t in state_dict.items():
+        t = t.detach().cpu().contiguous()
+        nbytes = t.numel() * t.element_size()
+        header[k] = {
+            "dtype": str(t.dtype).split(".")[-1],
+            "shape": list(t.shape),
+            "offsets": [offset, offset + nbytes],
+        }
+        tensors.append((offset, t))
+        offset = _align(offset + nbytes)
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    # Pad the header so that the buffer starts on an aligned offset
+    header_len = _align(8 + len(header_bytes)) - 8
+    header_bytes = header_bytes.ljust(header_len, b" ")
+
+    with open(path, "wb") as fp:
+        fp.write(struct.pack("<Q", header_len))
+        fp.write(header_bytes)
+        pos = 0
+        for begin, t in tensors:
+            fp.write(b"\0" * (begin - pos))
+            data = t.reshape(-1).view(torch.uint8).numpy().tobytes()
+            fp.write(data)
+            pos = begin + len(data)
+        fp.write(b"\0" * (_align(pos) - pos))
+
+
+def load_param_store(
+    path: str
+) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """
+    Maps a parameter store into memory.
+
+    The file is mapped copy-on-write. The returned tensors share the page
+    cache with every other process mapping the same file until written to.
+
+    Args:
+        path:
+            Path to a file written by save_param_store
+    Returns:
+        A tuple of (state_dict, metadata)
+    """
+    with open(path, "rb") as fp:
+        header_len, = struct.unpack("<Q", fp.read(8))
+        header = json.loads(fp.read(header_len))
+
+    metadata = header.pop(_METADATA_KEY, {})
+
+    state_dict = {}
+    if len(header) == 0:
+        return state_dict, metadata
+
+    buf = torch.from_numpy(
+        np.memmap(path, dtype=np.uint8, mode="c", offset=8 + header_len)
+    )
+    for k, v in header.items():
+        begin, end = v["offsets"]
+        state_dict[k] = (
+            buf[begin:end].view(getattr(torch, v["dtype"])).reshape(v["shape"])
+        )
+
+    return state_dict, metadata
+
+
+def assign_params_(
+    model: torch.nn.Module,
+    state_dict: Dict[str, torch.Tensor],
+    strict: bool = True,
+):
+    """
+    Replaces the parameters and buffers of a model with the tensors of a
+    state_dict. Unlike model.load_state_dict, tensors already on the device
+    and of the dtype of the model are used as they are, without a copy.
+
+    Args:
+        model:
+            The model
+        state_dict:
+            A dict of tensors, e.g. the output of load_param_store
+        strict:
+            Whether to raise an error if a key of the model is missing from
+            state_dict. Otherwise, those parameters are left unchanged.
+    """
+    model_tensors = model.state_dict(keep_vars=True)
+    missing = [k for k in model_tensors if k not in state_dict]
+    if strict and len(missing) > 0:
+        raise KeyError(f"Missing parameters: {missing}")
+
+    for k, t in model_tensors.items():
+        if k not in state_dict:
+            continue
+
+        v = state_dict[k]
+        if v.shape != t.shape:
+            raise ValueError(
+                f"Shape mismatch for {k}: {tuple(v.shape)} vs. "
+                f"{tuple(t.shape)}"
+            )
+
+        t.data = v.to(device=t.device, dtype=t.dtype)
+
+
+def import_param_store_(
+    model: torch.nn.Module,
+    path: str,
+    version: Optional[str] = None,
+):
+    """
+    Loads a parameter store into a model without copying the parameters.
+
+    Args:
+        model:
+            The model
+        path:
+            Path to a file written by save_param_store
+        version:
+            If given, the config preset the parameters must have been
+            converted for
+    """
+    state_dict, metadata = load_param_store(path)
+    if version is not None and metadata.get("version", version) != version:
+        raise ValueError(
+            f"{path} holds parameters for {metadata['version']}, not "
+            f"{version}"
+        )
+
+    assign_params_(model, state_dict)
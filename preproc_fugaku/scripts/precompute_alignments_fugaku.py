@@ -22,7 +22,9 @@ import os
 import threading
 from multiprocessing import cpu_count
 from shutil import copyfile
+import subprocess
 import tempfile
+import time
 import traceback
 from mpi4py import MPI
 import numpy as np
@@ -32,6 +34,16 @@ os.environ["OPENFOLD_IGNORE_IMPORT"] = "1"
 
 import openfold.data.mmcif_parsing as mmcif_parsing
 from openfold.data.data_pipeline import AlignmentRunner
+from openfold.data.fasta_index import FastaIndex, add_unique_suffix
+from openfold.data.run_ledger import (
+    STATE_FILE,
+    STATE_OK,
+    STATE_TIMEOUT,
+    STATE_UNKNOWN,
+    RunLedger,
+    is_completed,
+    load_state,
+)
 from openfold.data.parsers import parse_fasta
 from openfold.np import protein, residue_constants
 
@@ -45,7 +57,39 @@ UNCOMPLETED_FLAG_DTYPE = bool
 UNCOMPLETED_FLAG_AR_OP = MPI.LOR
 
 
-def run_seq_group_alignments(seqs, alignment_runner, args):
+def get_ledger_key(name, args):
+    # Jobs searching different databases share the same output directory
+    databases = ["uniref90", "mgnify", "pdb70", "bfd"]
+    stage = "+".join(
+        db for db in databases
+        if getattr(args, f"{db}_database_path") is not None)
+    return f"{stage}/{name}"
+
+
+def remove_ledger_completed(seq_groups, ledger_state, args):
+    """
+    Removes the chains recorded as completed in the ledger state.
+
+    Args:
+        seq_groups:
+            A list of (seq., [chain_name, ...]) tuples
+        ledger_state:
+            The state merged from the ledgers of the previous jobs
+    Returns:
+        A list of (seq., [chain_name, ...]) tuples
+    """
+    ret = []
+    for seq, names in seq_groups:
+        names = [
+            name for name in names
+            if not is_completed(ledger_state, get_ledger_key(name, args))]
+        if len(names) > 0:
+            ret.append((seq, names))
+
+    return ret
+
+
+def run_seq_group_alignments(seqs, alignment_runner, args, ledger=None):
     completed_count = 0
     total_count = 0
     for seq, names in seqs:
@@ -70,6 +114,7 @@ def run_seq_group_alignments(seqs, alignment_runner, args):
                     fp.write(f'>query\n{seq}')
 
                 logging.info(f"Processing for {name} on {fasta_path}")
+                begin_time = time.time()
                 try:
                     generated = alignment_runner.run(
                         fasta_path,
@@ -83,10 +128,26 @@ def run_seq_group_alignments(seqs, alignment_runner, args):
 
                     logging.info(f"Processing for {name} done!")
                     completed_count += 1
-
-                except:
+                    if ledger is not None:
+                        ledger.record(
+                            get_ledger_key(name, args),
+                            STATE_OK,
+                            time.time() - begin_time,
+                            seq_len=len(seq))
+
+                except BaseException as e:
                     traceback.print_exc()
                     logging.warning(f"Failed to run alignments for {name}. Skipping...")
+                    if ledger is not None:
+                        if isinstance(e, subprocess.TimeoutExpired):
+                            state = STATE_TIMEOUT
+                        else:
+                            state = STATE_UNKNOWN
+                        ledger.record(
+                            get_ledger_key(name, args),
+                            state,
+                            time.time() - begin_time,
+                            seq_len=len(seq))
 
                 os.remove(fasta_path)
 
@@ -104,40 +165,14 @@ def run_seq_group_alignments(seqs, alignment_runner, args):
 
                 logging.info(f"Processing for {name} done!")
                 completed_count += 1
+                if ledger is not None:
+                    ledger.record(
+                        get_ledger_key(name, args), STATE_OK, 0.,
+                        seq_len=len(seq))
 
     return completed_count, total_count
 
 
-def add_unique_suffix(input_chains):
-    """
-    Returns a list of chain names with additional suffix so that every name become unique.
-
-    Args:
-        input_chains:
-            A list of chain names
-    Returns:
-        A list of chain names
-    """
-
-    ret_chains = []
-    known_set = set()
-    input_set = set(input_chains)
-    for c in input_chains:
-       uc  = c
-       i = 0
-       while True:
-           if uc not in known_set and not (i > 0 and uc in input_set):
-               ret_chains.append(uc)
-               known_set.add(uc)
-               break
-
-           else:
-               uc = f"{c}_{i}"
-               i += 1
-
-    return ret_chains
-
-
 def get_unique_seqs(input_seq_chains):
     """
     Returns a set of unique sequences.
@@ -230,6 +265,73 @@ def get_uncompleted_seqs(input_seq_chains, comm, alignment_runner):
             if x[1] > 0]
 
 
+def get_indexed_seqs(index, comm, alignment_runner, ledger_state, args):
+    """
+    Returns the uncompleted sequences of this rank from a FASTA index.
+
+    Each rank reads the names of a contiguous slice of the groups (or
+    entries) of the index and removes its completed chains. The uncompleted
+    ones are then gathered by index and dealt to the ranks, as in
+    get_input_seqs, so that they are split evenly. Only the sequences of
+    this rank are read.
+
+    Args:
+        index:
+            The FastaIndex of the input file
+        comm:
+            mpi4py communicator
+        alignment_runner:
+            The alignment runner
+        ledger_state:
+            The state merged from the ledgers of the previous jobs
+    Returns:
+        A tuple of (the number of uncompleted chains of all ranks, a list of
+        (seq., [chain_name, ...]) tuples)
+    """
+    mpi_rank = comm.Get_rank()
+    mpi_size = comm.Get_size()
+
+    num_items = index.num_groups if args.unique else index.num_entries
+    begin = num_items * mpi_rank // mpi_size
+    end = num_items * (mpi_rank + 1) // mpi_size
+
+    # (group or entry index, [chain_name, ...]) of the slice of this rank
+    if args.unique:
+        items = [
+            (g, [index.name(int(i)) for i in index.group_members(g)])
+            for g in range(begin, end)
+        ]
+    else:
+        items = [(i, [index.name(i)]) for i in range(begin, end)]
+
+    items = remove_ledger_completed(items, ledger_state, args)
+    uncompleted = []
+    for item, names in items:
+        flags = get_uncompleted_flags(
+            [(item, name) for name in names],
+            args.output_dir,
+            alignment_runner)
+        names = [name for name, flag in zip(names, flags) if flag]
+        if len(names) > 0:
+            uncompleted.append((item, names))
+
+    # In the order of the index, as the slices are contiguous
+    uncompleted = [x for part in comm.allgather(uncompleted) for x in part]
+    uncompleted_total_count = sum(len(names) for _, names in uncompleted)
+
+    # Distribute uncompleted sequences
+    my_items = uncompleted[mpi_rank::mpi_size]
+    if args.unique:
+        seq_groups = [
+            (index.sequence(int(index.group_members(g)[0])), names)
+            for g, names in my_items
+        ]
+    else:
+        seq_groups = [(index.sequence(i), names) for i, names in my_items]
+
+    return uncompleted_total_count, seq_groups
+
+
 def main(args):
     # Build the alignment tool runner
     alignment_runner = AlignmentRunner(
@@ -253,7 +355,56 @@ def main(args):
     assert mpi_size > 0
     assert mpi_rank >= 0 and mpi_rank < mpi_size
 
+    ledger_state = {}
+    ledger = None
+    if args.ledger_dir is not None:
+        ledger_state = load_state(os.path.join(args.ledger_dir, STATE_FILE))
+        ledger = RunLedger(args.ledger_dir, mpi_rank)
+
+    host = os.environ["HOSTNAME"]
     input_file = args.input_file
+    if args.fasta_index is not None:
+        index = FastaIndex(args.fasta_index, input_file)
+        uncompleted_total_count, input_seq_chains = get_indexed_seqs(
+            index, comm, alignment_runner, ledger_state, args)
+
+        logging.info(f"host={host}, rank={mpi_rank}/{mpi_size}, "
+                     f"total_count={index.num_entries}, "
+                     f"total_uncompleted_count={uncompleted_total_count}, "
+                     f"my_count={sum(len(x[1]) for x in input_seq_chains)}")
+    else:
+        input_seq_chains = get_input_seqs(
+            input_file, comm, alignment_runner, ledger_state, args)
+
+    completed_count, total_count = run_seq_group_alignments(
+        input_seq_chains,
+        alignment_runner,
+        args,
+        ledger)
+
+    if ledger is not None:
+        ledger.close()
+
+    logging.info(f"DONE! "
+                 f"host={host}, rank={mpi_rank}/{mpi_size}, "
+                 f"my_completed_count={completed_count}, "
+                 f"my_count={total_count}")
+
+    completed_count = comm.allreduce(completed_count)
+    total_count = comm.allreduce(total_count)
+
+    if mpi_rank == 0:
+        if args.report_out_path is not None:
+            remaining = total_count-completed_count
+            assert remaining >= 0
+            with open(args.report_out_path, "w") as f:
+                f.write(str(remaining))
+
+
+def get_input_seqs(input_file, comm, alignment_runner, ledger_state, args):
+    mpi_rank = comm.Get_rank()
+    mpi_size = comm.Get_size()
+
     with open(input_file, 'r') as fp:
         fasta_str = fp.read()
 
@@ -263,6 +414,10 @@ def main(args):
     orig_total_count = len(input_seq_chains)
 
     # Remove completed chains
+    if len(ledger_state) > 0:
+        input_seq_chains = [
+            x for x in input_seq_chains
+            if not is_completed(ledger_state, get_ledger_key(x[1], args))]
     input_seq_chains = get_uncompleted_seqs(input_seq_chains, comm, alignment_runner)
 
     # Remove duplicated seqs.
@@ -284,25 +439,7 @@ def main(args):
                  f"total_uncompleted_count={uncompleted_total_count}, "
                  f"my_count={len(input_seq_chains)}")
 
-    completed_count, total_count = run_seq_group_alignments(
-        input_seq_chains,
-        alignment_runner,
-        args)
-
-    logging.info(f"DONE! "
-                 f"host={host}, rank={mpi_rank}/{mpi_size}, "
-                 f"my_completed_count={completed_count}, "
-                 f"my_count={total_count}")
-
-    completed_count = comm.allreduce(completed_count)
-    total_count = comm.allreduce(total_count)
-
-    if mpi_rank == 0:
-        if args.report_out_path is not None:
-            remaining = total_count-completed_count
-            assert remaining >= 0
-            with open(args.report_out_path, "w") as f:
-                f.write(str(remaining))
+    return input_seq_chains
 
 
 if __name__ == "__main__":
@@ -356,6 +493,19 @@ if __name__ == "__main__":
         help="Find duplicated sequences and create symlinks to existing alignment files "
         "instead of running search tools (default: False)",
     )
+    parser.add_argument(
+        "--ledger_dir", type=str, default=None,
+        help="Directory of the run ledgers. Each rank records the result of every "
+        "chain there, and chains completed according to the state file merged by "
+        "scripts/merge_run_ledgers.py are skipped without checking their "
+        "outputs (default: None)",
+    )
+    parser.add_argument(
+        "--fasta_index", type=str, default=None,
+        help="Index of the input file built by scripts/build_fasta_index.py "
+        "with --unique_names. Each rank reads only its own sequences and "
+        "checks only their completion (default: None)",
+    )
     parser.add_argument(
         "--disable-write-permission",
         dest="disable_write_permission",
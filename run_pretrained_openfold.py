@@ -15,9 +15,14 @@
 # limitations under the License.
 
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import copy
 from datetime import date
 import gc
 import logging
+import multiprocessing
 import numpy as np
 import os
 
@@ -31,15 +36,33 @@ import time
 import torch
 import tempfile
 
-from openfold.config import model_config
+from openfold.config import model_config, NUM_RES
 from openfold.data import templates, feature_pipeline, data_pipeline
+from openfold.data.alignment_store import AlignmentStore, is_alignment_store
+from openfold.data.structure_cache import StructureCache
+from openfold.data.feature_cache import (
+    FeatureCache,
+    hash_alignment_dir,
+    make_key,
+)
 from openfold.model.model import AlphaFold
 from openfold.model.torchscript import script_preset_
 from openfold.np import residue_constants, protein
 import openfold.np.relax.relax as relax
+from openfold.utils import dap
 from openfold.utils.import_weights import (
     import_jax_weights_,
 )
+from openfold.utils.loss import compute_tm
+from openfold.utils.memory_planner import (
+    applied_inference_plan,
+    plan_inference,
+)
+from openfold.utils.param_store import (
+    assign_params_,
+    import_param_store_,
+    load_param_store,
+)
 from openfold.utils.tensor_utils import (
     tensor_tree_map,
 )
@@ -54,6 +77,12 @@ logging.basicConfig()
 logger = logging.getLogger(__file__)
 logger.setLevel(level=logging.INFO)
 
+# Values of --precision
+PRECISION_DTYPES = {
+    "fp32": torch.float32,
+    "bf16": torch.bfloat16,
+}
+
 
 def precompute_alignments(tags, seqs, alignment_dir, args):
     for tag, seq in zip(tags, seqs):
@@ -87,6 +116,38 @@ def precompute_alignments(tags, seqs, alignment_dir, args):
         os.remove(tmp_fasta_path)
 
 
+def plan_batch_inference(model, batch, args):
+    """Chooses the model settings fitting --memory_budget for a batch."""
+    # [*, N_res, no_recycling]
+    aatype = batch["aatype"]
+    n_templ = 0
+    if("template_aatype" in batch):
+        n_templ = batch["template_aatype"].shape[-3]
+
+    offload = (
+        args.model_device != "cpu" or model.globals.offload_dir is not None
+    ) and model.globals.stream_tile_size is None and not model.globals.dap
+
+    return plan_inference(
+        model.config,
+        n_res=aatype.shape[-2],
+        n_msa=batch["msa_feat"].shape[-4],
+        n_extra=batch["extra_msa"].shape[-3],
+        n_templ=n_templ,
+        memory_budget=args.memory_budget,
+        offload=offload,
+        offload_templates=(args.model_device != "cpu"),
+        flash_attention=model.globals.flash_attention,
+        batch_size=int(np.prod(aatype.shape[:-2])),
+        itemsize=next(model.parameters()).element_size(),
+        # Offloading asked for with --offload_dir is kept
+        fixed=(
+            {"offload_inference": True}
+            if offload and model.globals.offload_inference else None
+        ),
+    )
+
+
 def run_model(model, batch, tag, args):
     with torch.no_grad():
         batch = {
@@ -99,12 +160,25 @@ def run_model(model, batch, tag, args):
             "template_" in k for k in batch
         ])
 
+        plan_context = contextlib.nullcontext()
+        if(args.memory_budget is not None):
+            plan = plan_batch_inference(model, batch, args)
+            plan_context = applied_inference_plan(model, plan)
+            logger.info(f"Inference plan for {tag}: {plan}")
+
         logger.info(f"Running inference for {tag}...")
         t = time.perf_counter()
-        out = model(batch)
-        logger.info(f"Inference time: {time.perf_counter() - t}")
+        with plan_context:
+            out = model(batch)
+        inference_time = time.perf_counter() - t
+        logger.info(f"Inference time: {inference_time}")
+
+        # The outputs of a bfloat16 model are written out in float32
+        out = tensor_tree_map(
+            lambda t: t.float() if t.is_floating_point() else t, out
+        )
     
-    return out
+    return out, inference_time
 
 
 def prep_output(out, batch, feature_dict, feature_processor, args):
@@ -167,22 +241,35 @@ def prep_output(out, batch, feature_dict, feature_processor, args):
     return unrelaxed_protein
 
 
-def main(args):
-    pid = os.getpid()
-    initial_cpu_affinity = os.sched_getaffinity(pid)
-
-    # Create the output directory
-    os.makedirs(args.output_dir, exist_ok=True)
+def set_model_globals(config, args):
+    """Applies the command line options on the model to config."""
+    config.globals.flash_attention = args.flash_attention
+    if(args.chunk_plan_path is not None):
+        config.globals.chunk_plan_path = args.chunk_plan_path
+    if(args.chunk_memory_budget is not None):
+        config.globals.chunk_memory_budget = args.chunk_memory_budget
+    if(args.offload_dir is not None):
+        config.globals.offload_dir = args.offload_dir
+        # When streaming, the activations stay in their memory-mapped files
+        config.globals.offload_inference = args.stream_tile_size is None
+    if(args.stream_tile_size is not None):
+        config.globals.stream_tile_size = args.stream_tile_size
+    config.globals.dap = args.dap
 
-    # Prep the model
-    config = model_config(args.config_preset)
-    
-    logger.info(f"Using config preset {args.config_preset}...")
 
+def load_model(config, args):
+    set_model_globals(config, args)
     model = AlphaFold(config)
     model = model.eval()
 
-    if(args.jax_param_path):
+    if(args.param_store_path):
+        import_param_store_(
+            model, args.param_store_path, version=args.config_preset
+        )
+        logger.info(
+            f"Mapped parameter store at {args.param_store_path}..."
+        )
+    elif(args.jax_param_path):
         import_jax_weights_(
             model, args.jax_param_path, version=args.config_preset
         )
@@ -231,7 +318,162 @@ def main(args):
             "be specified."
         )
 
-    model = model.to(args.model_device)
+    # Cast once. Features are cast to the dtype of the parameters in the
+    # model
+    model = model.to(
+        device=args.model_device, dtype=PRECISION_DTYPES[args.precision]
+    )
+
+    return model
+
+
+def get_preset_args(preset, args):
+    """Returns a copy of args for running the given config preset."""
+    preset_args = copy.copy(args)
+    preset_args.config_preset = preset
+
+    return preset_args
+
+
+class PresetEnsemble:
+    """
+        A single model instance shared by several config presets.
+
+        The model_{1-5}(_ptm) presets only differ in the weights, the
+        template and TM head flags of the model config and the data config.
+        The network is built once with every optional module present, the
+        parameters of all presets are kept resident (or memory-mapped) and
+        switching presets points the model at them without a copy.
+    """
+    def __init__(self, presets, args):
+        if(args.openfold_checkpoint_path is not None):
+            raise ValueError(
+                "--ensemble_presets requires JAX parameters"
+            )
+
+        self.presets = presets
+        self.configs = {p: model_config(p) for p in presets}
+
+        config = model_config(presets[0])
+        config.model.template.enabled = any(
+            c.model.template.enabled for c in self.configs.values()
+        )
+        config.model.heads.tm.enabled = any(
+            c.model.heads.tm.enabled for c in self.configs.values()
+        )
+
+        set_model_globals(config, args)
+        self.model = AlphaFold(config).eval()
+        self.params = {}
+        for preset in presets:
+            param_path = os.path.join(args.jax_param_dir, "params_" + preset)
+            if(os.path.exists(param_path + ".store")):
+                # Converted by scripts/convert_jax_params.py. Mapped rather
+                # than read into memory.
+                self.params[preset], _ = load_param_store(
+                    param_path + ".store"
+                )
+                logger.info(f"Mapped parameter store at {param_path}.store...")
+                continue
+
+            import_jax_weights_(self.model, param_path + ".npz", version=preset)
+            self.params[preset] = {
+                k: v.detach().clone()
+                for k, v in self.model.state_dict().items()
+            }
+            logger.info(
+                f"Successfully loaded JAX parameters at {param_path}.npz..."
+            )
+
+        # The parameters of each preset are cast by assign_params_ when
+        # switching to it
+        self.model = self.model.to(
+            device=args.model_device, dtype=PRECISION_DTYPES[args.precision]
+        )
+        self.preset = None
+
+    def activate(self, preset):
+        """Switches the model to the given preset and returns it."""
+        if(preset != self.preset):
+            t = time.perf_counter()
+            # The parameters of the TM head are missing from non-pTM presets
+            assign_params_(self.model, self.params[preset], strict=False)
+            self.preset = preset
+            logger.info(
+                f"Switched parameters to {preset}: {time.perf_counter() - t}"
+            )
+
+        # Also restores templates after run_model has turned them off
+        preset_config = self.configs[preset].model
+        self.model.config.template.enabled = preset_config.template.enabled
+        self.model.config.heads.tm.enabled = preset_config.heads.tm.enabled
+
+        return self.model
+
+
+def predict_ensemble(
+    tag,
+    feature_dict,
+    processed_feature_dict,
+    ensemble,
+    prediction_dir,
+    args,
+):
+    """
+        Runs inference with every preset of the ensemble on a single
+        featurized FASTA file. processed_feature_dict must have been computed
+        with the data config of the first preset. The raw features are reused
+        and only processed again for presets with a different data config.
+
+        Returns a list of (unrelaxed_protein, output_name) tuples.
+    """
+    processed = {}
+    predictions = []
+    for i, preset in enumerate(ensemble.presets):
+        config = ensemble.configs[preset]
+        preset_args = get_preset_args(preset, args)
+        output_name = get_output_name(tag, preset_args)
+        unrelaxed_output_path = os.path.join(
+            prediction_dir, f'{output_name}_unrelaxed.pdb'
+        )
+        if(os.path.exists(unrelaxed_output_path) and args.skip_relaxation):
+            continue
+
+        feature_processor = feature_pipeline.FeaturePipeline(config.data)
+        data_key = config.data.to_json_best_effort(sort_keys=True)
+        if(i == 0):
+            processed[data_key] = processed_feature_dict
+        elif(data_key not in processed):
+            t = time.perf_counter()
+            processed[data_key] = feature_processor.process_features(
+                feature_dict, mode='predict',
+            )
+            logger.info(
+                f"Feature processing time for {preset}: "
+                f"{time.perf_counter() - t}"
+            )
+
+        unrelaxed_protein, output_name, _ = predict_features(
+            tag,
+            feature_dict,
+            processed[data_key],
+            ensemble.activate(preset),
+            feature_processor,
+            prediction_dir,
+            preset_args,
+        )
+        predictions.append((unrelaxed_protein, output_name))
+
+    return predictions
+
+
+def make_data_processor(config, args):
+    structure_cache = None
+    if(args.template_cache_size is not None):
+        structure_cache = StructureCache(
+            int(args.template_cache_size * (1 << 30)),
+            shared_dir=args.template_cache_dir,
+        )
 
     template_featurizer = templates.TemplateHitFeaturizer(
         mmcif_dir=args.template_mmcif_dir,
@@ -239,150 +481,807 @@ def main(args):
         max_hits=config.data.predict.max_templates,
         kalign_binary_path=args.kalign_binary_path,
         release_dates_path=args.release_dates_path,
-        obsolete_pdbs_path=args.obsolete_pdbs_path
+        obsolete_pdbs_path=args.obsolete_pdbs_path,
+        structure_cache=structure_cache,
     )
 
+    alignment_store = None
+    if(args.use_precomputed_alignments is not None and
+       is_alignment_store(args.use_precomputed_alignments)):
+        alignment_store = AlignmentStore(args.use_precomputed_alignments)
+
     data_processor = data_pipeline.DataPipeline(
         template_featurizer=template_featurizer,
+        alignment_store=alignment_store,
     )
 
-    output_dir_base = args.output_dir
-    random_seed = args.data_random_seed
-    if random_seed is None:
-        random_seed = random.randrange(sys.maxsize)
-    seed_everything(random_seed)
-    feature_processor = feature_pipeline.FeaturePipeline(config.data)
-    if not os.path.exists(output_dir_base):
-        os.makedirs(output_dir_base)
+    return data_processor
+
+
+def get_alignment_dir(args):
     if(args.use_precomputed_alignments is None):
-        alignment_dir = os.path.join(output_dir_base, "alignments")
+        alignment_dir = os.path.join(args.output_dir, "alignments")
     else:
         alignment_dir = args.use_precomputed_alignments
         logger.info(f"Using precomputed alignments at {alignment_dir}...")
 
-    prediction_dir = os.path.join(args.output_dir, "predictions") 
-    os.makedirs(prediction_dir, exist_ok=True)
+    return alignment_dir
 
-    for fasta_file in os.listdir(args.fasta_dir):
-        # Gather input sequences
-        with open(os.path.join(args.fasta_dir, fasta_file), "r") as fp:
-            data = fp.read()
 
-        lines = [
-            l.replace('\n', '') 
-            for prot in data.split('>') for l in prot.strip().split('\n', 1)
-        ][1:]
-        tags, seqs = lines[::2], lines[1::2]
+def get_output_name(tag, args):
+    output_name = f'{tag}_{args.config_preset}'
+    if(args.output_postfix is not None):
+        output_name = f'{output_name}_{args.output_postfix}'
 
-        tags = [t.split()[0] for t in tags]
-        # assert len(tags) == len(set(tags)), "All FASTA tags must be unique"
-        tag = '-'.join(tags)
+    return output_name
 
-        output_name = f'{tag}_{args.config_preset}'
-        if(args.output_postfix is not None):
-            output_name = f'{output_name}_{args.output_postfix}'
 
-        # Save the unrelaxed PDB.
-        unrelaxed_output_path = os.path.join(
-            prediction_dir, f'{output_name}_unrelaxed.pdb'
+def featurize_fasta(
+    fasta_path,
+    data_processor,
+    feature_processor,
+    alignment_dir,
+    prediction_dir,
+    args,
+):
+    """
+        Runs the CPU-side featurization for the sequence(s) in a single FASTA
+        file.
+
+        Returns a (tag, feature_dict, processed_feature_dict) tuple, or None
+        if the prediction already exists.
+    """
+    # Gather input sequences
+    with open(fasta_path, "r") as fp:
+        data = fp.read()
+
+    lines = [
+        l.replace('\n', '') 
+        for prot in data.split('>') for l in prot.strip().split('\n', 1)
+    ][1:]
+    tags, seqs = lines[::2], lines[1::2]
+
+    tags = [t.split()[0] for t in tags]
+    # assert len(tags) == len(set(tags)), "All FASTA tags must be unique"
+    tag = '-'.join(tags)
+
+    presets = args.ensemble_presets or [args.config_preset]
+    unrelaxed_output_paths = [
+        os.path.join(
+            prediction_dir, 
+            f'{get_output_name(tag, get_preset_args(p, args))}_unrelaxed.pdb'
         )
+        for p in presets
+    ]
 
-        if(os.path.exists(unrelaxed_output_path) and args.skip_relaxation):
-            continue
+    if(args.skip_relaxation and 
+       all(os.path.exists(p) for p in unrelaxed_output_paths)):
+        return None
 
-        precompute_alignments(tags, seqs, alignment_dir, args)
+    precompute_alignments(tags, seqs, alignment_dir, args)
 
-        _, tmp_fasta_path = tempfile.mkstemp(suffix=".fasta")
-        if(len(seqs) == 1):
-            seq = seqs[0]
-            with open(tmp_fasta_path, "w") as fp:
-                fp.write(f">{tag}\n{seq}")
-
-            local_alignment_dir = os.path.join(alignment_dir, tag)
-            feature_dict = data_processor.process_fasta(
-                fasta_path=tmp_fasta_path, alignment_dir=local_alignment_dir
-            )
-        else:
-            with open(tmp_fasta_path, "w") as fp:
-                fp.write(
-                    '\n'.join([f">{tag}\n{seq}" for tag, seq in zip(tags, seqs)])
-                )
-            feature_dict = data_processor.process_multiseq_fasta(
-                fasta_path=tmp_fasta_path, super_alignment_dir=alignment_dir, 
-            )
+    feature_cache = make_feature_cache(args)
+    if(feature_cache is not None):
+        local_alignment_dirs = [tag] if len(seqs) == 1 else tags
+        raw_key = make_key(
+            "raw",
+            tags,
+            seqs,
+            [
+                hash_alignment_dir(os.path.join(alignment_dir, d)) 
+                for d in local_alignment_dirs
+            ],
+            args.template_mmcif_dir,
+            args.max_template_date,
+            args.release_dates_path,
+            args.obsolete_pdbs_path,
+            feature_processor.config.predict.max_templates,
+        )
+        feature_dict = feature_cache.get(raw_key)
+    else:
+        feature_dict = None
 
-        # Remove temporary FASTA file
-        os.remove(tmp_fasta_path)
+    if(feature_dict is None):
+        feature_dict = make_feature_dict(
+            tag, tags, seqs, data_processor, alignment_dir
+        )
+        if(feature_cache is not None):
+            feature_cache.put(raw_key, feature_dict)
+    else:
+        logger.info(f"Using cached features of {tag}...")
+
+    # Sequences run in batches are padded to the length of their bucket
+    bucket_len = get_bucket_len(int(feature_dict["seq_length"][0]), args)
+    if(bucket_len is not None):
+        data_config = copy.deepcopy(feature_processor.config)
+        with data_config.unlocked():
+            data_config.predict.crop_size = bucket_len
+        feature_processor = feature_pipeline.FeaturePipeline(data_config)
 
+    # Without a fixed seed, the sampled features of each run differ
+    cache_processed = (
+        feature_cache is not None and args.data_random_seed is not None
+    )
+    processed_feature_dict = None
+    if(cache_processed):
+        processed_key = make_key(
+            "processed",
+            raw_key,
+            feature_processor.config.to_json_best_effort(sort_keys=True),
+            args.data_random_seed,
+        )
+        processed_feature_dict = feature_cache.get(processed_key)
+
+    if(processed_feature_dict is None):
         processed_feature_dict = feature_processor.process_features(
             feature_dict, mode='predict',
         )
+        if(cache_processed):
+            feature_cache.put(processed_key, processed_feature_dict)
 
-        batch = processed_feature_dict
-        out = run_model(model, batch, tag, args)
+    return tag, feature_dict, processed_feature_dict
 
-        # Toss out the recycling dimensions --- we don't need them anymore
-        batch = tensor_tree_map(lambda x: np.array(x[..., -1].cpu()), batch)
-        out = tensor_tree_map(lambda x: np.array(x.cpu()), out)
-       
-        unrelaxed_protein = prep_output(
-            out, batch, feature_dict, feature_processor, args
+
+def make_feature_dict(tag, tags, seqs, data_processor, alignment_dir):
+    """Runs the data pipeline on the sequence(s) of a FASTA file."""
+    _, tmp_fasta_path = tempfile.mkstemp(suffix=".fasta")
+    if(len(seqs) == 1):
+        seq = seqs[0]
+        with open(tmp_fasta_path, "w") as fp:
+            fp.write(f">{tag}\n{seq}")
+
+        local_alignment_dir = os.path.join(alignment_dir, tag)
+        feature_dict = data_processor.process_fasta(
+            fasta_path=tmp_fasta_path, alignment_dir=local_alignment_dir
+        )
+    else:
+        with open(tmp_fasta_path, "w") as fp:
+            fp.write(
+                '\n'.join([f">{tag}\n{seq}" for tag, seq in zip(tags, seqs)])
+            )
+        feature_dict = data_processor.process_multiseq_fasta(
+            fasta_path=tmp_fasta_path, super_alignment_dir=alignment_dir, 
         )
 
-        output_name = f'{tag}_{args.config_preset}'
-        if(args.output_postfix is not None):
-            output_name = f'{output_name}_{args.output_postfix}'
+    # Remove temporary FASTA file
+    os.remove(tmp_fasta_path)
 
-        # Save the unrelaxed PDB.
-        unrelaxed_output_path = os.path.join(
-            prediction_dir, f'{output_name}_unrelaxed.pdb'
+    return feature_dict
+
+
+def make_feature_cache(args):
+    if(args.feature_cache_dir is None):
+        return None
+
+    max_bytes = None
+    if(args.feature_cache_size is not None):
+        max_bytes = int(args.feature_cache_size * (1 << 30))
+
+    return FeatureCache(args.feature_cache_dir, max_bytes)
+
+
+def predict_features(
+    tag,
+    feature_dict,
+    processed_feature_dict,
+    model,
+    feature_processor,
+    prediction_dir,
+    args,
+):
+    """
+        Runs inference on featurized inputs and writes the unrelaxed 
+        prediction.
+
+        Returns an (unrelaxed_protein, output_name, inference_time) tuple.
+    """
+    batch = processed_feature_dict
+    out, inference_time = run_model(model, batch, tag, args)
+
+    # Toss out the recycling dimensions --- we don't need them anymore
+    batch = tensor_tree_map(lambda x: np.array(x[..., -1].cpu()), batch)
+    out = tensor_tree_map(lambda x: np.array(x.cpu()), out)
+
+    unrelaxed_protein, output_name = write_prediction(
+        tag, out, batch, feature_dict, feature_processor, prediction_dir, args
+    )
+
+    return unrelaxed_protein, output_name, inference_time
+
+
+def get_bucket_len(num_res, args):
+    """
+        Returns the length to which a sequence is padded for batched 
+        inference, or None if it is run on its own.
+    """
+    if(args.batch_size <= 1 or num_res > args.batch_max_len):
+        return None
+
+    bucket_size = args.batch_bucket_size
+    return -(-num_res // bucket_size) * bucket_size
+
+
+def unpad_features(batch, num_res, feature_schema):
+    """Removes the residue padding from unbatched input features."""
+    unpadded = {}
+    for k, v in batch.items():
+        schema = feature_schema.get(k, [])
+        if(NUM_RES in schema):
+            idx = tuple(
+                slice(0, num_res) if s == NUM_RES else slice(None) 
+                for s in schema
+            )
+            v = v[idx]
+        unpadded[k] = v
+
+    return unpadded
+
+
+# Residue dimensions of the unbatched model outputs. Those not listed have 
+# a single leading residue dimension.
+OUTPUT_RESIDUE_DIMS = {
+    "msa": (1,),
+    "masked_msa_logits": (1,),
+    "pair": (0, 1),
+    "distogram_logits": (0, 1),
+    "tm_logits": (0, 1),
+    "predicted_aligned_error": (0, 1),
+    "aligned_confidence_probs": (0, 1),
+    "max_predicted_aligned_error": (),
+    "predicted_tm_score": (),
+}
+
+# The structure module outputs are stacked over blocks, except "single"
+SM_OUTPUT_RESIDUE_DIMS = {
+    "single": (0,),
+}
+
+
+def unpad_output(out, num_res):
+    """Removes the residue padding from unbatched model outputs."""
+    def unpad(v, dims):
+        idx = [slice(None)] * v.ndim
+        for d in dims:
+            idx[d] = slice(0, num_res)
+        return v[tuple(idx)]
+
+    unpadded = {}
+    for k, v in out.items():
+        if(k == "sm"):
+            unpadded[k] = {
+                k_sm: unpad(v_sm, SM_OUTPUT_RESIDUE_DIMS.get(k_sm, (1,)))
+                for k_sm, v_sm in v.items()
+            }
+        else:
+            unpadded[k] = unpad(v, OUTPUT_RESIDUE_DIMS.get(k, (0,)))
+
+    return unpadded
+
+
+def predict_batch(
+    features_list,
+    model,
+    config,
+    feature_processor,
+    prediction_dir,
+    args,
+):
+    """
+        Runs inference on featurized inputs padded to the same length in a 
+        single forward pass and writes the unrelaxed predictions.
+
+        Returns a list of (unrelaxed_protein, output_name) tuples.
+    """
+    tags = [tag for tag, _, _ in features_list]
+    batch = {
+        k: torch.stack([f[k] for _, _, f in features_list]) 
+        for k in features_list[0][2]
+    }
+    out, _ = run_model(model, batch, ','.join(tags), args)
+
+    predictions = []
+    for i, (tag, feature_dict, _) in enumerate(features_list):
+        num_res = int(feature_dict["seq_length"][0])
+
+        # Toss out the batch and recycling dimensions and the padding
+        batch_i = tensor_tree_map(
+            lambda x: np.array(x[i, ..., -1].cpu()), batch
+        )
+        batch_i = unpad_features(batch_i, num_res, config.data.common.feat)
+        out_i = tensor_tree_map(lambda x: np.array(x[i].cpu()), out)
+        out_i = unpad_output(out_i, num_res)
+
+        # The pTM computed by the model is diluted by the padding
+        if("tm_logits" in out_i):
+            out_i["predicted_tm_score"] = np.array(compute_tm(
+                torch.as_tensor(out_i["tm_logits"]), **config.model.heads.tm
+            ))
+
+        predictions.append(write_prediction(
+            tag, 
+            out_i, 
+            batch_i, 
+            feature_dict, 
+            feature_processor, 
+            prediction_dir, 
+            args,
+        ))
+
+    return predictions
+
+
+def write_prediction(
+    tag,
+    out,
+    batch,
+    feature_dict,
+    feature_processor,
+    prediction_dir,
+    args,
+):
+    """
+        Writes the unrelaxed prediction of a single sequence.
+
+        Returns an (unrelaxed_protein, output_name) tuple.
+    """
+    unrelaxed_protein = prep_output(
+        out, batch, feature_dict, feature_processor, args
+    )
+
+    output_name = get_output_name(tag, args)
+
+    # With DAP, every rank holds the same prediction
+    if(dap.get_rank() != 0):
+        return unrelaxed_protein, output_name
+
+    # Save the unrelaxed PDB.
+    unrelaxed_output_path = os.path.join(
+        prediction_dir, f'{output_name}_unrelaxed.pdb'
+    )
+    with open(unrelaxed_output_path + '.incomp', 'w') as fp:
+        fp.write(protein.to_pdb(unrelaxed_protein))
+    os.rename(unrelaxed_output_path + '.incomp', unrelaxed_output_path)
+
+    logger.info(f"Output written to {unrelaxed_output_path}...")
+
+    if(args.save_outputs):
+        output_dict_path = os.path.join(
+            args.output_dir, f'{output_name}_output_dict.pkl'
+        )
+        with open(output_dict_path, "wb") as fp:
+            pickle.dump(out, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+        logger.info(f"Model output written to {output_dict_path}...")
+
+    return unrelaxed_protein, output_name
+
+
+def relax_prediction(
+    unrelaxed_protein,
+    output_name,
+    prediction_dir,
+    relax_config,
+    cpu_affinity,
+    args,
+):
+    """
+        Runs Amber relaxation on a prediction and writes the relaxed PDB.
+
+        Returns the relaxation time in seconds.
+    """
+    # re-setting cpu affinity. fcc openmp changes the affinity to single core.
+    os.sched_setaffinity(os.getpid(), cpu_affinity)
+
+    amber_relaxer = relax.AmberRelaxation(
+        use_gpu=(args.model_device != "cpu"),
+        **relax_config,
+    )
+    
+    # Relax the prediction.
+    logger.info(f"Running relaxation on {output_name}...")
+    t = time.perf_counter()
+    visible_devices = os.getenv("CUDA_VISIBLE_DEVICES", default="")
+    if("cuda" in args.model_device):
+        device_no = args.model_device.split(":")[-1]
+        os.environ["CUDA_VISIBLE_DEVICES"] = device_no
+    relaxed_pdb_str, _, _ = amber_relaxer.process(prot=unrelaxed_protein)
+    os.environ["CUDA_VISIBLE_DEVICES"] = visible_devices
+    relaxation_time = time.perf_counter() - t
+    logger.info(f"Relaxation time: {relaxation_time}")
+    
+    # Save the relaxed PDB.
+    relaxed_output_path = os.path.join(
+        prediction_dir, f'{output_name}_relaxed.pdb'
+    )
+    with open(relaxed_output_path + '.incomp', 'w') as fp:
+        fp.write(relaxed_pdb_str)
+    os.rename(relaxed_output_path + '.incomp', relaxed_output_path)
+
+    logger.info(f"Relaxed output written to {relaxed_output_path}...")
+
+    return relaxation_time
+
+
+def predict_fasta(
+    fasta_path, 
+    model, 
+    config, 
+    data_processor, 
+    feature_processor, 
+    alignment_dir, 
+    prediction_dir, 
+    initial_cpu_affinity, 
+    args,
+):
+    """
+        Runs featurization, inference and (optionally) relaxation for the
+        sequence(s) in a single FASTA file.
+
+        Returns a dict with the inference and relaxation times in seconds, or
+        None if the prediction already exists.
+    """
+    features = featurize_fasta(
+        fasta_path,
+        data_processor,
+        feature_processor,
+        alignment_dir,
+        prediction_dir,
+        args,
+    )
+    if(features is None):
+        return None
+
+    unrelaxed_protein, output_name, inference_time = predict_features(
+        *features,
+        model,
+        feature_processor,
+        prediction_dir,
+        args,
+    )
+
+    relaxation_time = 0.
+    if(not args.skip_relaxation):
+        relaxation_time = relax_prediction(
+            unrelaxed_protein,
+            output_name,
+            prediction_dir,
+            config.relax,
+            initial_cpu_affinity,
+            args,
         )
-        with open(unrelaxed_output_path + '.incomp', 'w') as fp:
-            fp.write(protein.to_pdb(unrelaxed_protein))
-        os.rename(unrelaxed_output_path + '.incomp', unrelaxed_output_path)
 
-        logger.info(f"Output written to {unrelaxed_output_path}...")
+    return {
+        "inference_time": inference_time,
+        "relaxation_time": relaxation_time,
+    }
+
+
+# Per-process state of the featurization workers
+_feature_worker = {}
+
+
+def _init_feature_worker(args, random_seed):
+    # The model runs in the parent process. Don't compete for its cores.
+    torch.set_num_threads(1)
+    seed_everything(random_seed)
+
+    config = model_config(args.config_preset)
+    _feature_worker["data_processor"] = make_data_processor(config, args)
+    _feature_worker["feature_processor"] = (
+        feature_pipeline.FeaturePipeline(config.data)
+    )
+    _feature_worker["args"] = args
+
+
+def _featurize_fasta_in_worker(fasta_path, alignment_dir, prediction_dir):
+    t = time.perf_counter()
+    features = featurize_fasta(
+        fasta_path,
+        _feature_worker["data_processor"],
+        _feature_worker["feature_processor"],
+        alignment_dir,
+        prediction_dir,
+        _feature_worker["args"],
+    )
+    logger.info(
+        f"Featurization time for {fasta_path}: {time.perf_counter() - t}"
+    )
+
+    return features
+
 
-        if(not args.skip_relaxation):
-            # re-setting cpu affinity. fcc openmp changes the affinity to single core.
-            os.sched_setaffinity(pid, initial_cpu_affinity)
+def prefetch_features(
+    executor, 
+    fasta_paths, 
+    alignment_dir, 
+    prediction_dir, 
+    depth,
+):
+    """
+        Yields (fasta_path, features) in the order of fasta_paths, keeping
+        featurization of up to depth FASTA files in flight in the executor.
+    """
+    fasta_paths = iter(fasta_paths)
+    pending = collections.deque()
 
-            amber_relaxer = relax.AmberRelaxation(
-                use_gpu=(args.model_device != "cpu"),
-                **config.relax,
+    def submit_next():
+        fasta_path = next(fasta_paths, None)
+        if(fasta_path is not None):
+            future = executor.submit(
+                _featurize_fasta_in_worker, 
+                fasta_path, 
+                alignment_dir, 
+                prediction_dir,
             )
-            
-            # Relax the prediction.
-            logger.info(f"Running relaxation on {unrelaxed_output_path}...")
-            t = time.perf_counter()
-            visible_devices = os.getenv("CUDA_VISIBLE_DEVICES", default="")
-            if("cuda" in args.model_device):
-                device_no = args.model_device.split(":")[-1]
-                os.environ["CUDA_VISIBLE_DEVICES"] = device_no
-            relaxed_pdb_str, _, _ = amber_relaxer.process(prot=unrelaxed_protein)
-            os.environ["CUDA_VISIBLE_DEVICES"] = visible_devices
-            logger.info(f"Relaxation time: {time.perf_counter() - t}")
-            
-            # Save the relaxed PDB.
-            relaxed_output_path = os.path.join(
-                prediction_dir, f'{output_name}_relaxed.pdb'
+            pending.append((fasta_path, future))
+
+    for _ in range(depth):
+        submit_next()
+
+    while(len(pending) > 0):
+        fasta_path, future = pending.popleft()
+        submit_next()
+
+        t = time.perf_counter()
+        features = future.result()
+        logger.info(
+            f"Waited for features of {fasta_path}: {time.perf_counter() - t}"
+        )
+
+        yield fasta_path, features
+
+
+# Per-process state of the relaxation workers
+_relax_worker = {}
+
+
+def parse_cpu_list(s):
+    """Parses a CPU list such as "0-11,24,25" into a list of CPU ids."""
+    cpus = []
+    for r in s.split(','):
+        if('-' in r):
+            begin, end = r.split('-')
+            cpus.extend(range(int(begin), int(end) + 1))
+        else:
+            cpus.append(int(r))
+
+    return cpus
+
+
+def _init_relax_worker(cpu_sets):
+    # Each worker takes its own set of cores
+    cpus = cpu_sets.get()
+    os.sched_setaffinity(os.getpid(), cpus)
+    os.environ["OPENMM_CPU_THREADS"] = str(len(cpus))
+    _relax_worker["cpus"] = cpus
+
+
+def _relax_prediction_in_worker(
+    unrelaxed_protein, 
+    output_name, 
+    prediction_dir, 
+    relax_config, 
+    args,
+):
+    return relax_prediction(
+        unrelaxed_protein,
+        output_name,
+        prediction_dir,
+        relax_config,
+        _relax_worker["cpus"],
+        args,
+    )
+
+
+def make_relax_executor(initial_cpu_affinity, args):
+    ctx = multiprocessing.get_context("spawn")
+    if(args.relax_cpus is not None):
+        cpus = parse_cpu_list(args.relax_cpus)
+    else:
+        cpus = sorted(initial_cpu_affinity)
+
+    n = args.num_relax_workers
+    if(args.relax_cpus is not None and len(cpus) >= n):
+        cpu_sets = [
+            cpus[i * len(cpus) // n:(i + 1) * len(cpus) // n] 
+            for i in range(n)
+        ]
+    else:
+        cpu_sets = [cpus] * n
+
+    cpu_set_queue = ctx.Queue()
+    for cpu_set in cpu_sets:
+        cpu_set_queue.put(cpu_set)
+
+    logger.info(f"Relaxation worker cores: {cpu_sets}")
+
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=n,
+        mp_context=ctx,
+        initializer=_init_relax_worker,
+        initargs=(cpu_set_queue,),
+    )
+
+
+def main(args):
+    initial_cpu_affinity = os.sched_getaffinity(os.getpid())
+
+    # Create the output directory
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if(args.dap):
+        if(args.use_precomputed_alignments is None):
+            raise ValueError(
+                "--dap requires --use_precomputed_alignments, since the "
+                "ranks featurize the inputs independently"
+            )
+        dap.init_dap(args.dap_backend, args.dap_init_method)
+        logger.info(
+            f"DAP rank {dap.get_rank()} of {dap.get_world_size()}..."
+        )
+
+    ensemble = None
+    if(args.ensemble_presets):
+        if(args.batch_size > 1):
+            raise ValueError(
+                "--batch_size can't be used with --ensemble_presets"
+            )
+
+        # The features are computed with the data config of the first 
+        # preset and reprocessed for the others as needed
+        args.config_preset = args.ensemble_presets[0]
+
+    # Prep the model
+    config = model_config(args.config_preset)
+    
+    if(args.ensemble_presets):
+        logger.info(f"Using config presets {args.ensemble_presets}...")
+        ensemble = PresetEnsemble(args.ensemble_presets, args)
+        model = None
+    else:
+        logger.info(f"Using config preset {args.config_preset}...")
+        model = load_model(config, args)
+
+    random_seed = args.data_random_seed
+    if random_seed is None:
+        random_seed = random.randrange(sys.maxsize)
+    # The ranks must sample the same features
+    random_seed = dap.broadcast_object(random_seed)
+    seed_everything(random_seed)
+    feature_processor = feature_pipeline.FeaturePipeline(config.data)
+
+    alignment_dir = get_alignment_dir(args)
+
+    prediction_dir = os.path.join(args.output_dir, "predictions") 
+    os.makedirs(prediction_dir, exist_ok=True)
+
+    fasta_paths = [
+        os.path.join(args.fasta_dir, fasta_file) 
+        for fasta_file in os.listdir(args.fasta_dir)
+    ]
+
+    with contextlib.ExitStack() as stack:
+        if(args.num_feature_workers > 0):
+            # Spawned rather than forked, as forking after OpenMP has been 
+            # initialized for the model is not safe
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=args.num_feature_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_feature_worker,
+                    initargs=(args, random_seed),
+                )
+            )
+            featurized = prefetch_features(
+                executor, 
+                fasta_paths, 
+                alignment_dir, 
+                prediction_dir, 
+                max(args.prefetch_depth, 1),
             )
-            with open(relaxed_output_path + '.incomp', 'w') as fp:
-                fp.write(relaxed_pdb_str)
-            os.rename(relaxed_output_path + '.incomp', relaxed_output_path)
+        else:
+            data_processor = make_data_processor(config, args)
+            featurized = (
+                (fasta_path, featurize_fasta(
+                    fasta_path,
+                    data_processor,
+                    feature_processor,
+                    alignment_dir,
+                    prediction_dir,
+                    args,
+                ))
+                for fasta_path in fasta_paths
+            )
+
+        relax_executor = None
+        if(not args.skip_relaxation and args.num_relax_workers > 0):
+            relax_executor = stack.enter_context(
+                make_relax_executor(initial_cpu_affinity, args)
+            )
+
+        relax_futures = []
 
-            logger.info(f"Relaxed output written to {relaxed_output_path}...")
+        def relax_predictions(predictions):
+            if(args.skip_relaxation or dap.get_rank() != 0):
+                return
 
-        if(args.save_outputs):
-            output_dict_path = os.path.join(
-                args.output_dir, f'{output_name}_output_dict.pkl'
+            for unrelaxed_protein, output_name in predictions:
+                if(relax_executor is None):
+                    relax_prediction(
+                        unrelaxed_protein,
+                        output_name,
+                        prediction_dir,
+                        config.relax,
+                        initial_cpu_affinity,
+                        args,
+                    )
+                else:
+                    # The model moves on to the next sequence right away
+                    relax_futures.append(relax_executor.submit(
+                        _relax_prediction_in_worker,
+                        unrelaxed_protein,
+                        output_name,
+                        prediction_dir,
+                        config.relax.to_dict(),
+                        args,
+                    ))
+
+        # Short sequences waiting for their batch, by padded length
+        buckets = collections.defaultdict(list)
+        for fasta_path, features in featurized:
+            if(features is None):
+                continue
+
+            _, feature_dict, _ = features
+            bucket_len = get_bucket_len(
+                int(feature_dict["seq_length"][0]), args
             )
-            with open(output_dict_path, "wb") as fp:
-                pickle.dump(out, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            if(ensemble is not None):
+                relax_predictions(predict_ensemble(
+                    *features,
+                    ensemble,
+                    prediction_dir,
+                    args,
+                ))
+                continue
+            elif(bucket_len is None):
+                unrelaxed_protein, output_name, _ = predict_features(
+                    *features,
+                    model,
+                    feature_processor,
+                    prediction_dir,
+                    args,
+                )
+                relax_predictions([(unrelaxed_protein, output_name)])
+                continue
 
-            logger.info(f"Model output written to {output_dict_path}...")
+            buckets[bucket_len].append(features)
+            if(len(buckets[bucket_len]) == args.batch_size):
+                relax_predictions(predict_batch(
+                    buckets.pop(bucket_len),
+                    model,
+                    config,
+                    feature_processor,
+                    prediction_dir,
+                    args,
+                ))
 
-if __name__ == "__main__":
+        # Partially filled batches
+        for features_list in buckets.values():
+            relax_predictions(predict_batch(
+                features_list,
+                model,
+                config,
+                feature_processor,
+                prediction_dir,
+                args,
+            ))
+
+        for future in relax_futures:
+            future.result()
+
+
+def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "fasta_dir", type=str,
@@ -410,12 +1309,34 @@ if __name__ == "__main__":
         help="""Name of a model config. Choose one of model_{1-5} or 
              model_{1-5}_ptm, as defined on the AlphaFold GitHub."""
     )
+    parser.add_argument(
+        "--ensemble_presets", type=str, nargs="+", default=None,
+        help="""Names of several model configs run on every FASTA file with
+             a single model instance, e.g. model_1 model_2 model_3 model_4
+             model_5. Overrides --config_preset. Parameters are loaded from 
+             --jax_param_dir and the features are shared among the presets"""
+    )
+    parser.add_argument(
+        "--jax_param_dir", type=str, 
+        default=os.path.join("openfold", "resources", "params"),
+        help="""Directory of the params_<preset>.npz files of the JAX model
+             parameters used with --ensemble_presets. params_<preset>.store
+             files converted by scripts/convert_jax_params.py are used 
+             instead where present"""
+    )
     parser.add_argument(
         "--jax_param_path", type=str, default=None,
         help="""Path to JAX model parameters. If None, and openfold_checkpoint_path
              is also None, parameters are selected automatically according to 
              the model name from openfold/resources/params"""
     )
+    parser.add_argument(
+        "--param_store_path", type=str, default=None,
+        help="""Path to a parameter store converted from JAX parameters by
+             scripts/convert_jax_params.py. It is memory-mapped, so that
+             processes on the same node share a single copy. Takes 
+             precedence over jax_param_path"""
+    )
     parser.add_argument(
         "--openfold_checkpoint_path", type=str, default=None,
         help="""Path to OpenFold checkpoint. Can be either a DeepSpeed 
@@ -450,8 +1371,147 @@ if __name__ == "__main__":
     parser.add_argument(
             "--use_small_bfd", action="store_true", default=False,
     )
+    parser.add_argument(
+        "--num_feature_workers", type=int, default=0,
+        help="""Number of background processes computing the input features
+             of the next FASTA files while the model runs. If 0, the features
+             are computed in series with the model"""
+    )
+    parser.add_argument(
+        "--prefetch_depth", type=int, default=2,
+        help="""Maximum number of FASTA files featurized ahead of the model
+             when --num_feature_workers is positive"""
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=1,
+        help="""Number of short sequences run together in a single forward 
+             pass. Sequences are padded to a multiple of --batch_bucket_size
+             and only those of the same padded length are batched together"""
+    )
+    parser.add_argument(
+        "--batch_bucket_size", type=int, default=32,
+        help="""Granularity in residues of the padded length of batched 
+             sequences"""
+    )
+    parser.add_argument(
+        "--batch_max_len", type=int, default=200,
+        help="""Sequences longer than this are never batched"""
+    )
+    parser.add_argument(
+        "--num_relax_workers", type=int, default=0,
+        help="""Number of background processes running Amber relaxation, so
+             that the model proceeds to the next sequence without waiting for
+             it. If 0, relaxation runs in series with the model"""
+    )
+    parser.add_argument(
+        "--relax_cpus", type=str, default=None,
+        help="""CPUs (e.g. "36-47") split evenly among the relaxation workers.
+             By default, every worker may use all CPUs of the process"""
+    )
+    parser.add_argument(
+        "--feature_cache_dir", type=str, default=None,
+        help="""Directory of a feature cache shared between runs. The input
+             features are looked up by the sequence, the contents of the 
+             alignment files and the data config, so that retried or 
+             re-predicted sequences skip MSA and template processing. The
+             processed features are only cached with --data_random_seed"""
+    )
+    parser.add_argument(
+        "--feature_cache_size", type=float, default=None,
+        help="""Maximum size of the feature cache in GiB. The least recently
+             used entries are removed beyond it. Unlimited by default"""
+    )
+    parser.add_argument(
+        "--template_cache_size", type=float, default=None,
+        help="""Size in GiB of an in-memory LRU cache of the parsed template
+             structures of each featurization process, so that templates
+             recurring across sequences are read once. Disabled by default"""
+    )
+    parser.add_argument(
+        "--template_cache_dir", type=str, default=None,
+        help="""Directory, e.g. under /dev/shm, where the parsed template
+             structures are also cached with --template_cache_size, shared
+             by the featurization processes and later runs. Only used for
+             .pkl files and structure stores"""
+    )
+    parser.add_argument(
+        "--flash_attention", action="store_true", default=False,
+        help="""Use the single-pass attention kernel that streams over blocks
+             of keys instead of materializing the full attention logits.
+             Reduces the memory traffic of the extra MSA stack"""
+    )
+    parser.add_argument(
+        "--chunk_plan_path", type=str, default=None,
+        help="""JSON file of chunk size plans. The chunk size of each module
+             of the Evoformer and extra MSA stacks is tuned by wall time on
+             the first input of a given size, dtype and thread count, and
+             the plans are reused by later runs"""
+    )
+    parser.add_argument(
+        "--chunk_memory_budget", type=float, default=None,
+        help="""Maximum activation memory of a chunked module in GiB when
+             tuning chunk size plans"""
+    )
+    parser.add_argument(
+        "--memory_budget", type=float, default=None,
+        help="""Activation memory available to the process in GiB. The chunk
+             size, low-memory attention, offloading and template averaging
+             are chosen per input as the fastest settings estimated to fit
+             in it"""
+    )
+    parser.add_argument(
+        "--precision", type=str, default="fp32",
+        choices=list(PRECISION_DTYPES.keys()),
+        help="""Dtype of the parameters and activations. With bf16, the
+             softmax and LayerNorm statistics, the rigid frames of the
+             structure module and the confidence metrics are still computed
+             in fp32. See scripts/bf16_parity_report.py for the resulting
+             accuracy"""
+    )
+    parser.add_argument(
+        "--offload_dir", type=str, default=None,
+        help="""Directory on node-local storage, e.g. /local or the LLIO
+             cache, to which the MSA and pair activations are spilled
+             between Evoformer blocks. Read back ahead of their use by a
+             background thread. The traffic and stall time of each block
+             are logged"""
+    )
+    parser.add_argument(
+        "--stream_tile_size", type=int, default=None,
+        help="""Keep the pair embedding in a memory-mapped file under
+             --offload_dir (or the temporary directory) and run the pair
+             stack of the Evoformer and extra MSA stacks by tiles of this
+             many rows, so that sequences longer than fit in memory can be
+             predicted. See scripts/streaming_evoformer_report.py for the
+             cost in throughput"""
+    )
+    parser.add_argument(
+        "--dap", action="store_true", default=False,
+        help="""Split the Evoformer, extra MSA and template pair stacks of
+             each prediction among the processes of an MPI job or torchrun,
+             e.g. one per node, by sequence and by residue (dynamic axial
+             parallelism). Every process runs the rest of the model, and
+             the first writes the predictions. Requires
+             --use_precomputed_alignments"""
+    )
+    parser.add_argument(
+        "--dap_backend", type=str, default="gloo", choices=["gloo", "mpi"],
+        help="""Backend of torch.distributed for --dap. "mpi" requires a
+             PyTorch build with MPI"""
+    )
+    parser.add_argument(
+        "--dap_init_method", type=str, default="env://",
+        help="""Rendezvous of the --dap processes for the gloo backend,
+             e.g. a file:// URL on a shared file system. "env://" reads
+             MASTER_ADDR and MASTER_PORT"""
+    )
     add_data_args(parser)
-    args = parser.parse_args()
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
 
     if(args.jax_param_path is None and args.openfold_checkpoint_path is None):
         args.jax_param_path = os.path.join(
@@ -21,9 +21,28 @@ import traceback
 import time
 import subprocess
 
+import numpy as np
+
+from openfold.data.fasta_index import FastaIndex
 from openfold.data.parsers import parse_fasta
+from openfold.data.run_ledger import (
+    STATE_FILE,
+    STATE_OK,
+    STATE_TIMEOUT,
+    STATE_UNKNOWN,
+    RunLedger,
+    is_completed,
+    load_state,
+)
 from scripts.utils import add_data_args
-from scripts.openfold_runner import OpenFoldInference
+from scripts.openfold_runner import OpenFoldInference, OpenFoldResidentInference
+from scripts.scheduler import (
+    INFERENCE_TIME_COEFFS,
+    SharedWorkQueue,
+    default_work_queue_path,
+    estimate_inference_time,
+    partition_lpt,
+)
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s :%(message)s")
@@ -54,28 +73,58 @@ def run_inference(runner, name, seq, pred_dir, args):
         logging.info(f"Processing for {name} done!")
     return ret
 
+def get_ledger_key(name, args):
+    # The same as the name of the output files
+    return f"{name}_{args.config_preset}"
+
+def load_ledger_state(args):
+    if args.ledger_dir is None:
+        return {}
+
+    state_path = os.path.join(args.ledger_dir, STATE_FILE)
+    state = load_state(state_path)
+    logging.info(f"Loaded {len(state)} items from {state_path}")
+    return state
+
 def run_seq_group_inference(seq_groups, args):
     dirs = set(os.listdir(args.output_dir))
     pred_dir = os.path.join(args.output_dir, 'predictions')
-    runner = OpenFoldInference(os.path.join(os.environ.get('OPENFOLDDIR'), 'run_pretrained_openfold.py'))
+    if args.resident_worker:
+        runner = OpenFoldResidentInference()
+    else:
+        runner = OpenFoldInference(os.path.join(os.environ.get('OPENFOLDDIR'), 'run_pretrained_openfold.py'))
+
+    ledger = None
+    if args.ledger_dir is not None:
+        mpi_rank, _ = get_mpi_rank_size()
+        ledger = RunLedger(args.ledger_dir, mpi_rank)
+
+    # With a ledger, completed groups were removed from seq_groups by its
+    # state, so the outputs aren't probed on the shared filesystem
+    def needs_output(name):
+        return ledger is not None or not is_inferred(name, pred_dir, args)
 
     for seq, names in seq_groups:
         print("seq, names", seq, names)
         first_name = names[0]
+        ledger_key = get_ledger_key(first_name, args)
 
-        if not is_inferred(first_name, pred_dir, args):
-            begin_time = time.time()
+        begin_time = time.time()
+        ret = {'inference_time': 0., 'relaxation_time': 0.}
+        if needs_output(first_name):
             try:
                 ret = run_inference(runner, first_name, seq, pred_dir, args)
             except Exception as e:
                 duration = time.time() - begin_time
                 traceback.print_exc()
                 logging.warning(f"Failed to run inference for {first_name}. Skipping...")
-                if isinstance(e, subprocess.TimeoutExpired):
-                    state = 'NG_timeout'
+                if isinstance(e, (subprocess.TimeoutExpired, TimeoutError)):
+                    state = STATE_TIMEOUT
                 else:
-                    state = 'NG_unknown'
+                    state = STATE_UNKNOWN
                 logging.info(f"inference_stat {first_name} {len(seq)} {state} {duration:.1f} 0 0")
+                if ledger is not None:
+                    ledger.record(ledger_key, state, duration, seq_len=len(seq))
                 continue
             else:
                 duration = time.time() - begin_time
@@ -90,12 +139,27 @@ def run_seq_group_inference(seq_groups, args):
                 raise Exception(f'{gen_file} is not exist')
 
         for name in names[1:]:
-            if not is_inferred(name, pred_dir, args):
+            if needs_output(name):
                 for f in generated_pdbs:
                         copy_file = os.path.join(pred_dir, '{}{}'.format(name, os.path.basename(f)[len(first_name):]))
                         logging.info(f"Copying result from {f} to {copy_file}")
                         copyfile(f, copy_file)
 
+        # Recorded once the copies are done, as the whole group is skipped
+        # by later jobs
+        if ledger is not None:
+            ledger.record(
+                ledger_key,
+                STATE_OK,
+                time.time() - begin_time,
+                seq_len=len(seq),
+                inference_time=ret['inference_time'],
+                relaxation_time=ret['relaxation_time'],
+            )
+
+    if ledger is not None:
+        ledger.close()
+
 
 def make_uniq_seq_groups(input_seqs, input_chains):
     assert len(input_seqs) == len(input_chains)
@@ -118,7 +182,109 @@ def make_uniq_seq_groups(input_seqs, input_chains):
 
     return [x[0] for x in items], [x[1] for x in items]
 
+def get_mpi_rank_size():
+    if "OMPI_COMM_WORLD_RANK" in os.environ:
+        # ABCI (OpenMPI)
+        mpi_rank = int(os.environ["OMPI_COMM_WORLD_RANK"])
+        mpi_size = int(os.environ["OMPI_COMM_WORLD_SIZE"])
+
+    elif "PMIX_RANK" in os.environ:
+        # Fugaku (Fujitsu MPI)
+        mpi_rank = int(os.environ["PMIX_RANK"])
+        mpi_size = int(os.environ["OMPI_UNIVERSE_SIZE"])
+
+    else:
+        logging.warning("MPI rank/size environment variables not found")
+        mpi_rank = 0
+        mpi_size = 1
+
+    return mpi_rank, mpi_size
+
+def to_first_lower(s):
+    x = s.split(sep='_')
+    x[0] = x[0].lower()
+    return '_'.join(x)
+
+def get_indexed_seq_groups(args):
+    # The groups of the index are already unique and sorted by length
+    if args.ignore_unique or args.weak_scale:
+        raise ValueError("--fasta_index can't be used with --ignore_unique or --weak_scale")
+
+    mpi_rank, mpi_size = get_mpi_rank_size()
+    assert mpi_size > 0
+    assert mpi_rank >= 0 and mpi_rank < mpi_size
+
+    index = FastaIndex(args.fasta_index, args.input_file)
+    orig_total_count = index.num_entries
+
+    def read_group(g):
+        seq, names = index.group(g)
+        if args.first_lower:
+            names = list(map(to_first_lower, names))
+        return seq, names
+
+    def read_first_name(g):
+        name = index.name(int(index.group_members(g)[0]))
+        return to_first_lower(name) if args.first_lower else name
+
+    # Groups are distributed first and the completed ones removed by each
+    # rank from its own, so that a rank only reads the names of its groups
+    ledger_state = load_ledger_state(args)
+
+    def is_pending(g):
+        return len(ledger_state) == 0 or not is_completed(ledger_state, get_ledger_key(read_first_name(g), args))
+
+    def remove_completed(my_groups):
+        pending = [g for g in my_groups if is_pending(g)]
+        if len(pending) < len(my_groups):
+            logging.info(f"Skipping {len(my_groups) - len(pending)} sequences completed in the previous jobs")
+        return pending
+
+    total_count = index.num_groups
+
+    if args.schedule == "round_robin":
+        my_groups = remove_completed(range(mpi_rank, total_count, mpi_size))
+        seq_groups = [read_group(g) for g in my_groups]
+
+        logging.info(f"mpi_rank={mpi_rank}, mpi_size={mpi_size}, orig_total_count={orig_total_count}, total_count={total_count}, my_count={len(seq_groups)}")
+        logging.info(f"my chains: {[x[1] for x in seq_groups]}")
+
+    elif args.schedule == "lpt":
+        if list(args.cost_coeffs) == index.meta["cost_coeffs"]:
+            costs = index.groups["cost"]
+        else:
+            costs = estimate_inference_time(index.groups["seq_len"].astype(np.float64), args.cost_coeffs)
+        parts, loads = partition_lpt(np.asarray(costs).tolist(), mpi_size)
+        my_groups = remove_completed(parts[mpi_rank])
+        seq_groups = [read_group(g) for g in my_groups]
+
+        logging.info(f"mpi_rank={mpi_rank}, mpi_size={mpi_size}, orig_total_count={orig_total_count}, total_count={total_count}, my_count={len(seq_groups)}")
+        logging.info(f"estimated time [s]: mine={loads[mpi_rank]:.1f}, max={max(loads):.1f}, min={min(loads):.1f}")
+        logging.info(f"my chains: {[x[1] for x in seq_groups]}")
+
+    else:
+        # Longest first, so that the shortest sequences fill the tail of the
+        # job. Completed groups are skipped as they are taken
+        work_queue_path = args.work_queue_path
+        if work_queue_path is None:
+            work_queue_path = default_work_queue_path(args.output_dir)
+        queue = SharedWorkQueue(work_queue_path, total_count)
+        seq_groups = (
+            read_group(total_count - 1 - i) for i in queue
+            if is_pending(total_count - 1 - i)
+        )
+
+        logging.info(f"mpi_rank={mpi_rank}, mpi_size={mpi_size}, orig_total_count={orig_total_count}, total_count={total_count}, work_queue={work_queue_path}")
+
+    return seq_groups
+
 def main(args):
+    if args.fasta_index is not None:
+        seq_groups = get_indexed_seq_groups(args)
+        run_seq_group_inference(seq_groups, args)
+        logging.info("DONE!")
+        return
+
     input_file = args.input_file
     with open(input_file, 'r') as fp:
         fasta_str = fp.read()
@@ -131,14 +297,19 @@ def main(args):
         logging.warning(f"--ignore_unique is enabled. The process might be redundant")
         input_chains = [[x] for x in input_chains]
 
-    def to_first_lower(s):
-        x = s.split(sep='_')
-        x[0] = x[0].lower()
-        return '_'.join(x)
-
     if args.first_lower:
         input_chains = [list(map(to_first_lower, g)) for g in input_chains]
 
+    ledger_state = load_ledger_state(args)
+    if len(ledger_state) > 0:
+        pending = [i for i, g in enumerate(input_chains) if not is_completed(ledger_state, get_ledger_key(g[0], args))]
+        logging.info(f"Skipping {len(input_chains) - len(pending)} sequences completed in the previous jobs")
+        input_seqs   = [  input_seqs[i] for i in pending]
+        input_chains = [input_chains[i] for i in pending]
+        if len(pending) == 0:
+            logging.info("DONE!")
+            return
+
     # sort by sequence length
     zip_seqs_chains = zip(input_seqs, input_chains)
     zip_seqs_chains_sorted = sorted(zip_seqs_chains, key=lambda x: len(x[0]))
@@ -147,20 +318,7 @@ def main(args):
     # input_seqs   = [AAA, BBB, ...]
     # input_chains = [[A_1, A_2], [B_1], ...]
 
-    if "OMPI_COMM_WORLD_RANK" in os.environ:
-        # ABCI (OpenMPI)
-        mpi_rank = int(os.environ["OMPI_COMM_WORLD_RANK"])
-        mpi_size = int(os.environ["OMPI_COMM_WORLD_SIZE"])
-
-    elif "PMIX_RANK" in os.environ:
-        # Fugaku (Fujitsu MPI)
-        mpi_rank = int(os.environ["PMIX_RANK"])
-        mpi_size = int(os.environ["OMPI_UNIVERSE_SIZE"])
-
-    else:
-        logging.warning("MPI rank/size environment variables not found")
-        mpi_rank = 0
-        mpi_size = 1
+    mpi_rank, mpi_size = get_mpi_rank_size()
 
     if args.weak_scale:
         logging.warning(f"--weak_scale is enabled. The process might be redundant")
@@ -173,14 +331,39 @@ def main(args):
     assert mpi_size > 0
     assert mpi_rank >= 0 and mpi_rank < mpi_size
     total_count  = len(input_seqs)
-    input_seqs   =   input_seqs[mpi_rank::mpi_size]
-    input_chains = input_chains[mpi_rank::mpi_size]
 
-    logging.info(f"mpi_rank={mpi_rank}, mpi_size={mpi_size}, orig_total_count={orig_total_count}, total_count={total_count}, my_count={len(input_seqs)}")
-    logging.info(f"my chains: {input_chains}")
+    if args.schedule == "round_robin":
+        input_seqs   =   input_seqs[mpi_rank::mpi_size]
+        input_chains = input_chains[mpi_rank::mpi_size]
+        seq_groups = list(zip(input_seqs, input_chains))
+
+        logging.info(f"mpi_rank={mpi_rank}, mpi_size={mpi_size}, orig_total_count={orig_total_count}, total_count={total_count}, my_count={len(input_seqs)}")
+        logging.info(f"my chains: {input_chains}")
+
+    elif args.schedule == "lpt":
+        costs = [estimate_inference_time(len(seq), args.cost_coeffs) for seq in input_seqs]
+        parts, loads = partition_lpt(costs, mpi_size)
+        input_seqs   = [  input_seqs[i] for i in parts[mpi_rank]]
+        input_chains = [input_chains[i] for i in parts[mpi_rank]]
+        seq_groups = list(zip(input_seqs, input_chains))
+
+        logging.info(f"mpi_rank={mpi_rank}, mpi_size={mpi_size}, orig_total_count={orig_total_count}, total_count={total_count}, my_count={len(input_seqs)}")
+        logging.info(f"estimated time [s]: mine={loads[mpi_rank]:.1f}, max={max(loads):.1f}, min={min(loads):.1f}")
+        logging.info(f"my chains: {input_chains}")
+
+    else:
+        # Longest first, so that the shortest sequences fill the tail of the job
+        order = sorted(range(total_count), key=lambda i: (-len(input_seqs[i]), i))
+        work_queue_path = args.work_queue_path
+        if work_queue_path is None:
+            work_queue_path = default_work_queue_path(args.output_dir)
+        queue = SharedWorkQueue(work_queue_path, total_count)
+        seq_groups = ((input_seqs[order[i]], input_chains[order[i]]) for i in queue)
+
+        logging.info(f"mpi_rank={mpi_rank}, mpi_size={mpi_size}, orig_total_count={orig_total_count}, total_count={total_count}, work_queue={work_queue_path}")
 
     run_seq_group_inference(
-        zip(input_seqs, input_chains),
+        seq_groups,
         args)
 
     logging.info("DONE!")
@@ -219,6 +402,44 @@ if __name__ == "__main__":
     parser.add_argument(
         '--timeout', type=float, default=None
     )
+    parser.add_argument(
+        "--schedule", type=str, default="round_robin",
+        choices=("round_robin", "lpt", "dynamic"),
+        help="How sequences are distributed among processes. "
+        "round_robin: deal sequences sorted by length in turn, "
+        "lpt: balance the estimated time statically (longest first), "
+        "dynamic: each process takes the next sequence from a shared queue file"
+    )
+    parser.add_argument(
+        "--cost_coeffs", type=float, nargs=3, default=list(INFERENCE_TIME_COEFFS),
+        metavar=("A", "B", "C"),
+        help="Coefficients of the estimated time A*L^2 + B*L + C used by --schedule lpt"
+    )
+    parser.add_argument(
+        "--work_queue_path", type=str, default=None,
+        help="Queue file for --schedule dynamic on a shared filesystem. "
+        "A file left over from another job is an error "
+        "(default: OUTPUT_DIR/work_queue.JOB_ID, with the ID of the batch job)"
+    )
+    parser.add_argument(
+        "--fasta_index", type=str, default=None,
+        help="Index of the input file built by scripts/build_fasta_index.py. "
+        "Each process reads only its own sequences instead of parsing the whole file"
+    )
+    parser.add_argument(
+        "--ledger_dir", type=str, default=None,
+        help="Directory of the run ledgers. Each process records the result of every "
+        "sequence there, and sequences completed according to the state file merged by "
+        "scripts/merge_run_ledgers.py are skipped. The output files are not checked, "
+        "so the others are predicted again even if their outputs exist"
+    )
+    parser.add_argument(
+        "--resident_worker",
+        dest="resident_worker", action="store_const",
+        const=True, default=False,
+        help="Keep the model loaded in this process and run all sequences in it "
+        "instead of launching run_pretrained_openfold.py for each sequence"
+    )
     parser.add_argument(
         "--first_lower",
         dest="first_lower", action="store_const",
@@ -268,6 +489,58 @@ if __name__ == "__main__":
     parser.add_argument(
         "--skip_relaxation", action="store_true", default=False,
     )
+    parser.add_argument(
+        "--feature_cache_dir", type=str, default=None,
+        help="""Directory of a feature cache shared between runs, so that
+             retried sequences skip MSA and template processing"""
+    )
+    parser.add_argument(
+        "--feature_cache_size", type=float, default=None,
+        help="""Maximum size of the feature cache in GiB"""
+    )
+    parser.add_argument(
+        "--template_cache_size", type=float, default=None,
+        help="""Size in GiB of the in-memory cache of parsed template
+             structures"""
+    )
+    parser.add_argument(
+        "--template_cache_dir", type=str, default=None,
+        help="""Directory, e.g. under /dev/shm, of the parsed template
+             structures shared by the processes of a node"""
+    )
+    parser.add_argument(
+        "--flash_attention", action="store_true", default=False,
+        help="""Use the single-pass attention kernel that never materializes
+             the full attention logits"""
+    )
+    parser.add_argument(
+        "--chunk_plan_path", type=str, default=None,
+        help="""JSON file of chunk size plans shared between ranks and runs"""
+    )
+    parser.add_argument(
+        "--chunk_memory_budget", type=float, default=None,
+        help="""Maximum activation memory of a chunked module in GiB when
+             tuning chunk size plans"""
+    )
+    parser.add_argument(
+        "--memory_budget", type=float, default=None,
+        help="""Activation memory available to each process in GiB, from
+             which the chunk size and other memory settings are chosen"""
+    )
+    parser.add_argument(
+        "--precision", type=str, default="fp32", choices=["fp32", "bf16"],
+        help="""Dtype of the parameters and activations"""
+    )
+    parser.add_argument(
+        "--offload_dir", type=str, default=None,
+        help="""Node-local directory to which activations are spilled
+             between Evoformer blocks"""
+    )
+    parser.add_argument(
+        "--stream_tile_size", type=int, default=None,
+        help="""Rows of the pair embedding per tile when streaming it from
+             a memory-mapped file"""
+    )
 
     args = parser.parse_args()
 
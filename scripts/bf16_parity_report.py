@@ -0,0 +1,184 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reports the accuracy of inference with --precision bf16 against fp32. The
+same features are predicted in both precisions and the bf16 predictions are
+scored with the fp32 ones as the reference: the pLDDT difference, the
+lDDT-Ca and the Ca RMSD after superposition.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import pickle
+import time
+
+import sys
+sys.path.append(".") # an innocent hack to get this to run from the top level
+
+import torch
+
+from openfold.config import model_config
+from openfold.data import feature_pipeline
+from openfold.model.model import AlphaFold
+from openfold.np import residue_constants
+from openfold.utils.import_weights import import_jax_weights_
+from openfold.utils.loss import lddt_ca
+from openfold.utils.seed import seed_everything
+from openfold.utils.superimposition import superimpose
+from openfold.utils.tensor_utils import tensor_tree_map
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+def load_features(path):
+    """Loads a feature dict pickled by the data pipeline."""
+    open_fn = gzip.open if path.endswith(".gz") else open
+    with open_fn(path, "rb") as fp:
+        return pickle.load(fp)
+
+
+def predict(model, batch):
+    # Disable templates if there aren't any in the batch
+    model.config.template.enabled = model.config.template.enabled and any(
+        "template_" in k for k in batch
+    )
+
+    with torch.no_grad():
+        start = time.perf_counter()
+        out = model(batch)
+        inference_time = time.perf_counter() - start
+
+    out = tensor_tree_map(
+        lambda t: t.float() if t.is_floating_point() else t, out
+    )
+
+    return out, inference_time
+
+
+def compare(ref, out, batch):
+    """Scores a prediction with another one as the reference."""
+    # [N_res, 37], without the recycling dimension
+    atom_mask = batch["atom37_atom_exists"][..., -1].float()
+    ca_pos = residue_constants.atom_order["CA"]
+    ca_mask = atom_mask[..., ca_pos]
+
+    pos_ref = ref["final_atom_positions"]
+    pos = out["final_atom_positions"]
+    _, rmsd = superimpose(
+        pos_ref[..., ca_pos, :], pos[..., ca_pos, :], ca_mask
+    )
+
+    plddt_diff = torch.abs(out["plddt"] - ref["plddt"])
+    report = {
+        "plddt_ref": float(torch.mean(ref["plddt"])),
+        "plddt": float(torch.mean(out["plddt"])),
+        "plddt_abs_diff_mean": float(torch.mean(plddt_diff)),
+        "plddt_abs_diff_max": float(torch.max(plddt_diff)),
+        "lddt_ca": float(
+            lddt_ca(pos, pos_ref, atom_mask, per_residue=False) * 100
+        ),
+        "ca_rmsd": float(rmsd),
+    }
+    if("predicted_tm_score" in out):
+        report["ptm_ref"] = float(ref["predicted_tm_score"])
+        report["ptm"] = float(out["predicted_tm_score"])
+
+    return report
+
+
+def main(args):
+    config = model_config(args.config_preset)
+    feature_processor = feature_pipeline.FeaturePipeline(config.data)
+
+    # The same MSA clusters are sampled for both precisions
+    batches = {}
+    for path in args.feature_paths:
+        seed_everything(args.data_random_seed)
+        processed_feature_dict = feature_processor.process_features(
+            load_features(path), mode="predict",
+        )
+        batches[path] = {
+            k: torch.as_tensor(v, device=args.model_device)
+            for k, v in processed_feature_dict.items()
+        }
+
+    model = AlphaFold(config).eval()
+    import_jax_weights_(
+        model, args.jax_param_path, version=args.config_preset
+    )
+    model = model.to(args.model_device)
+
+    outputs = {}
+    for precision, dtype in [("fp32", torch.float32), ("bf16", torch.bfloat16)]:
+        # Cast once, in the same way as run_pretrained_openfold.py
+        model = model.to(dtype=dtype)
+        for path, batch in batches.items():
+            out, inference_time = predict(model, batch)
+            outputs[(path, precision)] = out
+            logging.info(
+                f"{os.path.basename(path)} {precision}: {inference_time:.2f}s"
+            )
+
+    reports = {}
+    for path, batch in batches.items():
+        report = compare(
+            outputs[(path, "fp32")], outputs[(path, "bf16")], batch
+        )
+        reports[path] = report
+        logging.info(
+            f"{os.path.basename(path)}: " +
+            ", ".join(f"{k}={v:.4f}" for k, v in report.items())
+        )
+
+    if(args.output_path is not None):
+        with open(args.output_path, "w") as fp:
+            json.dump(reports, fp, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "feature_paths", type=str, nargs="*",
+        default=["tests/test_data/features.pkl"],
+        help="""Pickled feature dicts of the data pipeline, optionally
+             gzipped. Defaults to the test fixture"""
+    )
+    parser.add_argument(
+        "--jax_param_path", type=str,
+        default="openfold/resources/params/params_model_1_ptm.npz",
+        help="Path to JAX model parameters"
+    )
+    parser.add_argument(
+        "--config_preset", type=str, default="model_1_ptm",
+        help="Name of a model config preset defined in openfold/config.py"
+    )
+    parser.add_argument(
+        "--model_device", type=str, default="cpu",
+        help="Name of the device on which to run the model"
+    )
+    parser.add_argument(
+        "--data_random_seed", type=int, default=42,
+    )
+    parser.add_argument(
+        "--output_path", type=str, default=None,
+        help="Path to write the report as JSON"
+    )
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,67 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Builds the index of a FASTA file used by the --fasta_index option of
+run_pretrained_openfold_multi.py and precompute_alignments_fugaku.py.
+"""
+import argparse
+import logging
+import os
+
+import sys
+sys.path.append(".") # an innocent hack to get this to run from the top level
+os.environ["OPENFOLD_IGNORE_IMPORT"] = "1"
+
+from openfold.data.fasta_index import build_fasta_index
+from scripts.scheduler import INFERENCE_TIME_COEFFS
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main(args):
+    build_fasta_index(
+        args.input_file,
+        args.index_dir,
+        args.cost_coeffs,
+        unique_names=args.unique_names,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "input_file", type=str,
+        help="The input FASTA file"
+    )
+    parser.add_argument(
+        "index_dir", type=str,
+        help="Output directory of the index"
+    )
+    parser.add_argument(
+        "--cost_coeffs", type=float, nargs=3,
+        default=list(INFERENCE_TIME_COEFFS), metavar=("A", "B", "C"),
+        help="Coefficients of the estimated time A*L^2 + B*L + C of a sequence"
+    )
+    parser.add_argument(
+        "--unique_names", action="store_true", default=False,
+        help="""Rename duplicated names by adding suffixes, as
+             precompute_alignments_fugaku.py does. Otherwise, duplicated
+             names are an error"""
+    )
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,107 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Builds a structure store from a directory of template .cif files, or of the
+.pkl files written by convert_mmcif/convert.py. The store can be passed in
+place of the directory as the template mmCIF directory of
+run_pretrained_openfold.py and train_openfold.py.
+
+Run in one process with --num_workers worker processes, or as an MPI job
+with one shard per rank followed by the index:
+
+    mpiexec -n N python3 scripts/build_structure_store.py \
+        mmcif_files/ store/ --num_shards N
+    python3 scripts/build_structure_store.py \
+        mmcif_files/ store/ --num_shards N --finalize
+"""
+import argparse
+import logging
+import os
+
+import sys
+sys.path.append(".") # an innocent hack to get this to run from the top level
+os.environ["OPENFOLD_IGNORE_IMPORT"] = "1"
+
+from openfold.data.structure_store import (
+    build_structure_store,
+    finalize_structure_store,
+    list_pdb_ids,
+    write_structure_shard,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+def get_pdb_ids(args):
+    if(args.pdb_id_path is not None):
+        with open(args.pdb_id_path, "r") as fp:
+            return [l.strip() for l in fp.readlines() if l.strip()]
+
+    return list_pdb_ids(args.mmcif_dir)
+
+
+def main(args):
+    if(args.num_shards is None):
+        build_structure_store(
+            args.mmcif_dir,
+            args.store_dir,
+            num_workers=args.num_workers,
+            pdb_ids=get_pdb_ids(args),
+        )
+    elif(args.finalize):
+        finalize_structure_store(args.store_dir, args.num_shards)
+    else:
+        rank = int(os.environ.get("PMIX_RANK", "0"))
+        logging.info(f"rank = {rank} / {args.num_shards}")
+        write_structure_shard(
+            args.mmcif_dir,
+            get_pdb_ids(args)[rank::args.num_shards],
+            args.store_dir,
+            rank,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "mmcif_dir", type=str,
+        help="Directory of .cif or .pkl files"
+    )
+    parser.add_argument(
+        "store_dir", type=str,
+        help="Output directory of the store"
+    )
+    parser.add_argument(
+        "--pdb_id_path", type=str, default=None,
+        help="File of the PDB IDs to store, one per line. Defaults to all"
+    )
+    parser.add_argument(
+        "--num_workers", type=int, default=1,
+        help="Number of worker processes, without --num_shards"
+    )
+    parser.add_argument(
+        "--num_shards", type=int, default=None,
+        help="""Number of MPI ranks. Each rank writes the shard of its
+             PMIX_RANK"""
+    )
+    parser.add_argument(
+        "--finalize", action="store_true", default=False,
+        help="Index the shards written by the MPI ranks"
+    )
+
+    args = parser.parse_args()
+
+    main(args)
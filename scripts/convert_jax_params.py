@@ -0,0 +1,79 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Converts the JAX params_<preset>.npz files once to memory-mappable parameter
+stores (params_<preset>.store) laid out in OpenFold parameter order.
+"""
+import argparse
+import logging
+import os
+
+import sys
+sys.path.append(".") # an innocent hack to get this to run from the top level
+
+from openfold.config import model_config
+from openfold.model.model import AlphaFold
+from openfold.utils.import_weights import import_jax_weights_
+from openfold.utils.param_store import save_param_store
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    for preset in args.config_presets:
+        npz_path = os.path.join(args.jax_param_dir, f"params_{preset}.npz")
+        if not os.path.exists(npz_path):
+            logging.warning(f"{npz_path} not found. Skipping...")
+            continue
+
+        model = AlphaFold(model_config(preset)).eval()
+        import_jax_weights_(model, npz_path, version=preset)
+
+        output_path = os.path.join(args.output_dir, f"params_{preset}.store")
+        save_param_store(
+            model.state_dict(),
+            output_path + ".incomp",
+            metadata={
+                "version": preset,
+                "source": os.path.basename(npz_path),
+            },
+        )
+        os.rename(output_path + ".incomp", output_path)
+        logging.info(f"Converted {npz_path} to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "jax_param_dir", type=str,
+        help="Directory containing the params_<preset>.npz files"
+    )
+    parser.add_argument(
+        "output_dir", type=str,
+        help="Directory for the params_<preset>.store files"
+    )
+    parser.add_argument(
+        "--config_presets", type=str, nargs="+",
+        default=[
+            f"model_{i}{s}" for s in ["", "_ptm"] for i in range(1, 6)
+        ],
+        help="Config presets to convert. By default, all model_{1-5}(_ptm)"
+    )
+
+    args = parser.parse_args()
+
+    main(args)
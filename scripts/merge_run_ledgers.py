@@ -0,0 +1,75 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Merges the per-rank ledgers written with --ledger_dir into the state file
+read by the next job. Run it between jobs.
+"""
+import argparse
+import collections
+import logging
+import os
+
+import sys
+sys.path.append(".") # an innocent hack to get this to run from the top level
+os.environ["OPENFOLD_IGNORE_IMPORT"] = "1"
+
+from openfold.data.run_ledger import STATE_OK, merge_ledgers
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main(args):
+    state = merge_ledgers(
+        args.ledger_dir, state_path=args.state_path, remove=args.remove
+    )
+
+    counts = collections.Counter(v["state"] for v in state.values())
+    logging.info(
+        f"{len(state)} items: " +
+        ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+    )
+
+    if args.failed_list_path is not None:
+        with open(args.failed_list_path, "w") as fp:
+            for k, v in sorted(state.items()):
+                if v["state"] != STATE_OK:
+                    fp.write(f"{k}\t{v['state']}\t{v['attempts']}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "ledger_dir", type=str,
+        help="Directory given to --ledger_dir of the drivers"
+    )
+    parser.add_argument(
+        "--state_path", type=str, default=None,
+        help="Output state file. Defaults to state.json in ledger_dir, "
+             "which the drivers read"
+    )
+    parser.add_argument(
+        "--remove", action="store_true", default=False,
+        help="Remove the per-rank ledgers once merged"
+    )
+    parser.add_argument(
+        "--failed_list_path", type=str, default=None,
+        help="Path to write the items not completed yet, with their state "
+             "and number of attempts"
+    )
+
+    args = parser.parse_args()
+
+    main(args)
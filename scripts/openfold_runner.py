@@ -15,8 +15,12 @@
 # limitations under the License.
 
 """A Python wrapper for OpenFold."""
+import gc
 import os
+import random
+import signal
 import subprocess
+import sys
 import re
 from typing import Sequence
 
@@ -25,6 +29,74 @@ from absl import logging
 from openfold.data.tools import utils
 
 
+def make_script_args(
+        fasta_dir: str,
+        template_mmcif_dir: str,
+        args: object) -> Sequence[str]:
+    """Builds the command line arguments of run_pretrained_openfold.py."""
+    script_args = [
+        fasta_dir,
+        template_mmcif_dir,
+        "--model_device",
+        args.model_device,
+        "--jax_param_path",
+        args.jax_param_path,
+        "--output_dir",
+        args.output_dir,
+        "--use_precomputed_alignments",
+        args.use_precomputed_alignments,
+        "--max_template_date",
+        args.max_template_date,
+        "--kalign_binary_path",
+        args.kalign_binary_path,
+        "--config_preset",
+        args.config_preset,
+    ]
+    if args.obsolete_pdbs_path is not None:
+        script_args.append("--obsolete_pdbs_path")
+        script_args.append(args.obsolete_pdbs_path)
+    if args.release_dates_path is not None:
+        script_args.append("--release_dates_path")
+        script_args.append(args.release_dates_path)
+    if args.data_random_seed is not None:
+        script_args.append("--data_random_seed")
+        script_args.append(args.data_random_seed)
+    if args.feature_cache_dir is not None:
+        script_args.append("--feature_cache_dir")
+        script_args.append(args.feature_cache_dir)
+    if args.feature_cache_size is not None:
+        script_args.append("--feature_cache_size")
+        script_args.append(str(args.feature_cache_size))
+    if args.template_cache_size is not None:
+        script_args.append("--template_cache_size")
+        script_args.append(str(args.template_cache_size))
+    if args.template_cache_dir is not None:
+        script_args.append("--template_cache_dir")
+        script_args.append(args.template_cache_dir)
+    if args.flash_attention:
+        script_args.append("--flash_attention")
+    if args.chunk_plan_path is not None:
+        script_args.append("--chunk_plan_path")
+        script_args.append(args.chunk_plan_path)
+    if args.chunk_memory_budget is not None:
+        script_args.append("--chunk_memory_budget")
+        script_args.append(str(args.chunk_memory_budget))
+    if args.memory_budget is not None:
+        script_args.append("--memory_budget")
+        script_args.append(str(args.memory_budget))
+    if args.precision != "fp32":
+        script_args.append("--precision")
+        script_args.append(args.precision)
+    if args.offload_dir is not None:
+        script_args.append("--offload_dir")
+        script_args.append(args.offload_dir)
+    if args.stream_tile_size is not None:
+        script_args.append("--stream_tile_size")
+        script_args.append(str(args.stream_tile_size))
+
+    return script_args
+
+
 class OpenFoldInference:
     """Python wrapper of the OpenFold inference."""
 
@@ -66,32 +138,7 @@ class OpenFoldInference:
         cmd = [
             "python3",
             self.script_path,
-            fasta_dir,
-            template_mmcif_dir,
-            "--model_device",
-            args.model_device,
-            "--jax_param_path",
-            args.jax_param_path,
-            "--output_dir",
-            args.output_dir,
-            "--use_precomputed_alignments",
-            args.use_precomputed_alignments,
-            "--max_template_date",
-            args.max_template_date,
-            "--kalign_binary_path",
-            args.kalign_binary_path,
-            "--config_preset",
-            args.config_preset,
-        ]
-        if args.obsolete_pdbs_path is not None:
-            cmd.append("--obsolete_pdbs_path")
-            cmd.append(args.obsolete_pdbs_path)
-        if args.release_dates_path is not None:
-            cmd.append("--release_dates_path")
-            cmd.append(args.release_dates_path)
-        if args.data_random_seed is not None:
-            cmd.append("--data_random_seed")
-            cmd.append(args.data_random_seed)
+        ] + make_script_args(fasta_dir, template_mmcif_dir, args)
 
         logging.info('Launching subprocess "%s"', " ".join(cmd))
         process = subprocess.Popen(
@@ -124,3 +171,123 @@ class OpenFoldInference:
         ret['relaxation_time'] = float(re.findall('Relaxation time: *(.*)', stderr_dec)[0])
 
         return ret
+
+
+class OpenFoldResidentInference:
+    """In-process OpenFold inference with a resident model.
+
+    Unlike OpenFoldInference, the model, its parameters and the template
+    featurizer are set up only once, on the first query, and are reused for
+    all subsequent queries of the process.
+    """
+
+    def __init__(self):
+        """Initializes the resident OpenFold runner."""
+        # Imported lazily so that the subprocess-based runner does not pull in
+        # torch and the model code
+        import run_pretrained_openfold
+
+        self.script = run_pretrained_openfold
+        self.model = None
+
+    def _setup(self, script_args: object):
+        from openfold.config import model_config
+        from openfold.data import feature_pipeline
+
+        self.initial_cpu_affinity = os.sched_getaffinity(os.getpid())
+        os.makedirs(script_args.output_dir, exist_ok=True)
+
+        with utils.timing("OpenFold model setup"):
+            self.config = model_config(script_args.config_preset)
+            self.model = self.script.load_model(self.config, script_args)
+            self.data_processor = self.script.make_data_processor(
+                self.config, script_args
+            )
+            self.feature_processor = feature_pipeline.FeaturePipeline(
+                self.config.data
+            )
+
+        # run_model disables templates in place if a query has none
+        self.template_enabled = self.config.model.template.enabled
+
+        self.alignment_dir = self.script.get_alignment_dir(script_args)
+        self.prediction_dir = os.path.join(
+            script_args.output_dir, "predictions"
+        )
+        os.makedirs(self.prediction_dir, exist_ok=True)
+
+    def run(
+            self,
+            fasta_dir: str,
+            template_mmcif_dir: str,
+            args: object,
+            timeout: float=None):
+        """Run inference.
+
+        Args:
+          fasta_dir: Directory containing the FASTA file of the query
+          template_mmcif_dir: Directory containing the template mmCIFs
+          args: Arguments of the calling driver
+          timeout: Time limit in seconds for the query, excluding the model
+            setup
+
+        Returns:
+          A dict with the inference and relaxation times in seconds.
+
+        Raises:
+          TimeoutError: If the query does not finish within the timeout.
+        """
+        from openfold.utils.seed import seed_everything
+
+        logging.info("Run inference for {}".format(fasta_dir))
+
+        # Parse the same arguments as those passed to the subprocess so that
+        # both runners behave identically
+        script_args = self.script.get_parser().parse_args(
+            make_script_args(fasta_dir, template_mmcif_dir, args)
+        )
+
+        if self.model is None:
+            self._setup(script_args)
+
+        self.model.config.template.enabled = self.template_enabled
+
+        random_seed = script_args.data_random_seed
+        if random_seed is None:
+            random_seed = random.randrange(sys.maxsize)
+        seed_everything(random_seed)
+
+        def timeout_handler(signum, frame):
+            raise TimeoutError(
+                f"OpenFold inference timed out after {timeout} seconds"
+            )
+
+        if timeout is not None:
+            prev_handler = signal.signal(signal.SIGALRM, timeout_handler)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+
+        ret = None
+        try:
+            with utils.timing("OpenFold inference query"):
+                for fasta_file in os.listdir(fasta_dir):
+                    ret = self.script.predict_fasta(
+                        os.path.join(fasta_dir, fasta_file),
+                        self.model,
+                        self.config,
+                        self.data_processor,
+                        self.feature_processor,
+                        self.alignment_dir,
+                        self.prediction_dir,
+                        self.initial_cpu_affinity,
+                        script_args,
+                    )
+        finally:
+            if timeout is not None:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, prev_handler)
+            gc.collect()
+
+        if ret is None:
+            ret = {'inference_time': 0., 'relaxation_time': 0.}
+
+        return ret
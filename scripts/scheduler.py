@@ -0,0 +1,159 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Work distribution of sequences among MPI ranks."""
+import fcntl
+import heapq
+import logging
+import os
+import re
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+
+# a*L^2 + b*L + c [s], the same model as inference/estimate_time.awk
+INFERENCE_TIME_COEFFS = (0.0023, 0.4875, 35.636)
+
+# Job IDs of the batch systems, in order of precedence. A sub-job of a
+# Fugaku bulk job has its own PJM_SUBJOBID but shares PJM_JOBID.
+JOB_ID_VARS = ("PJM_SUBJOBID", "PJM_JOBID", "PBS_JOBID", "SLURM_JOB_ID", "JOB_ID")
+
+
+def estimate_inference_time(
+        seq_len: int,
+        coeffs: Sequence[float] = INFERENCE_TIME_COEFFS) -> float:
+    """Returns the estimated inference time in seconds of a sequence."""
+    a, b, c = coeffs
+    return a * seq_len * seq_len + b * seq_len + c
+
+
+def partition_lpt(
+        costs: Sequence[float],
+        n_parts: int) -> Tuple[List[List[int]], List[float]]:
+    """
+    Partitions items among workers with the longest-processing-time-first rule.
+
+    Items are assigned in descending order of cost, each to the worker with
+    the smallest accumulated cost so far. Ties are broken by index, so every
+    rank computes the same partition from the same costs.
+
+    Args:
+        costs:
+            A list of estimated costs of the items
+        n_parts:
+            The number of workers
+    Returns:
+        A tuple of (a list of item indices for each worker in processing
+        order, a list of the estimated total cost of each worker)
+    """
+    assert n_parts > 0
+
+    order = sorted(range(len(costs)), key=lambda i: (-costs[i], i))
+    heap = [(0., p) for p in range(n_parts)]
+    parts = [[] for _ in range(n_parts)]
+    loads = [0.] * n_parts
+    for i in order:
+        load, p = heapq.heappop(heap)
+        parts[p].append(i)
+        loads[p] = load + costs[i]
+        heapq.heappush(heap, (loads[p], p))
+
+    return parts, loads
+
+
+def get_job_id() -> Optional[str]:
+    """Returns the ID of the batch job, or None outside of a batch job."""
+    for var in JOB_ID_VARS:
+        job_id = os.environ.get(var)
+        if job_id:
+            return re.sub(r"[^\w.-]", "_", job_id)
+
+    return None
+
+
+def default_work_queue_path(output_dir: str) -> str:
+    """
+    Returns the queue file of the current job in output_dir, so that a
+    restarted job starts from a new queue.
+    """
+    job_id = get_job_id()
+    if job_id is None:
+        raise ValueError(
+            "The job ID was not found in any of "
+            f"{', '.join(JOB_ID_VARS)}. Set a queue file unique to the job"
+        )
+
+    return os.path.join(output_dir, f"work_queue.{job_id}")
+
+
+class SharedWorkQueue:
+    """
+    A work queue shared among ranks through a counter file.
+
+    The file holds the index of the next item to be processed and is updated
+    under an exclusive POSIX lock, so that idle ranks pull the next item as
+    soon as they finish the previous one. The file must be on a filesystem
+    visible to all ranks.
+
+    The file also records the number of items and the job ID. A file left
+    over from another job, or written for another list of items, raises a
+    RuntimeError instead of silently handing out nothing.
+    """
+
+    def __init__(self, path: str, n_items: int, job_id: Optional[str] = None):
+        self.path = path
+        self.n_items = n_items
+        self.job_id = job_id if job_id is not None else get_job_id()
+
+    def _check(self, fields: List[str]):
+        n_items, job_id = int(fields[1]), fields[2]
+        if job_id != str(self.job_id):
+            raise RuntimeError(
+                f"{self.path} was written by job {job_id}, not by this job "
+                f"({self.job_id}). Remove it or use another queue file"
+            )
+        if n_items != self.n_items:
+            raise RuntimeError(
+                f"{self.path} was written for {n_items} items, not "
+                f"{self.n_items}. Remove it or use another queue file"
+            )
+
+    def _pop(self) -> int:
+        with open(self.path, "a+") as f:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                fields = f.read().split()
+                if fields:
+                    self._check(fields)
+                    i = int(fields[0])
+                else:
+                    i = 0
+                f.seek(0)
+                f.truncate()
+                f.write(f"{i + 1} {self.n_items} {self.job_id}")
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+
+        return i
+
+    def __iter__(self) -> Iterator[int]:
+        while True:
+            i = self._pop()
+            if i >= self.n_items:
+                return
+
+            logging.info(f"Took item {i}/{self.n_items} from {self.path}")
+            yield i
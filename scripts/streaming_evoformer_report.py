@@ -0,0 +1,156 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reports the throughput of the Evoformer stack with --stream_tile_size
+against the in-memory path. The same random MSA and pair embeddings of each
+length are run through both, and the wall times and the difference of the
+resulting pair embeddings are reported.
+"""
+import argparse
+import json
+import logging
+import time
+
+import sys
+sys.path.append(".") # an innocent hack to get this to run from the top level
+
+import torch
+
+from openfold.config import model_config
+from openfold.model.model import AlphaFold
+from openfold.utils.import_weights import import_jax_weights_
+from openfold.utils.offload_store import mapped_copy
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+def run_evoformer(evoformer, m, z, args, stream_tile_size=None):
+    n_seq, n_res = m.shape[-3:-1]
+    msa_mask = m.new_ones((n_seq, n_res))
+    pair_mask = z.new_ones((n_res, n_res))
+
+    with torch.no_grad():
+        start = time.perf_counter()
+        _, z, _ = evoformer(
+            m,
+            z,
+            msa_mask=msa_mask,
+            pair_mask=pair_mask,
+            chunk_size=args.chunk_size,
+            inplace_safe=True,
+            _stream_tile_size=stream_tile_size,
+            _stream_dir=args.stream_dir,
+        )
+        elapsed = time.perf_counter() - start
+
+    return z, elapsed
+
+
+def main(args):
+    config = model_config(args.config_preset)
+    config.model.evoformer_stack.tune_chunk_size = False
+
+    model = AlphaFold(config).eval()
+    import_jax_weights_(
+        model, args.jax_param_path, version=args.config_preset
+    )
+    evoformer = model.evoformer
+    if(args.no_blocks is not None):
+        evoformer.blocks = evoformer.blocks[:args.no_blocks]
+
+    c_m = config.model.evoformer_stack.c_m
+    c_z = config.model.evoformer_stack.c_z
+
+    torch.manual_seed(args.seed)
+    reports = {}
+    for n_res in args.n_res:
+        m = torch.randn((args.n_seq, n_res, c_m))
+        z = torch.randn((n_res, n_res, c_z))
+
+        z_ref, ref_time = run_evoformer(evoformer, m.clone(), z.clone(), args)
+        z_stream, stream_time = run_evoformer(
+            evoformer,
+            m.clone(),
+            mapped_copy(z, dir=args.stream_dir),
+            args,
+            stream_tile_size=args.tile_size,
+        )
+
+        report = {
+            "pair_embedding_gib": z.numel() * z.element_size() / 1024**3,
+            "in_memory_time": ref_time,
+            "streamed_time": stream_time,
+            "slowdown": stream_time / ref_time,
+            "max_abs_diff": float(torch.max(torch.abs(z_stream - z_ref))),
+        }
+        reports[n_res] = report
+        logging.info(
+            f"N_res={n_res}: " +
+            ", ".join(f"{k}={v:.4f}" for k, v in report.items())
+        )
+
+    if(args.output_path is not None):
+        with open(args.output_path, "w") as fp:
+            json.dump(reports, fp, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--n_res", type=int, nargs="+", default=[256, 512, 768],
+        help="Sequence lengths to compare at"
+    )
+    parser.add_argument(
+        "--n_seq", type=int, default=128,
+        help="Number of MSA sequences"
+    )
+    parser.add_argument(
+        "--tile_size", type=int, default=64,
+        help="Rows of the pair embedding per tile when streaming"
+    )
+    parser.add_argument(
+        "--stream_dir", type=str, default=None,
+        help="""Directory of the memory-mapped files. Defaults to the
+             temporary directory"""
+    )
+    parser.add_argument(
+        "--chunk_size", type=int, default=None,
+        help="Chunk size of both paths"
+    )
+    parser.add_argument(
+        "--no_blocks", type=int, default=None,
+        help="Number of Evoformer blocks to run. Defaults to all"
+    )
+    parser.add_argument(
+        "--jax_param_path", type=str,
+        default="openfold/resources/params/params_model_1.npz",
+        help="Path to JAX model parameters"
+    )
+    parser.add_argument(
+        "--config_preset", type=str, default="model_1",
+        help="Name of a model config preset defined in openfold/config.py"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=42,
+    )
+    parser.add_argument(
+        "--output_path", type=str, default=None,
+        help="Path to write the report as JSON"
+    )
+
+    args = parser.parse_args()
+
+    main(args)
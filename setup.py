@@ -17,7 +17,9 @@ import os
 from setuptools import setup, Extension, find_packages
 import subprocess
 
-from torch.utils.cpp_extension import BuildExtension, CUDAExtension, CUDA_HOME
+from torch.utils.cpp_extension import (
+    BuildExtension, CppExtension, CUDAExtension, CUDA_HOME
+)
 
 
 version_dependent_macros = [
@@ -35,6 +37,10 @@ extra_cuda_flags = [
     '--expt-extended-lambda'
 ]
 
+extra_cpu_flags = [
+    '-fopenmp',
+]
+
 def get_cuda_bare_metal_version(cuda_dir):
     raw_output = subprocess.check_output([cuda_dir + "/bin/nvcc", "-V"], universal_newlines=True)
     output = raw_output.split()
@@ -68,6 +74,22 @@ setup(
         "openfold": ['utils/kernel/csrc/*'],
         "": ["resources/stereo_chemical_props.txt"]
     },
+    ext_modules=[CppExtension(
+        name="attn_core_inplace_cpu",
+        sources=[
+            "openfold/utils/kernel/csrc/softmax_cpu.cpp",
+        ],
+        include_dirs=[
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), 
+                'openfold/utils/kernel/csrc/'
+            )
+        ],
+        extra_compile_args={
+            'cxx': ['-O3'] + version_dependent_macros + extra_cpu_flags,
+        },
+        extra_link_args=extra_cpu_flags,
+    )],
     # ext_modules=[CUDAExtension(
     #     name="attn_core_inplace_cuda",
     #     sources=[
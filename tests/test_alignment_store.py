@@ -0,0 +1,113 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from openfold.data.alignment_store import (
+    AlignmentStore,
+    build_alignment_store,
+    finalize_alignment_store,
+    is_alignment_store,
+    write_alignment_shard,
+)
+from openfold.data.data_pipeline import DataPipeline
+from openfold.data.feature_cache import hash_alignment_dir
+
+
+ALIGNMENT_DIR = os.path.join(
+    os.path.dirname(__file__), "test_data", "alignments"
+)
+
+NAMES = ["1abc_B", "1abc_A", "2xyz_A"]
+
+
+class TestAlignmentStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.alignment_dir = os.path.join(self.tmp_dir, "alignments")
+        for name in NAMES:
+            shutil.copytree(
+                ALIGNMENT_DIR, os.path.join(self.alignment_dir, name)
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _assert_same(self, store, name):
+        pipeline = DataPipeline(template_featurizer=None)
+        store_pipeline = DataPipeline(
+            template_featurizer=None, alignment_store=store
+        )
+        alignment_dir = os.path.join(self.alignment_dir, name)
+        store_dir = os.path.join(store.store_dir, name)
+
+        msa_data_gt = pipeline._parse_msa_data(alignment_dir)
+        msa_data = store_pipeline._parse_msa_data(store_dir)
+        self.assertEqual(msa_data.keys(), msa_data_gt.keys())
+        for f, data_gt in msa_data_gt.items():
+            for k, v in data_gt.items():
+                self.assertEqual(msa_data[f][k].dtype, v.dtype)
+                self.assertTrue(np.array_equal(msa_data[f][k], v))
+
+        self.assertEqual(
+            store_pipeline._parse_template_hits(store_dir),
+            pipeline._parse_template_hits(alignment_dir),
+        )
+
+    def test_build(self):
+        store_dir = os.path.join(self.tmp_dir, "store")
+        build_alignment_store(self.alignment_dir, store_dir, num_workers=2)
+
+        self.assertTrue(is_alignment_store(store_dir))
+        store = AlignmentStore(store_dir)
+        self.assertEqual(store.chain_ids(), sorted(NAMES))
+        self.assertNotIn("1abc_C", store)
+        for name in NAMES:
+            self._assert_same(store, name)
+
+        # Reopened by DataLoader workers
+        self._assert_same(pickle.loads(pickle.dumps(store)), NAMES[0])
+
+        # Chains of the store are hashed by their records
+        self.assertNotEqual(
+            hash_alignment_dir(os.path.join(store_dir, NAMES[0])),
+            hash_alignment_dir(os.path.join(store_dir, "1abc_C")),
+        )
+
+    def test_shards(self):
+        store_dir = os.path.join(self.tmp_dir, "store")
+        for shard in range(2):
+            write_alignment_shard(
+                self.alignment_dir, NAMES[shard::2], store_dir, shard
+            )
+
+        self.assertFalse(is_alignment_store(store_dir))
+        with self.assertRaises(ValueError):
+            finalize_alignment_store(store_dir, 3)
+
+        finalize_alignment_store(store_dir, 2)
+        store = AlignmentStore(store_dir)
+        self.assertEqual(store.chain_ids(), sorted(NAMES))
+        for name in NAMES:
+            self._assert_same(store, name)
+
+
+if __name__ == "__main__":
+    unittest.main()
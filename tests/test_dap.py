@@ -0,0 +1,189 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from openfold.model.evoformer import EvoformerStack, ExtraMSAStack
+from openfold.model.template import TemplatePairStack
+from openfold.utils import dap
+from tests.config import consts
+
+
+WORLD_SIZE = 2
+
+
+def _make_modules():
+    torch.manual_seed(0)
+    evoformer = EvoformerStack(
+        consts.c_m,
+        consts.c_z,
+        c_hidden_msa_att=12,
+        c_hidden_opm=17,
+        c_hidden_mul=19,
+        c_hidden_pair_att=14,
+        c_s=consts.c_s,
+        no_heads_msa=3,
+        no_heads_pair=7,
+        no_blocks=2,
+        transition_n=2,
+        msa_dropout=0.15,
+        pair_dropout=0.25,
+        blocks_per_ckpt=None,
+        inf=1e9,
+        eps=1e-10,
+        save_activation_to_file=False,
+        activation_tmp_dir=None,
+    )
+    extra_msa = ExtraMSAStack(
+        consts.c_e,
+        consts.c_z,
+        c_hidden_msa_att=8,
+        c_hidden_opm=9,
+        c_hidden_mul=10,
+        c_hidden_pair_att=11,
+        no_heads_msa=4,
+        no_heads_pair=5,
+        no_blocks=2,
+        transition_n=2,
+        msa_dropout=0.15,
+        pair_dropout=0.25,
+        ckpt=False,
+        inf=1e9,
+        eps=1e-10,
+    )
+    template = TemplatePairStack(
+        consts.c_t,
+        c_hidden_tri_att=7,
+        c_hidden_tri_mul=7,
+        no_blocks=2,
+        no_heads=4,
+        pair_transition_n=2,
+        dropout_rate=0.25,
+        blocks_per_ckpt=None,
+        inf=1e7,
+    )
+
+    modules = [evoformer, extra_msa, template]
+    with torch.no_grad():
+        for module in modules:
+            module.eval().double()
+            for p in module.parameters():
+                p.normal_(std=0.1)
+
+    return modules
+
+
+def _make_inputs():
+    torch.manual_seed(1)
+    batch_size = consts.batch_size
+    n_seq = consts.n_seq
+    n_res = consts.n_res
+
+    rand_mask = lambda *shape: torch.randint(0, 2, shape).double()
+    return {
+        "m": torch.rand((batch_size, n_seq, n_res, consts.c_m)).double(),
+        "a": torch.rand(
+            (batch_size, consts.n_extra, n_res, consts.c_e)
+        ).double(),
+        "z": torch.rand((batch_size, n_res, n_res, consts.c_z)).double(),
+        "t": torch.rand(
+            (batch_size, consts.n_templ, n_res, n_res, consts.c_t)
+        ).double(),
+        "msa_mask": rand_mask(batch_size, n_seq, n_res),
+        "extra_msa_mask": rand_mask(batch_size, consts.n_extra, n_res),
+        "pair_mask": rand_mask(batch_size, n_res, n_res),
+        "template_mask": rand_mask(batch_size, consts.n_templ, n_res, n_res),
+    }
+
+
+def _run(modules, inputs, use_dap):
+    evoformer, extra_msa, template = modules
+    with torch.no_grad():
+        m, z, s = evoformer(
+            inputs["m"].clone(),
+            inputs["z"].clone(),
+            inputs["msa_mask"],
+            inputs["pair_mask"],
+            chunk_size=4,
+            inplace_safe=True,
+            _dap=use_dap,
+        )
+        z_extra = extra_msa(
+            inputs["a"].clone(),
+            inputs["z"].clone(),
+            msa_mask=inputs["extra_msa_mask"],
+            pair_mask=inputs["pair_mask"],
+            chunk_size=4,
+            inplace_safe=True,
+            _dap=use_dap,
+        )
+        t = template(
+            inputs["t"].clone(),
+            inputs["template_mask"],
+            chunk_size=4,
+            inplace_safe=True,
+            _dap=use_dap,
+        )
+
+    return {"m": m, "z": z, "s": s, "z_extra": z_extra, "t": t}
+
+
+def _dap_worker(rank, init_method, output_dir):
+    os.environ["RANK"] = str(rank)
+    os.environ["WORLD_SIZE"] = str(WORLD_SIZE)
+    torch.set_num_threads(1)
+    dap.init_dap("gloo", init_method)
+
+    out = _run(_make_modules(), _make_inputs(), use_dap=True)
+    torch.save(out, os.path.join(output_dir, f"{rank}.pt"))
+
+    dist.destroy_process_group()
+
+
+class TestDAP(unittest.TestCase):
+    def test_matches_single_process(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            init_method = "file://" + os.path.join(tmp_dir, "rendezvous")
+            mp.spawn(
+                _dap_worker,
+                args=(init_method, tmp_dir),
+                nprocs=WORLD_SIZE,
+            )
+            outs = [
+                torch.load(os.path.join(tmp_dir, f"{rank}.pt"))
+                for rank in range(WORLD_SIZE)
+            ]
+
+        # The DAP functions are no-ops outside of a process group
+        out_gt = _run(_make_modules(), _make_inputs(), use_dap=False)
+        for out in outs:
+            for k, v in out_gt.items():
+                self.assertEqual(out[k].shape, v.shape)
+                self.assertTrue(torch.allclose(out[k], v), k)
+
+    def test_no_process_group(self):
+        t = torch.rand((3, 5))
+        padded = dap.pad(t, [-2, -1])
+        self.assertTrue(torch.equal(padded, t))
+        self.assertTrue(torch.equal(dap.gather(dap.shard(t, -1), -1), t))
+
+
+if __name__ == "__main__":
+    unittest.main()
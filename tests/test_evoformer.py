@@ -20,6 +20,7 @@ from openfold.model.evoformer import (
     EvoformerStack,
     ExtraMSAStack,
 )
+from openfold.utils.offload_store import mapped_copy
 from openfold.utils.tensor_utils import tree_map
 import tests.compare_utils as compare_utils
 from tests.config import consts
@@ -86,6 +87,64 @@ class TestEvoformerStack(unittest.TestCase):
         self.assertTrue(z.shape == shape_z_before)
         self.assertTrue(s.shape == (batch_size, n_res, c_s))
 
+    def test_streamed(self):
+        n_seq = consts.n_seq
+        n_res = consts.n_res
+        c_m = consts.c_m
+        c_z = consts.c_z
+
+        es = EvoformerStack(
+            c_m,
+            c_z,
+            c_hidden_msa_att=12,
+            c_hidden_opm=17,
+            c_hidden_mul=19,
+            c_hidden_pair_att=14,
+            c_s=consts.c_s,
+            no_heads_msa=3,
+            no_heads_pair=7,
+            no_blocks=2,
+            transition_n=2,
+            msa_dropout=0.15,
+            pair_dropout=0.25,
+            blocks_per_ckpt=None,
+            inf=1e9,
+            eps=1e-10,
+            save_activation_to_file=False,
+            activation_tmp_dir=None,
+        ).eval().double()
+        with torch.no_grad():
+            for p in es.parameters():
+                p.normal_(std=0.1)
+
+        m = torch.rand((consts.batch_size, n_seq, n_res, c_m)).double()
+        z = torch.rand((consts.batch_size, n_res, n_res, c_z)).double()
+        msa_mask = torch.randint(
+            0, 2, size=(consts.batch_size, n_seq, n_res)
+        ).double()
+        pair_mask = torch.randint(
+            0, 2, size=(consts.batch_size, n_res, n_res)
+        ).double()
+
+        with torch.no_grad():
+            m_gt, z_gt, s_gt = es(
+                m.clone(), z.clone(), msa_mask, pair_mask, 
+                chunk_size=None, inplace_safe=True,
+            )
+            for tile_size in [1, 3, n_res]:
+                m_out, z_out, s_out = es(
+                    m.clone(), 
+                    mapped_copy(z), 
+                    msa_mask, 
+                    pair_mask, 
+                    chunk_size=4,
+                    inplace_safe=True, 
+                    _stream_tile_size=tile_size,
+                )
+                self.assertTrue(torch.allclose(m_out, m_gt))
+                self.assertTrue(torch.allclose(z_out, z_gt))
+                self.assertTrue(torch.allclose(s_out, s_gt))
+
     @compare_utils.skip_unless_alphafold_installed()
     def test_compare(self):
         def run_ei(activations, masks):
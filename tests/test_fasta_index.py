@@ -0,0 +1,99 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from openfold.data.fasta_index import FastaIndex, build_fasta_index
+from openfold.data.parsers import parse_fasta
+
+
+FASTA = """>4X96_D
+MKVLAA
+GHW
+>1ABC_A desc
+MKV
+
+>2DEF_B
+MKVLAAGHW
+>1ABC_B
+MKV
+>3GHI_A
+MKVLA
+"""
+
+
+class TestFastaIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fasta_path = os.path.join(self.tmp_dir, "input.fasta")
+        with open(self.fasta_path, "w") as fp:
+            fp.write(FASTA)
+        self.index_dir = os.path.join(self.tmp_dir, "index")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_entries(self):
+        build_fasta_index(self.fasta_path, self.index_dir, (0., 1., 0.))
+        index = FastaIndex(self.index_dir)
+
+        seqs, names = parse_fasta(FASTA)
+        self.assertEqual(index.num_entries, len(seqs))
+        for i in range(index.num_entries):
+            self.assertEqual(index.name(i), names[i])
+            self.assertEqual(index.sequence(i), seqs[i])
+            self.assertEqual(index.entries[i]["seq_len"], len(seqs[i]))
+
+    def test_groups(self):
+        build_fasta_index(self.fasta_path, self.index_dir, (0., 1., 0.))
+        index = FastaIndex(self.index_dir)
+
+        groups = [index.group(g) for g in range(index.num_groups)]
+        self.assertEqual(groups, [
+            ("MKV", ["1ABC_A desc", "1ABC_B"]),
+            ("MKVLA", ["3GHI_A"]),
+            ("MKVLAAGHW", ["2DEF_B", "4X96_D"]),
+        ])
+        self.assertEqual(list(index.groups["cost"]), [3., 5., 9.])
+        for g in range(index.num_groups):
+            for i in index.group_members(g):
+                self.assertEqual(index.entries[i]["group"], g)
+
+    def test_duplicated_names(self):
+        with open(self.fasta_path, "a") as fp:
+            fp.write(">3GHI_A\nMK\n")
+
+        with self.assertRaises(ValueError):
+            build_fasta_index(self.fasta_path, self.index_dir, (0., 1., 0.))
+
+        build_fasta_index(
+            self.fasta_path, self.index_dir, (0., 1., 0.), unique_names=True
+        )
+        index = FastaIndex(self.index_dir)
+        self.assertEqual(index.name(index.num_entries - 1), "3GHI_A_0")
+
+    def test_modified_fasta(self):
+        build_fasta_index(self.fasta_path, self.index_dir, (0., 1., 0.))
+        with open(self.fasta_path, "a") as fp:
+            fp.write(">5JKL_A\nMK\n")
+
+        with self.assertRaises(ValueError):
+            FastaIndex(self.index_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import unittest
+
+from openfold.data.feature_cache import (
+    FeatureCache,
+    hash_alignment_dir,
+    make_key,
+)
+
+
+class TestFeatureCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        cache = FeatureCache(os.path.join(self.tmp_dir, "cache"))
+        value = {
+            "aatype": np.random.randint(0, 20, (37, 21)),
+            "domain_name": np.array([b"1abc"], dtype=np.object_),
+        }
+
+        self.assertIsNone(cache.get("key"))
+        cache.put("key", value)
+        cached = cache.get("key")
+        self.assertTrue(np.array_equal(cached["aatype"], value["aatype"]))
+        self.assertEqual(cached["domain_name"][0], b"1abc")
+
+    def test_evict_least_recently_used(self):
+        cache = FeatureCache(os.path.join(self.tmp_dir, "cache"))
+        for i in range(3):
+            cache.put(str(i), np.random.rand(1000))
+            # Make the modification times distinct
+            t = time.time() - 100 + i
+            os.utime(cache._path(str(i)), (t, t))
+
+        # "0" becomes the most recently used
+        cache.get("0")
+
+        size = os.path.getsize(cache._path("0"))
+        cache.evict(2 * size)
+        self.assertIsNotNone(cache.get("0"))
+        self.assertIsNone(cache.get("1"))
+        self.assertIsNotNone(cache.get("2"))
+
+    def test_put_evicts_past_max_bytes(self):
+        values = [np.random.rand(1000) for _ in range(3)]
+        cache = FeatureCache(os.path.join(self.tmp_dir, "cache"))
+        cache.put("size", values[0])
+        size = os.path.getsize(cache._path("size"))
+        os.remove(cache._path("size"))
+
+        cache = FeatureCache(
+            os.path.join(self.tmp_dir, "cache"), int(2.5 * size)
+        )
+        scans = []
+        scan = cache._scan
+        cache._scan = lambda: scans.append(None) or scan()
+
+        cache.put("0", values[0])
+        cache.put("1", values[1])
+        # The directory is only listed once below max_bytes
+        self.assertEqual(len(scans), 1)
+        # "1" is the least recently used
+        for i, key in enumerate(["1", "0"]):
+            t = time.time() - 100 + i
+            os.utime(cache._path(key), (t, t))
+
+        cache.put("2", values[2])
+        self.assertEqual(len(scans), 2)
+        self.assertIsNone(cache.get("1"))
+        self.assertIsNotNone(cache.get("0"))
+        self.assertIsNotNone(cache.get("2"))
+
+    def test_key_depends_on_alignments(self):
+        alignment_dir = os.path.join(self.tmp_dir, "alignments")
+        os.makedirs(alignment_dir)
+        with open(os.path.join(alignment_dir, "mgnify_hits.a3m"), "w") as fp:
+            fp.write(">query\nMKV\n")
+
+        h1 = hash_alignment_dir(alignment_dir)
+        self.assertEqual(h1, hash_alignment_dir(alignment_dir))
+
+        with open(os.path.join(alignment_dir, "mgnify_hits.a3m"), "a") as fp:
+            fp.write(">hit\nMKI\n")
+        h2 = hash_alignment_dir(alignment_dir)
+        self.assertNotEqual(h1, h2)
+
+        self.assertNotEqual(make_key("MKV", h1), make_key("MKV", h2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,11 +2,15 @@
 # -*- coding: utf-8 -*-
 # Copyright 2023 RIKEN & Fujitsu Limited
 
+import importlib
+import importlib.util
 import torch
 import unittest
 
 from openfold.model.primitives import _attention
+import openfold.utils.kernel.attention_core as attention_core_module
 from openfold.utils.kernel.attention_core import attention_core
+import openfold.utils.kernel.attention_core_cpu as attention_core_cpu
 from tests.config import consts
 
 
@@ -83,6 +87,138 @@ class TestAttentionCore(unittest.TestCase):
             ) 
 
 
+
+class TestFlashAttentionCore(unittest.TestCase):
+    def setUp(self):
+        self.flash = attention_core_module._flash
+        self.kv_chunk_size = attention_core_module.kv_chunk_size
+        attention_core_module._flash = True
+        # Several key blocks, the last one partial
+        attention_core_module.kv_chunk_size = 4
+
+    def tearDown(self):
+        attention_core_module._flash = self.flash
+        attention_core_module.kv_chunk_size = self.kv_chunk_size
+
+    def _get_inputs(self):
+        n_res = consts.n_res
+        h = consts.n_heads_extra_msa
+        n_seq = consts.n_extra
+        c = consts.c_e
+
+        q = torch.rand([n_seq, h, n_res, c], requires_grad=True)
+        k = torch.rand([n_seq, h, n_res, c], requires_grad=True)
+        v = torch.rand([n_seq, h, n_res, c], requires_grad=True)
+        mask = torch.randint(0, 2, [n_seq, n_res])
+        mask_bias = (1e9 * (mask - 1))[..., None, None, :]
+        pair_bias = torch.rand([1, h, n_res, n_res], requires_grad=True)
+
+        return q, k, v, mask_bias, pair_bias
+
+    def test_flash_attention_core_forward(self):
+        q, k, v, mask_bias, pair_bias = self._get_inputs()
+
+        with torch.no_grad():
+            out_repro = attention_core(q, k, v, mask_bias, pair_bias)
+            out_gt = _attention(q, k, v, [mask_bias, pair_bias])
+
+        self.assertTrue(torch.max(torch.abs(out_repro - out_gt)) < consts.eps)
+
+    def test_flash_attention_core_backward(self):
+        q, k, v, mask_bias, pair_bias = self._get_inputs()
+
+        def clone(t):
+            t = t.clone()
+            if(t.requires_grad):
+                t.retain_grad()
+            return t
+
+        inputs_repro = [clone(t) for t in (q, k, v, pair_bias)]
+        q_repro, k_repro, v_repro, b_repro = inputs_repro
+        out_repro = attention_core(q_repro, k_repro, v_repro, mask_bias, b_repro)
+        torch.mean(out_repro).backward()
+
+        inputs_gt = [clone(t) for t in (q, k, v, pair_bias)]
+        q_gt, k_gt, v_gt, b_gt = inputs_gt
+        out_gt = _attention(q_gt, k_gt, v_gt, [mask_bias, b_gt])
+        torch.mean(out_gt).backward()
+
+        # Including the pair bias, broadcast over the sequences
+        self.assertIsNotNone(b_repro.grad)
+        self.assertEqual(b_repro.grad.shape, pair_bias.shape)
+        for t_repro, t_gt in zip(inputs_repro, inputs_gt):
+            self.assertTrue(
+                torch.max(torch.abs(t_repro.grad - t_gt.grad)) < consts.eps
+            )
+
+
+
+@unittest.skipIf(
+    importlib.util.find_spec("attn_core_inplace_cpu") is None,
+    "attn_core_inplace_cpu is not built"
+)
+class TestSoftmaxCpu(unittest.TestCase):
+    def setUp(self):
+        self.kernel = importlib.import_module("attn_core_inplace_cpu")
+
+    def _get_inputs(self, dtype):
+        n_res = consts.n_res
+        h = consts.n_heads_extra_msa
+        n_seq = consts.n_extra
+        c = consts.c_e
+
+        logits = torch.rand([n_seq, h, n_res, n_res]).to(dtype)
+        grad_output = torch.rand([n_seq, h, n_res, c]).to(dtype)
+        v = torch.rand([n_seq, h, n_res, c]).to(dtype)
+
+        return logits, grad_output, v
+
+    def test_softmax_forward(self):
+        for dtype, eps in [(torch.float32, consts.eps), (torch.bfloat16, 1e-2)]:
+            logits, _, _ = self._get_inputs(dtype)
+            rows, cols = logits.numel() // logits.shape[-1], logits.shape[-1]
+
+            out_repro = logits.clone()
+            self.kernel.forward_(out_repro, rows, cols)
+            out_gt = logits.clone()
+            attention_core_cpu.forward_(out_gt, rows, cols)
+
+            err = torch.max(torch.abs(out_repro.float() - out_gt.float()))
+            self.assertTrue(err < eps)
+
+    def test_softmax_backward(self):
+        for dtype, eps in [(torch.float32, consts.eps), (torch.bfloat16, 5e-2)]:
+            logits, grad_output, v = self._get_inputs(dtype)
+            attention_core_cpu.forward_(
+                logits, logits.numel() // logits.shape[-1], logits.shape[-1]
+            )
+            args = (
+                logits.numel() // logits.shape[-1],
+                logits.shape[-1],
+                grad_output.shape[-1],
+            )
+
+            out_repro = logits.clone()
+            self.kernel.backward_(out_repro, grad_output, v, *args)
+            out_gt = logits.clone()
+            attention_core_cpu.backward_(out_gt, grad_output, v, *args)
+
+            err = torch.max(torch.abs(out_repro.float() - out_gt.float()))
+            self.assertTrue(err < eps)
+
+    def test_softmax_non_contiguous(self):
+        logits, _, _ = self._get_inputs(torch.float32)
+        logits = logits.transpose(0, 1)
+        rows, cols = logits.numel() // logits.shape[-1], logits.shape[-1]
+
+        out = logits.clone()
+        self.assertFalse(out.is_contiguous())
+        self.kernel.forward_(out, rows, cols)
+
+        err = torch.max(torch.abs(out - torch.softmax(logits, dim=-1)))
+        self.assertTrue(err < consts.eps)
+
+
 if __name__ == '__main__':
     unittest.main()
 
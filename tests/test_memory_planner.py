@@ -0,0 +1,114 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import ml_collections as mlc
+
+from openfold.config import model_config
+from openfold.utils.memory_planner import (
+    applied_inference_plan,
+    estimate_stage_memory,
+    plan_inference,
+)
+
+
+class TestMemoryPlanner(unittest.TestCase):
+    def setUp(self):
+        self.config = model_config("model_1").model
+        self.sizes = {
+            "n_res": 1000,
+            "n_msa": 508,
+            "n_extra": 5120,
+            "n_templ": 4,
+        }
+
+    def test_estimate_stage_memory(self):
+        small = estimate_stage_memory(self.config, chunk_size=4, **self.sizes)
+        no_chunk = estimate_stage_memory(
+            self.config, chunk_size=None, **self.sizes
+        )
+        for stage in ["template_stack", "extra_msa_stack", "evoformer"]:
+            self.assertLess(small[stage], no_chunk[stage])
+
+        # LMA only pays off beyond its chunk sizes
+        sizes = {**self.sizes, "n_res": 5000}
+        no_lma = estimate_stage_memory(self.config, chunk_size=None, **sizes)
+        lma = estimate_stage_memory(
+            self.config, chunk_size=None, use_lma=True, **sizes
+        )
+        self.assertLess(lma["evoformer"], no_lma["evoformer"])
+
+        self.config.template.enabled = False
+        self.assertNotIn(
+            "template_stack",
+            estimate_stage_memory(self.config, chunk_size=4, **self.sizes),
+        )
+
+    def test_plan_inference(self):
+        plan = plan_inference(self.config, memory_budget=1024, **self.sizes)
+        self.assertIsNone(plan.chunk_size)
+        self.assertFalse(plan.use_lma)
+
+        plan = plan_inference(self.config, memory_budget=16, **self.sizes)
+        self.assertIsNotNone(plan.chunk_size)
+        self.assertLessEqual(plan.peak_memory, 16 * 1024**3)
+        # Nothing to offload to on the CPU
+        self.assertFalse(plan.offload_inference)
+        self.assertFalse(plan.offload_templates)
+
+        # Larger budgets never make it slower
+        larger = plan_inference(self.config, memory_budget=32, **self.sizes)
+        self.assertGreaterEqual(larger.chunk_size or 2**31, plan.chunk_size)
+
+    def test_plan_inference_fixed(self):
+        plan = plan_inference(
+            self.config, memory_budget=1024, offload=True,
+            fixed={"offload_inference": True}, **self.sizes
+        )
+        self.assertTrue(plan.offload_inference)
+        self.assertIsNone(plan.chunk_size)
+
+    def test_applied_inference_plan(self):
+        model = mlc.ConfigDict({
+            "globals": {
+                "chunk_size": 4, "use_lma": False, "offload_inference": True
+            },
+            "config": {
+                "template": {
+                    "offload_templates": False, "average_templates": False
+                }
+            },
+        })
+        saved = model.to_dict()
+        plan = plan_inference(self.config, memory_budget=0.01, **self.sizes)
+        with self.assertRaises(RuntimeError):
+            with applied_inference_plan(model, plan):
+                self.assertEqual(model.globals.chunk_size, plan.chunk_size)
+                raise RuntimeError()
+
+        self.assertEqual(model.to_dict(), saved)
+
+    def test_plan_inference_over_budget(self):
+        plan = plan_inference(self.config, memory_budget=0.01, **self.sizes)
+        self.assertGreater(plan.peak_memory, 0.01 * 1024**3)
+        frugal = estimate_stage_memory(
+            self.config, chunk_size=1, use_lma=True, average_templates=True,
+            **self.sizes
+        )
+        self.assertLessEqual(plan.peak_memory, max(frugal.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -36,19 +36,12 @@ if compare_utils.alphafold_is_installed():
 
 
 class TestModel(unittest.TestCase):
-    def test_dry_run(self):
+    def _random_batch(self, c):
         n_seq = consts.n_seq
         n_templ = consts.n_templ
         n_res = consts.n_res
         n_extra_seq = consts.n_extra
 
-        c = model_config("model_1")
-        c.model.evoformer_stack.no_blocks = 4  # no need to go overboard here
-        c.model.evoformer_stack.blocks_per_ckpt = None  # don't want to set up
-        # deepspeed for this test
-
-        model = AlphaFold(c)
-
         batch = {}
         tf = torch.randint(c.model.input_embedder.tf_dim - 1, size=(n_res,))
         batch["target_feat"] = nn.functional.one_hot(
@@ -71,11 +64,37 @@ class TestModel(unittest.TestCase):
         add_recycling_dims = lambda t: (
             t.unsqueeze(-1).expand(*t.shape, c.data.common.max_recycling_iters)
         )
-        batch = tensor_tree_map(add_recycling_dims, batch)
+        return tensor_tree_map(add_recycling_dims, batch)
+
+    def _dry_run_config(self):
+        c = model_config("model_1")
+        c.model.evoformer_stack.no_blocks = 4  # no need to go overboard here
+        c.model.evoformer_stack.blocks_per_ckpt = None  # don't want to set up
+        # deepspeed for this test
+
+        return c
+
+    def test_dry_run(self):
+        c = self._dry_run_config()
+        model = AlphaFold(c)
+        batch = self._random_batch(c)
 
         with torch.no_grad():
             out = model(batch)
 
+    def test_dry_run_bf16(self):
+        c = self._dry_run_config()
+        model = AlphaFold(c).to(torch.bfloat16)
+        batch = self._random_batch(c)
+
+        with torch.no_grad():
+            out = model(batch)
+
+        # The structure module and the confidence metrics stay in float32
+        for k in ["final_atom_positions", "plddt"]:
+            self.assertEqual(out[k].dtype, torch.float32)
+            self.assertTrue(torch.all(torch.isfinite(out[k])))
+
     @compare_utils.skip_unless_alphafold_installed()
     def test_compare(self):
         def run_alphafold(batch):
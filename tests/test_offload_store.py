@@ -0,0 +1,89 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import torch
+
+from openfold.utils.offload_store import OffloadStore, save_on_store
+
+
+class TestOffloadStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = OffloadStore(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        tensors = [
+            torch.rand((3, 5, 7)),
+            torch.rand((4, 4)).bfloat16(),
+            torch.randint(0, 10, (6,)),
+            torch.rand((0, 3)),
+        ]
+        spilled = [self.store.offload(t) for t in tensors]
+        self.store.prefetch(spilled[1])
+        for t, s in zip(tensors, spilled):
+            out = self.store.load(s)
+            self.assertEqual(out.dtype, t.dtype)
+            self.assertTrue(torch.equal(out, t))
+
+        # Files are removed once read back
+        self.assertEqual(os.listdir(self.store.dir), [])
+
+        stats = self.store.end_block("block 0")
+        nbytes = sum(t.numel() * t.element_size() for t in tensors)
+        self.assertEqual(stats.bytes_written, nbytes)
+        self.assertEqual(stats.bytes_read, nbytes)
+
+        stats = self.store.end_block("block 1")
+        self.assertEqual(stats.bytes_written, 0)
+        self.assertEqual(len(self.store.block_stats), 2)
+
+    def test_save_on_store(self):
+        x = torch.rand((5, 5), requires_grad=True)
+
+        y_gt = torch.sin(torch.exp(x) @ x).sum()
+        grad_gt, = torch.autograd.grad(y_gt, x)
+
+        with save_on_store(self.store):
+            y = torch.sin(torch.exp(x) @ x).sum()
+        self.assertGreater(self.store.bytes_written, 0)
+
+        grad, = torch.autograd.grad(y, x)
+        self.assertTrue(torch.equal(grad, grad_gt))
+        self.assertEqual(self.store.bytes_read, self.store.bytes_written)
+
+    def test_close(self):
+        store = OffloadStore(self.tmp_dir.name)
+        store.offload(torch.rand((3, 3)))
+        store.close()
+        self.assertFalse(os.path.exists(store.dir))
+        # Closing again is a no-op
+        store.close()
+
+        # Stores dropped without being closed are removed as well
+        store = OffloadStore(self.tmp_dir.name)
+        store_dir = store.dir
+        del store
+        self.assertFalse(os.path.exists(store_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
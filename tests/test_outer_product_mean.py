@@ -45,6 +45,30 @@ class TestOuterProductMean(unittest.TestCase):
             (consts.batch_size, consts.n_res, consts.n_res, consts.c_z)
         )
 
+    def test_inference(self):
+        c = 7
+
+        opm = OuterProductMean(consts.c_m, consts.c_z, c).double()
+        with torch.no_grad():
+            opm.linear_out.weight.normal_()
+            opm.linear_out.bias.normal_()
+
+        m = torch.rand(
+            (consts.batch_size, consts.n_seq, consts.n_res, consts.c_m)
+        ).double()
+        mask = torch.randint(
+            0, 2, size=(consts.batch_size, consts.n_seq, consts.n_res)
+        )
+
+        # The autograd path
+        out_gt = opm(m, mask=mask, chunk_size=None)
+
+        with torch.no_grad():
+            for chunk_size in [None, 1, 3, consts.n_res]:
+                out = opm(m, mask=mask, chunk_size=chunk_size)
+                self.assertTrue(out.is_contiguous())
+                self.assertTrue(torch.allclose(out, out_gt))
+
     @compare_utils.skip_unless_alphafold_installed()
     def test_opm_compare(self):
         def run_opm(msa_act, msa_mask):
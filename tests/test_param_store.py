@@ -0,0 +1,105 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import torch
+import unittest
+
+from openfold.model.primitives import Linear, LayerNorm
+from openfold.utils.param_store import (
+    ALIGNMENT,
+    assign_params_,
+    import_param_store_,
+    load_param_store,
+    save_param_store,
+)
+
+
+def _make_model():
+    return torch.nn.Sequential(
+        Linear(7, 13),
+        LayerNorm(13),
+        Linear(13, 3, bias=False),
+    )
+
+
+class TestParamStore(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".store")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        model = _make_model()
+        for p in model.parameters():
+            torch.nn.init.normal_(p)
+
+        save_param_store(
+            model.state_dict(), self.path, metadata={"version": "model_1"}
+        )
+        self.assertEqual(os.path.getsize(self.path) % ALIGNMENT, 0)
+
+        state_dict, metadata = load_param_store(self.path)
+        self.assertEqual(metadata, {"version": "model_1"})
+        self.assertEqual(
+            list(state_dict.keys()), list(model.state_dict().keys())
+        )
+        for k, v in model.state_dict().items():
+            self.assertEqual(state_dict[k].dtype, v.dtype)
+            self.assertTrue(torch.equal(state_dict[k], v))
+
+    def test_import_param_store_(self):
+        model = _make_model()
+        for p in model.parameters():
+            torch.nn.init.normal_(p)
+        save_param_store(
+            model.state_dict(), self.path, metadata={"version": "model_1"}
+        )
+
+        model_2 = _make_model()
+        import_param_store_(model_2, self.path, version="model_1")
+
+        x = torch.rand(5, 7)
+        self.assertTrue(torch.equal(model(x), model_2(x)))
+
+        with self.assertRaises(ValueError):
+            import_param_store_(_make_model(), self.path, version="model_2")
+
+    def test_assign_params_without_copy(self):
+        model = _make_model()
+        state_dict = {
+            k: torch.rand(v.shape) for k, v in model.state_dict().items()
+        }
+
+        assign_params_(model, state_dict)
+        for k, v in model.state_dict().items():
+            self.assertEqual(v.data_ptr(), state_dict[k].data_ptr())
+
+        with self.assertRaises(KeyError):
+            assign_params_(model, {"0.weight": state_dict["0.weight"]})
+
+        # Parameters missing from the state_dict are kept
+        bias = model[0].bias.clone()
+        assign_params_(
+            model, {"0.weight": torch.zeros(13, 7)}, strict=False
+        )
+        self.assertTrue(torch.all(model[0].weight == 0))
+        self.assertTrue(torch.equal(model[0].bias, bias))
+
+
+if __name__ == "__main__":
+    unittest.main()
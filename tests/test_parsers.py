@@ -0,0 +1,159 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from openfold.data import parsers
+from openfold.data.data_pipeline import make_msa_features
+
+
+ALIGNMENT_DIR = os.path.join(
+    os.path.dirname(__file__), "test_data", "alignments"
+)
+
+A3M = """>query
+MKV-LA
+>hit_1 desc
+MKaaVL-bA
+>hit_2
+MK
+V-LA
+>hit_3
+-KVcccL-Ad
+>hit_1_again
+MKaVL-bA
+"""
+
+STOCKHOLM = """# STOCKHOLM 1.0
+#=GS hit_1    DE first hit
+#=GS hit_2    DE second hit
+
+query    MK-VL-A
+hit_1    MKAVLGA
+hit_2    M--V-GA
+
+query    C-
+hit_1    CC
+hit_2    -D
+//
+"""
+
+
+class TestParsers(unittest.TestCase):
+    def _assert_same(self, msa, deletion_matrix, msa_gt, deletion_matrix_gt):
+        self.assertEqual(msa.dtype, np.int8)
+        self.assertEqual(deletion_matrix.dtype, np.int16)
+        self.assertTrue(
+            np.array_equal(msa, parsers.sequences_to_ids(msa_gt))
+        )
+        self.assertTrue(
+            np.array_equal(deletion_matrix, np.array(deletion_matrix_gt))
+        )
+
+    def test_a3m(self):
+        msa, deletion_matrix = parsers.parse_a3m_arrays(A3M)
+        self._assert_same(msa, deletion_matrix, *parsers.parse_a3m(A3M))
+        self.assertEqual(deletion_matrix[1].tolist(), [0, 0, 2, 0, 0, 1])
+
+    def test_stockholm(self):
+        msa, deletion_matrix, names = parsers.parse_stockholm_arrays(
+            STOCKHOLM
+        )
+        msa_gt, deletion_matrix_gt, names_gt = parsers.parse_stockholm(
+            STOCKHOLM
+        )
+        self._assert_same(msa, deletion_matrix, msa_gt, deletion_matrix_gt)
+        self.assertEqual(names, names_gt)
+
+    def test_alignment_files(self):
+        for f in sorted(os.listdir(ALIGNMENT_DIR)):
+            path = os.path.join(ALIGNMENT_DIR, f)
+            ext = os.path.splitext(f)[-1]
+            with open(path, "rb") as fp:
+                contents = fp.read()
+            if(ext == ".a3m"):
+                arrays = parsers.parse_a3m_arrays(contents)
+                lists = parsers.parse_a3m(contents.decode())
+            elif(ext == ".sto"):
+                arrays = parsers.parse_stockholm_arrays(contents)[:2]
+                lists = parsers.parse_stockholm(contents.decode())[:2]
+            else:
+                continue
+
+            self._assert_same(*arrays, *lists)
+
+    def test_convert_stockholm_to_a3m(self):
+        a3m = parsers.convert_stockholm_to_a3m(STOCKHOLM)
+        self.assertEqual(
+            a3m,
+            ">query \nMKVLAC\n"
+            ">hit_1 first hit\nMKaVLgACc\n"
+            ">hit_2 second hit\nM-V-gA-d\n"
+        )
+
+        a3m = parsers.convert_stockholm_to_a3m(STOCKHOLM, max_sequences=2)
+        self.assertEqual(len(parsers.parse_fasta(a3m)[0]), 2)
+
+    def test_convert_stockholm_file_to_a3m(self):
+        sto_path = os.path.join(ALIGNMENT_DIR, "uniref90_hits.sto")
+        with open(sto_path) as fp:
+            sto = fp.read()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            a3m_path = os.path.join(tmp_dir, "uniref90_hits.a3m")
+            for max_sequences in [None, 3]:
+                parsers.convert_stockholm_file_to_a3m(
+                    sto_path, a3m_path, max_sequences=max_sequences
+                )
+                with open(a3m_path) as fp:
+                    a3m = fp.read()
+
+                self.assertEqual(
+                    a3m, parsers.convert_stockholm_to_a3m(sto, max_sequences)
+                )
+                self.assertEqual(
+                    parsers.parse_a3m(a3m),
+                    parsers.parse_stockholm(sto, max_sequences)[:2],
+                )
+
+    def test_unknown_residue(self):
+        with self.assertRaises(ValueError):
+            parsers.parse_a3m_arrays(">query\nMK?\n")
+
+    def test_make_msa_features(self):
+        msa, deletion_matrix = parsers.parse_a3m(A3M)
+        msa_arrays, deletion_matrix_arrays = parsers.parse_a3m_arrays(A3M)
+
+        features_gt = make_msa_features([msa], [deletion_matrix])
+        features = make_msa_features(
+            [msa_arrays, msa_arrays],
+            [deletion_matrix_arrays, deletion_matrix_arrays],
+        )
+
+        self.assertEqual(features.keys(), features_gt.keys())
+        for k, v in features_gt.items():
+            self.assertEqual(features[k].dtype, v.dtype)
+            self.assertTrue(np.array_equal(features[k], v), k)
+
+        # hit_2 repeats the query, and hit_1_again only differs from hit_1
+        # in its deletions
+        self.assertEqual(len(features["msa"]), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
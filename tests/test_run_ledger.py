@@ -0,0 +1,84 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from openfold.data.run_ledger import (
+    STATE_FILE,
+    STATE_OK,
+    STATE_TIMEOUT,
+    RunLedger,
+    is_completed,
+    load_state,
+    merge_ledgers,
+)
+
+
+class TestRunLedger(unittest.TestCase):
+    def setUp(self):
+        self.ledger_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.ledger_dir)
+
+    def test_merge(self):
+        ledger_0 = RunLedger(self.ledger_dir, 0)
+        ledger_1 = RunLedger(self.ledger_dir, 1)
+        ledger_0.record("A_model_1", STATE_TIMEOUT, 10., seq_len=100)
+        ledger_1.record("B_model_1", STATE_OK, 5., seq_len=50)
+        ledger_0.close()
+        ledger_1.close()
+
+        state = merge_ledgers(self.ledger_dir)
+        self.assertEqual(
+            state, load_state(os.path.join(self.ledger_dir, STATE_FILE))
+        )
+        self.assertFalse(is_completed(state, "A_model_1"))
+        self.assertTrue(is_completed(state, "B_model_1"))
+        self.assertFalse(is_completed(state, "C_model_1"))
+        self.assertEqual(state["B_model_1"]["seq_len"], 50)
+
+        # Merging again doesn't count the same attempts twice
+        state = merge_ledgers(self.ledger_dir, remove=True)
+        self.assertEqual(state["A_model_1"]["attempts"], 1)
+        self.assertEqual(
+            glob.glob(os.path.join(self.ledger_dir, "rank_*.jsonl")), []
+        )
+
+        # A retry in the next job
+        ledger_0 = RunLedger(self.ledger_dir, 0)
+        ledger_0.record("A_model_1", STATE_OK, 20.)
+        ledger_0.close()
+
+        state = merge_ledgers(self.ledger_dir)
+        self.assertTrue(is_completed(state, "A_model_1"))
+        self.assertEqual(state["A_model_1"]["attempts"], 2)
+
+    def test_broken_record(self):
+        ledger = RunLedger(self.ledger_dir, 0)
+        ledger.record("A_model_1", STATE_OK, 1.)
+        ledger.close()
+        with open(ledger.path, "a") as fp:
+            fp.write('{"key": "B_mod')
+
+        state = merge_ledgers(self.ledger_dir)
+        self.assertEqual(list(state.keys()), ["A_model_1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from scripts.scheduler import SharedWorkQueue, partition_lpt
+
+
+class TestPartitionLpt(unittest.TestCase):
+    def test_partition(self):
+        costs = [5., 1., 4., 2., 3., 3.]
+        parts, loads = partition_lpt(costs, 2)
+
+        self.assertEqual(sorted(i for p in parts for i in p), list(range(6)))
+        for part, load in zip(parts, loads):
+            self.assertEqual(sum(costs[i] for i in part), load)
+            # Longest first
+            self.assertEqual(
+                [costs[i] for i in part],
+                sorted((costs[i] for i in part), reverse=True),
+            )
+        self.assertEqual(sorted(loads), [9., 9.])
+
+        # The same on every rank
+        self.assertEqual(partition_lpt(costs, 2), (parts, loads))
+
+    def test_more_parts_than_items(self):
+        parts, loads = partition_lpt([2., 1.], 4)
+        self.assertEqual(parts, [[0], [1], [], []])
+        self.assertEqual(loads, [2., 1., 0., 0.])
+
+
+class TestSharedWorkQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "work_queue")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_claim(self):
+        queues = [SharedWorkQueue(self.path, 5, job_id="1") for _ in range(2)]
+        iters = [iter(q) for q in queues]
+
+        # Each item is taken once, in order, by whichever rank asks first
+        taken = [next(iters[0]), next(iters[1]), next(iters[1])]
+        taken += list(iters[0])
+        self.assertEqual(taken, [0, 1, 2, 3, 4])
+
+        # Exhausted for every rank
+        self.assertEqual(list(iters[1]), [])
+        self.assertEqual(list(SharedWorkQueue(self.path, 5, job_id="1")), [])
+
+    def test_stale(self):
+        list(SharedWorkQueue(self.path, 5, job_id="1"))
+
+        with self.assertRaises(RuntimeError):
+            list(SharedWorkQueue(self.path, 5, job_id="2"))
+        with self.assertRaises(RuntimeError):
+            list(SharedWorkQueue(self.path, 3, job_id="1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
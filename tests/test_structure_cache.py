@@ -0,0 +1,123 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from openfold.data import mmcif_parsing
+from openfold.data.structure_cache import (
+    StructureCache,
+    parsing_result_nbytes,
+)
+from openfold.data.structure_store import (
+    StructureStore,
+    build_structure_store,
+)
+
+
+MMCIF_DIR = os.path.join(os.path.dirname(__file__), "test_data", "mmcifs")
+
+
+class TestStructureCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        store_dir = os.path.join(cls.tmp_dir, "store")
+        build_structure_store(MMCIF_DIR, store_dir)
+        cls.store = StructureStore(store_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def _load(self, pdb_id):
+        self.loaded.append(pdb_id)
+        return self.store.parsing_result(pdb_id)
+
+    def setUp(self):
+        self.loaded = []
+
+    def test_lru(self):
+        pdb_ids = self.store.names()[:3]
+        sizes = [
+            parsing_result_nbytes(self.store.parsing_result(p))
+            for p in pdb_ids
+        ]
+
+        # Room for the first one and either of the others
+        cache = StructureCache(sizes[0] + max(sizes[1:]))
+        for pdb_id in [pdb_ids[0], pdb_ids[1], pdb_ids[0], pdb_ids[2]]:
+            cache.get(pdb_id, self._load)
+
+        # The second one was the least recently used
+        cache.get(pdb_ids[0], self._load)
+        cache.get(pdb_ids[1], self._load)
+        self.assertEqual(
+            self.loaded, [pdb_ids[0], pdb_ids[1], pdb_ids[2], pdb_ids[1]]
+        )
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 4)
+        self.assertEqual(stats["bytes_saved"], 2 * sizes[0])
+        self.assertLessEqual(stats["bytes"], cache.max_bytes)
+
+        # Workers which aren't forked start empty
+        cache = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_shared(self):
+        shared_dir = os.path.join(self.tmp_dir, "shared")
+        pdb_id = self.store.names()[0]
+
+        caches = [
+            StructureCache(1 << 30, shared_dir=shared_dir) for _ in range(2)
+        ]
+        results = [cache.get(pdb_id, self._load) for cache in caches]
+        self.assertEqual(self.loaded, [pdb_id])
+        self.assertEqual(caches[1].stats()["shared_hits"], 1)
+
+        gt, result = [r.mmcif_object for r in results]
+        self.assertEqual(result.header, gt.header)
+        self.assertEqual(result.chain_to_seqres, gt.chain_to_seqres)
+        for chain_id in gt.chain_to_seqres:
+            for a, a_gt in zip(
+                mmcif_parsing.get_atom_coords(result, chain_id),
+                mmcif_parsing.get_atom_coords(gt, chain_id),
+            ):
+                self.assertTrue(np.array_equal(a, a_gt))
+
+    def test_shared_eviction(self):
+        shared_dir = os.path.join(self.tmp_dir, "shared_eviction")
+        pdb_ids = self.store.names()
+
+        cache = StructureCache(1 << 30, shared_dir=shared_dir)
+        scans = []
+        scan = cache._shared._scan
+        cache._shared._scan = lambda: scans.append(None) or scan()
+        for pdb_id in pdb_ids:
+            cache.get(pdb_id, self._load)
+
+        # Misses don't list the shared directory below max_bytes
+        self.assertEqual(cache.stats()["misses"], len(pdb_ids))
+        self.assertEqual(len(scans), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# Copyright 2023 RIKEN & Fujitsu Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from openfold.data import mmcif_parsing, parsers
+from openfold.data.structure_store import (
+    StructureStore,
+    build_structure_store,
+    is_structure_store,
+    list_pdb_ids,
+)
+from openfold.data.templates import TemplateHitFeaturizer
+
+
+MMCIF_DIR = os.path.join(os.path.dirname(__file__), "test_data", "mmcifs")
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+class TestStructureStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.store_dir = os.path.join(cls.tmp_dir, "store")
+        build_structure_store(MMCIF_DIR, cls.store_dir, num_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_parsing_result(self):
+        self.assertTrue(is_structure_store(self.store_dir))
+        store = StructureStore(self.store_dir)
+        self.assertEqual(store.names(), list_pdb_ids(MMCIF_DIR))
+
+        for pdb_id in store.names():
+            with open(os.path.join(MMCIF_DIR, pdb_id + ".cif"), "r") as fp:
+                gt = mmcif_parsing.parse(
+                    file_id=pdb_id, mmcif_string=fp.read()
+                ).mmcif_object
+            mmcif_object = store.parsing_result(pdb_id).mmcif_object
+
+            self.assertEqual(mmcif_object.header, gt.header)
+            self.assertEqual(mmcif_object.chain_to_seqres, gt.chain_to_seqres)
+            for chain_id in gt.chain_to_seqres:
+                coords = mmcif_parsing.get_atom_coords(mmcif_object, chain_id)
+                # Zero-centered when the store is built
+                coords_gt = mmcif_parsing.get_atom_coords(
+                    gt, chain_id, _zero_center_positions=True
+                )
+                for a, a_gt in zip(coords, coords_gt):
+                    self.assertEqual(a.dtype, a_gt.dtype)
+                    self.assertTrue(np.array_equal(a, a_gt))
+
+    def test_template_features(self):
+        with open(os.path.join(TEST_DATA_DIR, "short.fasta"), "r") as fp:
+            query_sequence = parsers.parse_fasta(fp.read())[0][0]
+        hhr_path = os.path.join(TEST_DATA_DIR, "alignments", "pdb70_hits.hhr")
+        with open(hhr_path, "r") as fp:
+            hits = parsers.parse_hhr(fp.read())
+
+        results = []
+        for mmcif_dir in [MMCIF_DIR, self.store_dir]:
+            template_featurizer = TemplateHitFeaturizer(
+                mmcif_dir=mmcif_dir,
+                max_template_date="2021-12-20",
+                max_hits=20,
+                kalign_binary_path=shutil.which("kalign"),
+            )
+            results.append(
+                template_featurizer.get_templates(
+                    query_sequence=query_sequence,
+                    query_pdb_code=None,
+                    query_release_date=None,
+                    hits=hits,
+                )
+            )
+
+        features_gt, features = [r.features for r in results]
+        self.assertEqual(features.keys(), features_gt.keys())
+        for k, v in features_gt.items():
+            self.assertEqual(features[k].dtype, v.dtype)
+            self.assertTrue(np.array_equal(features[k], v), k)
+
+
+if __name__ == "__main__":
+    unittest.main()
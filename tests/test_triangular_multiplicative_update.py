@@ -140,5 +140,57 @@ class TestTriangularMultiplicativeUpdate(unittest.TestCase):
     def test_tri_mul_in_inference(self):
         self._tri_mul_inplace(incoming=True)
 
+    def _tri_mul_tiled(self, incoming=False):
+        c_z = 16
+        c = 11
+        n_res = consts.n_res
+
+        tm = (
+            TriangleMultiplicationIncoming(c_z, c)
+            if incoming
+            else TriangleMultiplicationOutgoing(c_z, c)
+        ).double()
+        with torch.no_grad():
+            for p in tm.parameters():
+                p.normal_()
+
+        x = torch.rand((consts.batch_size, n_res, n_res, c_z)).double()
+        mask = torch.randint(0, 2, size=(consts.batch_size, n_res, n_res))
+
+        with torch.no_grad():
+            out_stock = tm(x, mask)
+            for tile_size in [None, 1, 4]:
+                out = tm(
+                    x.clone(),
+                    mask,
+                    inplace_safe=True,
+                    _add_with_inplace=False,
+                    _inplace_chunk_size=tile_size,
+                )
+                self.assertTrue(torch.allclose(out, out_stock))
+
+                out = tm(
+                    x.clone(),
+                    mask,
+                    inplace_safe=True,
+                    _add_with_inplace=True,
+                    _inplace_chunk_size=tile_size,
+                )
+                self.assertTrue(torch.allclose(out, x + out_stock))
+
+            # The fused projections follow updates of the parameters
+            for p in tm.parameters():
+                p.normal_()
+
+            out_stock = tm(x, mask)
+            out = tm(x.clone(), mask, inplace_safe=True)
+            self.assertTrue(torch.allclose(out, out_stock))
+
+    def test_tri_mul_out_tiled(self):
+        self._tri_mul_tiled()
+
+    def test_tri_mul_in_tiled(self):
+        self._tri_mul_tiled(incoming=True)
+
 if __name__ == "__main__":
     unittest.main()
@@ -14,6 +14,8 @@
 
 import math
 import numpy as np
+import os
+import tempfile
 import torch
 import unittest
 
@@ -23,6 +25,7 @@ from openfold.utils.rigid_utils import (
     quat_to_rot,
     rot_to_quat,
 )
+from openfold.utils.chunk_utils import ChunkedModule, ChunkPlanTuner
 from openfold.utils.tensor_utils import chunk_layer, _chunk_slice
 import tests.compare_utils as compare_utils
 from tests.config import consts
@@ -221,6 +224,43 @@ class TestUtils(unittest.TestCase):
 
                 self.assertTrue(torch.all(chunked == chunked_flattened))
 
+    def test_chunk_plan_tuner(self):
+        calls = []
+        modules = {
+            "small": ChunkedModule(calls.append, 16, 1),
+            "large": ChunkedModule(calls.append, 16, 1024),
+        }
+        # Fits 4 chunks of the large module
+        memory_budget = 4096 / 1024**3
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            plan_path = os.path.join(tmp_dir, "chunk_plans.json")
+            tuner = ChunkPlanTuner("test", plan_path, memory_budget)
+            plan = tuner.tune_chunk_plan(
+                modules, 100, 200, torch.float32, min_chunk_size=4
+            )
+            self.assertEqual(set(plan.keys()), {"small", "large"})
+            self.assertTrue(4 <= plan["small"] <= 16)
+            self.assertEqual(plan["large"], 4)
+            self.assertTrue(len(calls) > 0)
+
+            # Loaded by a later run for inputs in the same bucket
+            calls.clear()
+            tuner = ChunkPlanTuner("test", plan_path, memory_budget)
+            self.assertEqual(
+                tuner.tune_chunk_plan(
+                    modules, 120, 250, torch.float32, min_chunk_size=4
+                ),
+                plan,
+            )
+            self.assertEqual(calls, [])
+
+            # But tuned again for another dtype
+            tuner.tune_chunk_plan(
+                modules, 120, 250, torch.bfloat16, min_chunk_size=4
+            )
+            self.assertTrue(len(calls) > 0)
+
     @compare_utils.skip_unless_alphafold_installed()
     def test_pre_compose_compare(self):
         quat = np.random.rand(20, 4)